@@ -1,19 +1,147 @@
 import os
 import sys
+import shutil
+import weakref
 import re
-from datetime import datetime
-from statistics import mean
+import heapq
+import bisect
+import json
+import tempfile
+import struct
+import time
+import zlib
+import math
+import hashlib
+import sqlite3
+import subprocess
+import threading
+import socketserver
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from array import array
+from datetime import datetime, timedelta
 import netaddr
-from collections import namedtuple
+from collections import namedtuple, deque, OrderedDict
 
 NowTime = datetime.now()
 server_status = []
 
+# アドレス文字列の共有テーブル
+# -- 同じ "10.20.30.1/16" を行数分保持しないように、1つの文字列を使いまわす
+address_table = {}
+
+def intern_address(address : str) -> str:
+    """アドレス文字列を共有テーブルに登録して、登録済みの文字列を返す
+
+    Args:
+        address (str): アドレス ex.) "10.20.30.1/16"
+    Returns:
+        str: 共有テーブル上の同じ内容の文字列
+    """
+    return address_table.setdefault(address, address)
+
+
+# 故障・過負荷・スイッチ故障の期間
+# -- kind : "broken" / "overload" / "switch_broken"
+# -- address : サーバのアドレス (スイッチの場合はネットワークアドレス)
+# -- end : 継続中の場合はNone
+Interval = namedtuple("Interval", ["kind", "address", "start", "end"])
+
+def format_interval(interval : Interval) -> str:
+    """Intervalを出力用の文字列にする
+
+    Args:
+        interval (Interval): 期間
+    Returns:
+        str: "アドレス,開始,終了" (継続中の終了は "----/--/-- --:--:--")
+    """
+    if interval.end is None:
+        return f"{interval.address},{interval.start},----/--/-- --:--:--"
+    return f"{interval.address},{interval.start},{interval.end}"
+
+
+# ネットワークアドレスの変換結果
+network_table = {}
+
+def network_of(address : str) -> str:
+    """サーバのアドレスから、同一ネットワークの判定に使うネットワークアドレスを返す
+
+    Args:
+        address (str): アドレス ex.) "10.20.30.1/16"
+    Returns:
+        str: ネットワークアドレス ex.) "10.20.0.0"
+    """
+    network = network_table.get(address)
+    if network is None:
+        network = network_table[address] = f"{netaddr.IPNetwork(address).network}"
+    return network
+
+
+# 応答なしとみなす状態の既定値 (分類名, 3列目の文字列) の組
+DEFAULT_FAILURE_CODES = (("broken", "-"),)
+
+# 判定条件
+# -- GetInfoなどのキーワード引数と同じ名前。GetInfoの結果のLRUのキーにも使う
+class DetectOptions(namedtuple("DetectOptions", [
+    "min_access_count",         # 故障 : 最低の連続アクセス回数 N
+    "overload_average_count",   # 過負荷 : 平均化する回数 m
+    "overload_limit_time_ms",   # 過負荷 : 過負荷とみなす応答時間 t
+    "overload_window_sec",      # 過負荷 : 0より大きい場合は回数ではなく直近W秒間で判定する
+    "overload_window_mode",     # 過負荷 : 時間窓の集計方法 "average" / "max"
+    "storm_bin_sec",            # 同時多発故障 : 集計する時間幅[秒] (0 : 判定しない)
+    "storm_ratio",              # 同時多発故障 : 故障中のネットワークの割合の閾値
+    "switch_threshold",         # スイッチ故障 : ネットワーク内で故障中のサーバの割合の閾値
+    "switch_member_timeout_sec",# スイッチ故障 : 最後に観測してからこの秒数でネットワークから外す (0 : 外さない)
+    "availability",             # 稼働率 : Trueの場合は故障時間・MTBF・MTTR・稼働率を集計する
+    "anomaly_alpha",            # 異常検知 : 指数移動平均の重み α (0 : 判定しない)
+    "anomaly_k",                # 異常検知 : 平均 + k × 標準偏差 を超えた応答時間を異常とする
+    "broken_close_count",       # 故障 : 故障期間を閉じる連続した応答の回数
+    "broken_merge_gap_sec",     # 故障 : この秒数未満の間隔の故障期間をつなげる (0 : つなげない)
+    "top_k",                    # 上位K件 : 故障回数・故障時間・平均応答時間・応答なしの回数の上位K件を出す (0 : 出さない)
+    "failure_codes",            # 故障 : 応答なしとみなす (分類名, 3列目の文字列) の組 (既定以外の場合は分類毎の回数を出す)
+    "coverage_bucket_sec",      # カバレッジ : 時間帯毎のログを出したサーバ・応答なしがあったサーバの数を出す時間帯の長さ[秒] (0 : 出さない)
+], defaults=[0, 10, 180000, 0, "average", 0, 0.5, 1.0, 0, False, 0.0, 3.0, 1, 0, 0, DEFAULT_FAILURE_CODES, 0])):
+    """判定条件 (failure_codesはJSONなどのリストでも受け取り、LRUのキーにできるようにタプルのタプルにする)
+    """
+    __slots__ = ()
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls, *args, **kwargs)
+        codes = tuple(tuple(x) for x in self.failure_codes)
+        if codes != self.failure_codes:
+            self = self._replace(failure_codes=codes)
+        return self
+
+
+EPOCH = datetime(1970, 1, 1)
+
+def datetime_to_seconds(dt : datetime) -> int:
+    """datetimeを1970/1/1からの秒数にする (ログの時刻はタイムゾーンなしで扱う)
+    """
+    return (dt - EPOCH) // timedelta(seconds=1)
+
+def seconds_to_datetime(seconds : int) -> datetime:
+    """datetime_to_secondsの逆変換
+    """
+    return EPOCH + timedelta(seconds=seconds)
+
+
 class LogLine:
-    address = "0.0.0.0",
-    break_datetime = datetime.min
-    state = ""
-    response_time = -1
+    """監視ログの1行分のデータ
+
+    Description:
+        ログの行数分作られるので、__slots__でインスタンス毎の辞書を持たないようにしている。
+    """
+    __slots__ = ("address", "datetime", "state", "response_time")
+
+    def __init__(self, address : str = "0.0.0.0", log_datetime : datetime = datetime.min, state : str = "", response_time : int = -1):
+        self.address = address
+        self.datetime = log_datetime
+        self.state = state
+        self.response_time = response_time
 
     def Parse(self, line : str):
         """
@@ -31,15 +159,15 @@ class LogLine:
                 status : 状態                   # "" : OK , "-" :break
             }
         """
-        line = line.rstrip()
-        splt = line.split(',')            
-        self.address = splt[1]
+        splt = line.rstrip().split(',')
+        self.address = intern_address(splt[1])
         self.datetime =  datetime.strptime(splt[0], '%Y%m%d%H%M%S')
 
         if splt[2].isdecimal():
             self.response_time = int(splt[2])
             self.state = ""
         else:
+            self.response_time = -1
             self.state = splt[2]  # ischara
 
         return self
@@ -54,307 +182,3980 @@ class LogLine:
         return str(js)
     
 
-class ServerLogParser:
-    """_summary_
+class StatusTable:
+    """3列目の状態の文字列から、応答なしの分類の番号を引く表
+
+    Description:
+        0 は応答なしではない (応答時間、または、分類にない状態)、1以降は categories の順の分類。
+        表は作る時に1回だけ組み立てるので、分類や状態がいくつあっても1行あたりdictを1回引くだけで済む。
+    """
+
+    def __init__(self, failure_codes = DEFAULT_FAILURE_CODES):
+        """
+        Args:
+            failure_codes (optional): (分類名, 状態の文字列) の組の並び. Defaults to DEFAULT_FAILURE_CODES.
+        """
+        self.categories = []
+        self.lookup = {}
+        for category, code in failure_codes:
+            if category not in self.categories:
+                self.categories.append(category)
+            if code in self.lookup:
+                raise ValueError(f"failure code {code} is assigned twice")
+            self.lookup[code] = self.categories.index(category) + 1
+        self.is_default = tuple(tuple(x) for x in failure_codes) == DEFAULT_FAILURE_CODES
+
+    def Classify(self, state : str) -> int:
+        """状態の分類の番号を返す (0 : 応答なしではない)
+        """
+        return self.lookup.get(state, 0)
+
+
+status_tables = {}
 
+def status_table(failure_codes = DEFAULT_FAILURE_CODES) -> StatusTable:
+    """同じ設定のStatusTableを使いまわす (JSONを通したリストの設定でもよい)
+    """
+    try:
+        # DetectOptionsのfailure_codesはタプルのタプルなので、そのまま引ける
+        return status_tables[failure_codes]
+    except (KeyError, TypeError):
+        pass
+    key = tuple(tuple(x) for x in failure_codes)
+    table = status_tables.get(key)
+    if table is None:
+        table = status_tables[key] = StatusTable(key)
+    return table
+
+def parse_failure_codes(text : str) -> tuple:
+    """ "分類=状態|状態,分類=状態" の文字列を、DetectOptions.failure_codes の形にする
+
+    Args:
+        text (str): ex.) "broken=-,timeout=T|TO,refused=R"
     Returns:
+        tuple: ex.) (("broken", "-"), ("timeout", "T"), ("timeout", "TO"), ("refused", "R"))
     """
-    broken_codes = ["-"]
-    ServerLogs = {}
-    Return_data = {
-        "broken":[],
-        "overload":[]
-    }
+    pairs = []
+    for item in text.split(','):
+        category, _, codes = item.partition('=')
+        if category == "" or codes == "":
+            raise ValueError(f"invalid failure codes : {item}")
+        pairs.extend((category, code) for code in codes.split('|'))
+    return tuple(pairs)
 
-    def __init__(self, filename : str = ""):
-        if filename != "":
-            self.ParseLogFile(filename)
-        return
 
-    def ParseLogFile(self, filename : str):
+def open_log(filename : str):
+    """ログファイルをテキストで開く
+
+    Description:
+        UTF-8として読めないbyteはsurrogateescapeで文字にして残すので、読み込みは止まらない。
+        その行はLogReaderの検査で変換できないので、その行だけが隔離される。
+    """
+    return open(filename, "r", encoding="utf-8", errors="surrogateescape")
+
+
+# 3列目の文字列 → (状態, 応答時間) の共有テーブル
+# -- 応答時間の種類が多い場合に備えて、登録する数に上限を設ける
+response_table = {}
+RESPONSE_TABLE_SIZE = 1 << 16
+
+class LogReader:
+    """ログの行をLogLineに変換する。不正な行は処理を止めずに隔離する
+
+    Description:
+        通常の行は、行毎の検査をほとんどしない高速な処理で変換する。
+        (時刻は直前の行と違う時だけ、アドレスは初めて出てきた時だけnetaddrで検査する)
+        3列目は文字列から (状態, 応答時間) を引く表で変換し、初めて出てきた値だけを検査する。
+        変換できなかった行だけを低速な処理に回し、空行は読み飛ばし、
+        それ以外は行番号を付けて隔離ファイルに書き出して、countersで件数を数える。
+    """
+
+    def __init__(self, quarantine_file : str = None):
         """
-        Description:
-            ログの中から、故障したことがあるサーバを特定する。
-            得られる故障期間を出力するが、回復しない場合は現在までの時間を算出する。
-            重複がある場合は、
         Args:
-            対象にするログファイルのパス
+            quarantine_file (str, optional): 不正な行の書き出し先。Noneの場合は件数だけ数える. Defaults to None.
+        """
+        self.quarantine_file = quarantine_file
+        self.counters = {"lines": 0, "parsed": 0, "blank": 0, "quarantined": 0}
+        self.__fout = None
+
+    def Iter(self, lines, raw : bool = False, numbered : bool = False):
+        """ログの行を変換しながら順に返す
+
+        Args:
+            lines : ログの行のイテレータ (numberedの場合は (行番号, 行) のイテレータ)
+            raw (bool, optional): Trueの場合はLogLineではなく、検査済みの行(改行なし)を返す. Defaults to False.
+            numbered (bool, optional): Trueの場合は隔離する行に、行と一緒に渡された行番号を付ける. Defaults to False.
         Returns:
-            {
-                "サーバアドレス" : [
-                        {
-                            <LogLine>
-                        },
-                        {
-                            # 繰り返し 
-                        }
-                    ],
-                ... # 繰り返し
-            }
+            LogLine、または、行の文字列のジェネレータ
+        """
+        counters = self.counters
+        table = address_table
+        responses = response_table
+        last_timestamp = None
+        log_datetime = None
+        line_no = 0
+        try:
+            # 例外を拾うのは1行の変換だけにする (ファイルの読み込みの例外はそのまま上げる)
+            for line in lines:
+                line_no += 1
+                if numbered:
+                    number, line = line
+                try:
+                    text = line.rstrip()
+                    timestamp, addr, response = text.split(',')
+                    if timestamp != last_timestamp:
+                        if len(timestamp) != 14:
+                            raise ValueError(f"invalid timestamp : {timestamp}")
+                        log_datetime = datetime.strptime(timestamp, '%Y%m%d%H%M%S')
+                        last_timestamp = timestamp
+                    address = table.get(addr)
+                    if address is None:
+                        address = self.__NewAddress(addr)
+                    value = responses.get(response)
+                    if value is None:
+                        value = self.__NewResponse(response)
+                except (ValueError, netaddr.AddrFormatError) as e:
+                    # 低速な処理 : 変換できなかった行だけを処理する
+                    self.__Reject(number if numbered else line_no, line, e)
+                    continue
+                if raw:
+                    yield text
+                else:
+                    yield LogLine(address, log_datetime, value[0], value[1])
+        finally:
+            counters["lines"] = line_no
+            counters["parsed"] = line_no - counters["blank"] - counters["quarantined"]
 
+    def Close(self):
+        """隔離ファイルを閉じる
         """
-        # clear
-        self.ServerLogs = {}
+        if self.__fout is not None:
+            self.__fout.close()
+            self.__fout = None
 
-        # 上から読んでエラーを見つけたらserver_statusに突っ込む
-        with open(filename,"r",encoding="utf-8") as fin:
-            for line in fin:
-                line = line.rstrip()
-                self.__LogAppend(line)
-        
-        # アドレス毎に時間順にログをソートする
-        for addr in self.ServerLogs:
-            self.ServerLogs[addr].sort(key=lambda x: x.datetime)
-        
-        return iter(self.ServerLogs)
+    @staticmethod
+    def __NewResponse(response : str) -> tuple:
+        """初めて出てきた3列目を検査して、(状態, 応答時間) を返す (表が大きくなりすぎない間は登録する)
+        """
+        if response.isdecimal():
+            value = ("", int(response))
+        elif response:
+            response.encode("utf-8")    # UTF-8でないbyte (surrogateescape) の場合はUnicodeEncodeError
+            value = (sys.intern(response), -1)
+        else:
+            raise ValueError("empty response")
+        if len(response_table) < RESPONSE_TABLE_SIZE:
+            response_table[response] = value
+        return value
+
+    @staticmethod
+    def __NewAddress(addr : str) -> str:
+        """初めて出てきたアドレスを検査して、共有テーブルに登録する
+        """
+        network_of(addr)    # 不正なアドレスの場合はAddrFormatError
+        return intern_address(addr)
+
+    def __Reject(self, line_no : int, line : str, error : Exception):
+        """変換できなかった行を、空行なら読み飛ばし、それ以外は隔離する
+        """
+        if line.strip() == "":
+            self.counters["blank"] += 1
+            return
+        self.counters["quarantined"] += 1
+        if self.quarantine_file is None:
+            return
+        if self.__fout is None:
+            # UTF-8でないbyteも元のまま書き出す
+            self.__fout = open(self.quarantine_file, "w", encoding="utf-8", errors="surrogateescape")
+        self.__fout.write(f"{line_no}\t{error}\t{line.rstrip()}\n")
+
+
+def encode_varint(value : int, out : bytearray):
+    """0以上の整数を7bitずつ(下位から、続きがある場合は最上位bitを1)outに追加する
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def decode_varint(buf : bytes, pos : int):
+    """encode_varintの逆変換
+
+    Returns:
+        (int, int): 値と、次の位置
+    """
+    value = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return value, pos
+        shift += 7
+
+def zigzag(value : int) -> int:
+    """符号付きの整数を、絶対値が小さいほど小さい0以上の整数にする (0, -1, 1, -2 ... → 0, 1, 2, 3 ...)
+    """
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+def unzigzag(value : int) -> int:
+    """zigzagの逆変換
+    """
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+# ログのアーカイブ形式
+# -- 先頭にARCHIVE_MAGIC、続いてブロックを並べる
+# -- ブロック = ヘッダ(ARCHIVE_BLOCK) + 辞書 + レコード
+#    ヘッダ : 辞書のbyte数, レコードのbyte数, レコード数, 最小時刻[秒], 最大時刻[秒]
+#    辞書 : このブロックで初めて出てきたアドレスと状態 (件数, (長さ, UTF-8)...) × 2
+#    レコード : アドレス番号, 前のレコードとの時刻の差(zigzag), 値 (応答時間 × 2、または、状態番号 × 2 + 1) をvarintで並べる
+ARCHIVE_MAGIC = b"SLOGARC1"
+ARCHIVE_BLOCK = struct.Struct("<IIIqq")
+
+def is_archive(filename : str) -> bool:
+    """ファイルがアーカイブ形式かどうかを先頭のbyte列で判定する
+    """
+    with open(filename, "rb") as fin:
+        return fin.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
 
-    def GetInfo(self, min_access_count : int = 0, overload_average_count : int = 10, overload_limit_time_ms : int = 180000):
-        """サーバー毎にログをパースして、応答がないipに関する情報を返す
 
+class ArchiveWriter:
+    """LogLineをアーカイブ形式で書き出す
+
+    Description:
+        アドレスと状態("-"など)は番号にし、時刻は前の行との差、応答時間はvarintで書くので、
+        1行あたり数byteになる。block_records行ごとに時刻の範囲をヘッダに書き、読む時に範囲外のブロックを飛ばせるようにする。
+    """
+
+    def __init__(self, filename : str, block_records : int = 4096):
+        """
         Args:
-            min_access_count (int, optional): 最低の連続アクセス回数. Defaults to 0.
-            overload_average_count (int, optional): _description_. Defaults to 10.
-            overload_time_ms (int, optional): _description_. Defaults to 180000.
+            filename (str): 出力先
+            block_records (int, optional): 1ブロックの行数. Defaults to 4096.
+        """
+        self.block_records = block_records
+        self.fout = open(filename, "wb")
+        self.fout.write(ARCHIVE_MAGIC)
+        self.addresses = {}
+        self.states = {}
+        self.__ResetBlock()
 
-        Returns:
-            _type_: 故障、または、
+    def Add(self, log : LogLine):
+        """1行追加する
+        """
+        if log.datetime is not self.last_datetime:
+            self.last_datetime = log.datetime
+            self.datetime_sec = datetime_to_seconds(log.datetime)
+        sec = self.datetime_sec
+
+        index = self.addresses.get(log.address)
+        if index is None:
+            index = self.addresses[log.address] = len(self.addresses)
+            self.new_addresses.append(log.address)
+        if log.state:
+            state = self.states.get(log.state)
+            if state is None:
+                state = self.states[log.state] = len(self.states)
+                self.new_states.append(log.state)
+            value = (state << 1) | 1
+        else:
+            value = log.response_time << 1
+
+        payload = self.payload
+        encode_varint(index, payload)
+        encode_varint(zigzag(sec - self.last_sec), payload)
+        encode_varint(value, payload)
+        self.last_sec = sec
+        if self.count == 0 or sec < self.min_sec:
+            self.min_sec = sec
+        if self.count == 0 or sec > self.max_sec:
+            self.max_sec = sec
+        self.count += 1
+        if self.count >= self.block_records:
+            self.__Flush()
 
+    def Close(self):
+        """残りのブロックを書いて閉じる
         """
-        self.Return_data = {
-            "broken":[],
-            "overload":[],
-            "switch_broken":[]
-        }
+        if self.fout is None:
+            return
+        self.__Flush()
+        self.fout.close()
+        self.fout = None
 
-        # 各アドレス事の検査
-        for addr in self.ServerLogs:
-            server_logs = self.ServerLogs[addr]
+    def __ResetBlock(self):
+        self.payload = bytearray()
+        self.new_addresses = []
+        self.new_states = []
+        self.count = 0
+        self.min_sec = 0
+        self.max_sec = 0
+        self.last_sec = 0
+        self.last_datetime = None
 
-            # 故障チェック
-            ret = self.__checkBroken(server_log=server_logs, min_access_count=min_access_count)
-            self.Return_data["broken"].extend(ret)
+    def __Flush(self):
+        if self.count == 0:
+            return
+        dictionary = bytearray()
+        for names in (self.new_addresses, self.new_states):
+            encode_varint(len(names), dictionary)
+            for name in names:
+                data = name.encode("utf-8")
+                encode_varint(len(data), dictionary)
+                dictionary.extend(data)
+        self.fout.write(ARCHIVE_BLOCK.pack(len(dictionary), len(self.payload), self.count, self.min_sec, self.max_sec))
+        self.fout.write(dictionary)
+        self.fout.write(self.payload)
+        self.__ResetBlock()
 
-            # オーバーロードのチェック
-            # -- ループ重複は気にしない
-            ret = self.__checkOverload(server_log=server_logs, overload_limit_ms=overload_limit_time_ms, overload_average_count=overload_average_count)
-            self.Return_data["overload"].extend(ret)
-        
-        # 同一ネットワークのエラーチェック
-        ret = self.__checkSwitchBroken()
-        self.Return_data["switch_broken"].extend(ret)
 
-        return self.Return_data        
+class ArchiveReader:
+    """アーカイブ形式のファイルからLogLineを読み出す
 
-    def OutputResult(self):
-        """動作結果をリストにして返すだけの関数
+    Description:
+        文字列の分割や時刻の解析をしないので、テキストのログより速く読める。
+        時間帯を指定した場合は、ヘッダの時刻の範囲が重ならないブロックを読まずに飛ばす。
+    """
 
+    def __init__(self, filename : str):
+        self.filename = filename
+        self.counters = {"lines": 0, "parsed": 0, "blank": 0, "quarantined": 0, "blocks_read": 0, "blocks_skipped": 0}
+
+    def Iter(self, since : datetime = None, until : datetime = None):
+        """ログの行を書かれた順に返す
+
+        Args:
+            since (datetime, optional): この時刻より前の行を除く. Defaults to None.
+            until (datetime, optional): この時刻より後の行を除く. Defaults to None.
         Returns:
-            _type_: _description_
+            LogLineのジェネレータ
         """
-        result = []
-        for key in self.Return_data:
-            result.append(f"## {key}")
-            for x in self.Return_data[key]:
-                result.append(x)
-            result.append("")
-        
-        return result
+        since_sec = None if since is None else datetime_to_seconds(since)
+        until_sec = None if until is None else datetime_to_seconds(until)
+        counters = self.counters
+        addresses = []
+        states = []
+        with open(self.filename, "rb") as fin:
+            if fin.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"not an archive : {self.filename}")
+            while True:
+                header = fin.read(ARCHIVE_BLOCK.size)
+                if not header:
+                    break
+                dictionary_bytes, payload_bytes, count, min_sec, max_sec = ARCHIVE_BLOCK.unpack(header)
+
+                # 辞書は後のブロックで使うので、飛ばすブロックでも読む
+                dictionary = fin.read(dictionary_bytes)
+                pos = 0
+                for names, intern in ((addresses, intern_address), (states, str)):
+                    n, pos = decode_varint(dictionary, pos)
+                    for _ in range(n):
+                        size, pos = decode_varint(dictionary, pos)
+                        names.append(intern(dictionary[pos:pos + size].decode("utf-8")))
+                        pos += size
+
+                if (since_sec is not None and max_sec < since_sec) or (until_sec is not None and min_sec > until_sec):
+                    fin.seek(payload_bytes, os.SEEK_CUR)
+                    counters["blocks_skipped"] += 1
+                    continue
+                counters["blocks_read"] += 1
+                yield from self.__IterBlock(fin.read(payload_bytes), count, addresses, states, since_sec, until_sec)
 
-    def __LogAppend(self, logline : str):
-        """ 1行のログをLogLineに変換して、ServerLogsにアドレス別に入れる
+    def __IterBlock(self, buf : bytes, count : int, addresses : list, states : list, since_sec : int, until_sec : int):
+        # ほとんどの値は1〜2byteなので、その場合はdecode_varintを呼ばない
+        pos = 0
+        sec = 0
+        last_sec = None
+        log_datetime = None
+        parsed = 0
+        for _ in range(count):
+            index = buf[pos]
+            pos += 1
+            if index >= 0x80:
+                b = buf[pos]
+                if b < 0x80:
+                    index = (index & 0x7F) | (b << 7)
+                    pos += 1
+                else:
+                    index, pos = decode_varint(buf, pos - 1)
+            delta = buf[pos]
+            pos += 1
+            if delta >= 0x80:
+                b = buf[pos]
+                if b < 0x80:
+                    delta = (delta & 0x7F) | (b << 7)
+                    pos += 1
+                else:
+                    delta, pos = decode_varint(buf, pos - 1)
+            value = buf[pos]
+            pos += 1
+            if value >= 0x80:
+                b = buf[pos]
+                if b < 0x80:
+                    value = (value & 0x7F) | (b << 7)
+                    pos += 1
+                else:
+                    value, pos = decode_varint(buf, pos - 1)
+            if delta:
+                sec += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+            if (since_sec is not None and sec < since_sec) or (until_sec is not None and sec > until_sec):
+                continue
+            parsed += 1
+            if sec != last_sec:
+                log_datetime = seconds_to_datetime(sec)
+                last_sec = sec
+            if value & 1:
+                yield LogLine(addresses[index], log_datetime, states[value >> 1])
+            else:
+                yield LogLine(addresses[index], log_datetime, "", value >> 1)
+        self.counters["lines"] += count
+        self.counters["parsed"] += parsed
+
+
+def convert_to_archive(src : str, dst : str, block_records : int = 4096, quarantine_file : str = None) -> dict:
+    """テキストのログをアーカイブ形式に変換する (不正な行はLogReaderと同じく隔離する)
+
+    Returns:
+        dict: LogReaderの件数
+    """
+    reader = LogReader(quarantine_file)
+    writer = ArchiveWriter(dst, block_records)
+    try:
+        with open_log(src) as fin:
+            for log in reader.Iter(fin):
+                writer.Add(log)
+    finally:
+        writer.Close()
+        reader.Close()
+    return reader.counters
+
+
+def iter_log_lines(filename : str):
+    """テキストのログも、アーカイブ形式も、テキストの行として順に返す
+
+    Description:
+        1行ずつ処理する方法 (GetInfoExternal / GetInfoStream / GetInfoParallel / partition_log) で、
+        アーカイブ形式もテキストと同じように読めるようにする。アーカイブの行は元のログと同じ形式に戻す。
+    """
+    if not is_archive(filename):
+        with open_log(filename) as fin:
+            yield from fin
+        return
+    last_datetime = None
+    timestamp = ""
+    for log in ArchiveReader(filename).Iter():
+        if log.datetime is not last_datetime:
+            last_datetime = log.datetime
+            timestamp = f"{log.datetime:%Y%m%d%H%M%S}"
+        yield f"{timestamp},{log.address},{log.state if log.state else log.response_time}\n"
+
+def iter_log_bytes(filename : str):
+    """iter_log_linesと同じ行を、デコードせずにUTF-8のbyte列で返す (行を分けるだけの処理で使う)
+    """
+    if not is_archive(filename):
+        with open(filename, "rb") as fin:
+            yield from fin
+        return
+    for line in iter_log_lines(filename):
+        yield line.encode("utf-8", "surrogateescape")
+
+
+class ReverseLineReader:
+    """ファイルの末尾から、大きなブロック単位で読んで行を逆順に返す
+
+    Description:
+        途中で読むのをやめれば、それより前のブロックは読まない。読んだbyte数はbytes_readに入る。
+    """
+
+    def __init__(self, filename : str, block_size : int = 64 * 1024):
+        self.filename = filename
+        self.block_size = block_size
+        self.bytes_read = 0
+
+    def __iter__(self):
+        with open(self.filename, "rb") as fin:
+            fin.seek(0, os.SEEK_END)
+            position = fin.tell()
+            rest = b""
+            while position > 0:
+                size = min(self.block_size, position)
+                position -= size
+                fin.seek(position)
+                block = fin.read(size) + rest
+                self.bytes_read += size
+                lines = block.split(b"\n")
+                # 先頭は前のブロックに続いているので、次のブロックと合わせる
+                rest = lines[0]
+                for line in reversed(lines[1:]):
+                    yield line.decode("utf-8", "surrogateescape")
+            yield rest.decode("utf-8", "surrogateescape")
 
+
+class ExternalLogSorter:
+    """メモリの上限を決めてログの行を時刻順に並べ替える
+
+    Description:
+        追加された行がmemory_limit_bytesを超えたら、時刻順に並べた「ラン」を一時ファイルに書き出す。
+        最後に各ランをk-wayマージして、ファイル全体を時刻順に読み出す。
+        同じ時刻の行は入力順を保つので、アドレス毎に見るとlist.sortと同じ並びになる。
+    """
+
+    def __init__(self, memory_limit_bytes : int, tmp_dir : str = None):
+        """
         Args:
-            logline (str): ログの1行
-        Returns:
-            なし
+            memory_limit_bytes (int): メモリ上に保持する行の上限[byte]
+            tmp_dir (str, optional): ランの書き出し先. Defaults to None (OSの一時ディレクトリ).
         """
-        log = LogLine()
-        p = log.Parse(logline)
-        addr = p.address
-        if addr not in self.ServerLogs.keys():
-            self.ServerLogs[addr] = []
-        self.ServerLogs[addr].append(log)
+        self.memory_limit_bytes = memory_limit_bytes
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.run_files = []
 
-    def __checkBroken(self, server_log: list, min_access_count : int = 0):
-        """サーバの故障期間のデータを収集する内部関数
+    def Add(self, line : str):
+        """1行追加する。上限を超えたらランを書き出す
 
         Args:
-            server_log (list): 
-            ip_address (str): 対象サーバのipアドレスが入ってる
+            line (str): 改行を除いたログの1行
+        """
+        self.buffer.append(line)
+        self.buffer_bytes += sys.getsizeof(line) + 8
+        if self.buffer_bytes >= self.memory_limit_bytes:
+            self.__Spill()
+
+    def Merge(self):
+        """すべての行を時刻順に返す
 
         Returns:
-            _type_: _description_
+            改行を除いたログの行のジェネレータ
         """
-        bBroken = False
-        return_data= []
-        current_access_count = 0
-        dt_last_broken = datetime.min
-        dt_first_broken = datetime.min
+        self.buffer.sort(key=self.__SortKey)
+        runs = [self.__ReadRun(name) for name in self.run_files]
+        runs.append(iter(self.buffer))
+        try:
+            yield from heapq.merge(*runs, key=self.__SortKey)
+        finally:
+            self.Close()
 
-        for log in server_log:
+    def Close(self):
+        """一時ファイルを消す
+        """
+        for name in self.run_files:
+            if os.path.exists(name):
+                os.remove(name)
+        self.run_files = []
+        self.buffer = []
+        self.buffer_bytes = 0
 
-            if log.state == "-":
-                if bBroken == False:
-                    current_access_count = 0
-                    dt_first_broken = log.datetime
-                dt_last_broken = log.datetime
-                current_access_count += 1
-                bBroken = True
+    @staticmethod
+    def __SortKey(line : str) -> str:
+        # 先頭14文字が年月日時分秒なので、文字列のまま比較できる
+        return line[:14]
 
-            else:
-                if bBroken == True and current_access_count >= min_access_count:
-                    restxt = f"{log.address},{dt_first_broken},{dt_last_broken}"
-                    return_data.append(restxt)
-                bBroken = False
+    def __Spill(self):
+        self.buffer.sort(key=self.__SortKey)
+        fd, name = tempfile.mkstemp(prefix="run_", suffix=".txt", dir=self.tmp_dir)
+        self.run_files.append(name)
+        with os.fdopen(fd, "w", encoding="utf-8") as fout:
+            for line in self.buffer:
+                fout.write(line)
+                fout.write("\n")
+        self.buffer = []
+        self.buffer_bytes = 0
 
-        # not repaired
-        if bBroken == True and current_access_count >= min_access_count:
-            restxt = f"{log.address},{dt_first_broken},----/--/-- --:--:--"
-            return_data.append(restxt)
+    @staticmethod
+    def __ReadRun(name : str):
+        with open(name, "r", encoding="utf-8") as fin:
+            for line in fin:
+                yield line.rstrip("\n")
 
-        return return_data
 
+class LogSpiller:
+    """ParseLogFileで保持するログの量を上限以下に抑える
 
-    def __checkOverload(self,
-        server_log: list, overload_average_count : int = 10, overload_limit_ms : int = 180000):
-        """ サーバ事に過負荷の時間を計算する
-        Description:
-            過負荷の時間を計算する
-            応答なしの場合は、時間に含めずskipする。
+    Description:
+        アドレス毎に保持しているLogLineのおおよそのbyte数を数え、上限を超えたら
+        最後にログが来たのが古いアドレスから順に、一時ファイルに書き出してメモリから消す。
+        (一度に上限の半分まで減らすので、上限付近で書き出しを繰り返さない)
+        書き出したアドレスのログは、判定する時に1アドレス分ずつ読み戻す。
+    """
+    line_bytes = sys.getsizeof(LogLine()) + sys.getsizeof(datetime.min) + 8    # LogLine 1行分のおおよそのbyte数
 
+    def __init__(self, memory_limit_bytes : int, tmp_dir : str = None):
+        """
         Args:
-            server_log (list): _description_
-            ip_address (str): _description_
-            overload_average_count (int, optional): 平均化する回数. Defaults to 10.
-            overload_time_ms (int, optional): _description_. Defaults to 180000.
+            memory_limit_bytes (int): 保持するログの上限[byte]
+            tmp_dir (str, optional): 書き出し先. Defaults to None (OSの一時ディレクトリ).
         """
-        return_data = []
-        newest_response_times = [] # 最新m回のデータ
-        first_overload_time = None
-        last_overload_time = None   # log.datetimeにすると、過負荷ではない状態を観測した時間になる
+        self.memory_limit_bytes = memory_limit_bytes
+        self.tmp_dir = tmp_dir
+        self.spill_dir = None
+        self.files = {}     # {アドレス : 書き出したファイル}
+        self.spans = {}     # {アドレス : [書き出したログの最初の時刻, 最後の時刻]}
+        self.recent = OrderedDict()     # 最後にログが来た順のアドレス
+        self.counters = {"limit_bytes": memory_limit_bytes, "held_bytes": 0, "high_water_bytes": 0,
+                         "spilled_lines": 0, "spilled_addresses": 0}
+        self.__finalizer = None
 
-        for log in server_log:
-            restime = log.response_time
+    def Track(self, address : str, server_logs : dict):
+        """1行追加されたことを記録し、上限を超えていれば書き出す
 
-            # skip check
-            if log.state == "-" or log.response_time == -1:
-                # エラーの時に回数リセットするならここでリストを空にする
-                continue
+        Args:
+            address (str): 追加されたログのアドレス
+            server_logs (dict): ServerLogParser.ServerLogs
+        """
+        counters = self.counters
+        counters["held_bytes"] += self.line_bytes
+        self.recent[address] = None
+        self.recent.move_to_end(address)
+        if counters["held_bytes"] > counters["high_water_bytes"]:
+            counters["high_water_bytes"] = counters["held_bytes"]
+        if counters["held_bytes"] > self.memory_limit_bytes:
+            while counters["held_bytes"] > self.memory_limit_bytes // 2 and self.recent:
+                addr, _ = self.recent.popitem(last=False)
+                self.__Spill(addr, server_logs[addr])
+
+    def Load(self, address : str, server_log : list) -> list:
+        """書き出したログとメモリに残っているログを合わせて、時間順に返す
+
+        Args:
+            address (str): アドレス
+            server_log (list): メモリに残っているログ (時間順)
+        Returns:
+            list: アドレスのすべてのログ
+        """
+        name = self.files.get(address)
+        if name is None:
+            return server_log
+        with open(name, "r", encoding="utf-8") as fin:
+            logs = list(LogReader().Iter(fin))
+        logs.extend(server_log)
+        logs.sort(key=lambda x: x.datetime)
+        return logs
+
+    def Close(self):
+        """書き出したファイルを消す
+        """
+        if self.__finalizer is not None:
+            self.__finalizer()
+        self.files = {}
 
-            # 最新
-            newest_response_times.append(log.response_time)
-            newest_response_times = newest_response_times[-overload_average_count:]
+    def __Spill(self, address : str, server_log : list):
+        if not server_log:
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="spill_", dir=self.tmp_dir)
+            self.__finalizer = weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+        name = self.files.get(address)
+        if name is None:
+            name = self.files[address] = os.path.join(self.spill_dir, f"{len(self.files)}.txt")
+            self.spans[address] = [server_log[0].datetime, server_log[0].datetime]
+            self.counters["spilled_addresses"] += 1
+        span = self.spans[address]
+        with open(name, "a", encoding="utf-8") as fout:
+            for log in server_log:
+                value = log.state if log.state else log.response_time
+                fout.write(f"{log.datetime:%Y%m%d%H%M%S},{log.address},{value}\n")
+                if log.datetime < span[0]:
+                    span[0] = log.datetime
+                if log.datetime > span[1]:
+                    span[1] = log.datetime
+        self.counters["spilled_lines"] += len(server_log)
+        self.counters["held_bytes"] -= len(server_log) * self.line_bytes
+        del server_log[:]
 
-            # 規定回数に満たないならskip
-            if len(newest_response_times) != overload_average_count:
+
+class WatermarkReorderer:
+    """多少順序が入れ替わって届くログを、ウォーターマークで時刻順に並べ直す
+
+    Description:
+        ウォーターマークは「これまでに届いた最も新しい時刻 - 許容する遅れ」。
+        届いた行はアドレス毎のヒープに入れ、ウォーターマークより前になった行だけを時刻順に取り出す。
+        ウォーターマークより前の時刻で届いた行は、すでに後ろの行を判定器に渡しているので捨てて数える。
+        同じ時刻の行は届いた順に取り出すので、アドレス毎に見るとlist.sortと同じ並びになる。
+    """
+
+    def __init__(self, allowed_lateness_sec : int = 0):
+        """
+        Args:
+            allowed_lateness_sec (int, optional): 許容する遅れ[秒]. Defaults to 0.
+        """
+        self.allowed_lateness = timedelta(seconds=allowed_lateness_sec)
+        self.watermark = None
+        self.heaps = {}     # {アドレス : [(時刻, 届いた順, LogLine), ...]}
+        self.ready = []     # [(アドレス毎のヒープの先頭の時刻, アドレス), ...] (古くなったものも残る)
+        self.counters = {"late": 0, "reordered": 0, "buffered": 0, "buffered_high_water": 0}
+        self.__max_time = None
+        self.__seq = 0
+
+    def Push(self, log : LogLine):
+        """1行を受け取り、ウォーターマークより前になった行を時刻順に返す
+
+        Returns:
+            list: LogLineのリスト
+        """
+        dt = log.datetime
+        if self.watermark is not None and dt < self.watermark:
+            self.counters["late"] += 1
+            return []
+        if self.__max_time is None or dt > self.__max_time:
+            self.__max_time = dt
+            self.watermark = dt - self.allowed_lateness
+        elif dt < self.__max_time:
+            self.counters["reordered"] += 1
+
+        heap = self.heaps.get(log.address)
+        if heap is None:
+            heap = self.heaps[log.address] = []
+        self.__seq += 1
+        heapq.heappush(heap, (dt, self.__seq, log))
+        if heap[0][2] is log:
+            heapq.heappush(self.ready, (dt, log.address))
+        self.counters["buffered"] += 1
+        if self.counters["buffered"] > self.counters["buffered_high_water"]:
+            self.counters["buffered_high_water"] = self.counters["buffered"]
+        return list(self.__Release(self.watermark))
+
+    def Flush(self):
+        """入力の終わりで、残っている行をすべて時刻順に返す
+        """
+        return list(self.__Release(None))
+
+    def __Release(self, watermark : datetime):
+        """ヒープの先頭がwatermarkより前のアドレスから、watermarkより前の行を取り出す (None : すべて)
+        """
+        ready = self.ready
+        while ready and (watermark is None or ready[0][0] < watermark):
+            dt, addr = heapq.heappop(ready)
+            heap = self.heaps[addr]
+            if not heap or heap[0][0] != dt:
+                # 後から届いたより前の行で先頭が変わった、または、取り出し済み
                 continue
+            while heap and (watermark is None or heap[0][0] < watermark):
+                self.counters["buffered"] -= 1
+                yield heapq.heappop(heap)[2]
+            if heap:
+                heapq.heappush(ready, (heap[0][0], addr))
 
-            # 平均時間
-            ave = int(mean(newest_response_times))
-            if ave >= overload_limit_ms:
-                # 過負荷の場合
-                if first_overload_time is None:
-                    first_overload_time = log.datetime
-                last_overload_time = log.datetime    # 記録するのを過負荷ではない結果を得た時間にする場合はここを消す
-            else:
-                # 過負荷を抜けた場合
-                if first_overload_time is not None:
-                    restxt = f"{log.address},{first_overload_time},{last_overload_time}"
-                    return_data.append(restxt)
-                first_overload_time = None
 
-        if first_overload_time != None:
-            restxt = f"{log.address},{first_overload_time},{last_overload_time}"
-            return_data.append(restxt)
-        first_overload_time = None
+class BrokenDetector:
+    """1サーバ分の故障期間を逐次判定する
 
-        return return_data
+    Description:
+        連続した応答なし(既定は"-"。StatusTableで分類した状態)を1つの故障期間にまとめる。
+        min_access_count回以上続いた場合のみ結果にする。(応答が戻った行は故障期間に含めない)
+        結果にした故障期間の応答なしの回数を、分類毎にcategory_countsに数える。
+        応答と応答なしを繰り返すサーバで細かい期間が大量に出ないように、
+        close_count回続けて応答が戻るまでは故障期間を閉じず、
+        前の期間の終わりからmerge_gap_sec秒未満で始まった期間は前の期間につなげる。
+        (つなげるかどうか決まるまで、閉じた期間を1つだけ保留する)
+    """
+    __slots__ = ("min_access_count", "close_count", "merge_gap", "broken", "access_count", "good_count",
+                 "first_broken", "last_broken", "pending", "lookup", "run_counts", "category_counts")
+
+    def __init__(self, min_access_count : int = 0, close_count : int = 1, merge_gap_sec : int = 0, table : StatusTable = None):
+        """
+        Args:
+            min_access_count (int, optional): 故障とみなす応答なしの回数. Defaults to 0.
+            close_count (int, optional): 故障期間を閉じる連続した応答の回数. Defaults to 1.
+            merge_gap_sec (int, optional): この秒数未満の間隔の故障期間をつなげる (0 : つなげない). Defaults to 0.
+            table (StatusTable, optional): 応答なしの分類. Defaults to None (既定の分類).
+        """
+        if table is None:
+            table = status_table()
+        self.lookup = table.lookup
+        self.run_counts = [0] * (len(table.categories) + 1)         # 続いている応答なしの分類毎の回数
+        self.category_counts = [0] * (len(table.categories) + 1)    # 結果にした故障期間の分類毎の回数 (0番目は使わない)
+        self.min_access_count = min_access_count
+        self.close_count = close_count
+        self.merge_gap = timedelta(seconds=merge_gap_sec) if merge_gap_sec > 0 else None
+        self.broken = False
+        self.access_count = 0
+        self.good_count = 0
+        self.first_broken = datetime.min
+        self.last_broken = datetime.min
+        self.pending = None     # つなげるかどうか決まっていない故障期間
 
+    def Push(self, log : LogLine):
+        """1サンプル分の判定を進める
 
-    def __checkSwitchBroken(self):
-        """ネットワークスイッチの故障状態を出力する
+        Args:
+            log (LogLine): 時間順に入力するログ
         Returns:
-            _type_: _description_
-        Note:
+            Interval: 故障期間が終わった場合はその結果、それ以外はNone
         """
-        def time_and(t_a_start, t_a_end, t_b_start, t_b_end):
-            start = max(t_a_start, t_b_start)
-            end = max(t_a_end, t_b_end)
-            return {"start": start, "end": end }
+        category = self.lookup.get(log.state)
+        if category:
+            interval = None
+            if not self.broken:
+                self.access_count = 0
+                self.run_counts = [0] * len(self.run_counts)
+                self.first_broken = log.datetime
+                interval = self.__FlushPending(log.datetime)
+            self.last_broken = log.datetime
+            self.access_count += 1
+            self.run_counts[category] += 1
+            self.good_count = 0
+            self.broken = True
+            return interval
 
-        return_data = []
-        broken_log = self.Return_data["broken"] # 
-        networks = {}
+        if not self.broken:
+            return self.__FlushPending(log.datetime)
+        self.good_count += 1
+        if self.good_count < self.close_count:
+            return None
+        self.broken = False
+        if self.access_count < self.min_access_count:
+            return self.__FlushPending(log.datetime)
+        self.__CountRun()
+        return self.__Hold(Interval("broken", log.address, self.first_broken, self.last_broken))
+
+    def Finish(self, address : str):
+        """回復していない場合は故障継続として結果を返す
+
+        Description:
+            保留中の期間がある場合は2件になることがあるので、Noneが返るまで繰り返し呼ぶ。
+        """
+        if self.broken:
+            self.broken = False
+            if self.access_count >= self.min_access_count:
+                self.__CountRun()
+                # close_count回に満たなくても、最後に応答が戻っていれば回復したとみなす
+                end = None if self.good_count == 0 else self.last_broken
+                interval = self.__Hold(Interval("broken", address, self.first_broken, end))
+                if interval is not None:
+                    return interval
+        interval, self.pending = self.pending, None
+        return interval
+
+    def Categories(self, table : StatusTable) -> dict:
+        """結果にした故障期間の応答なしの回数を {分類名 : 回数} で返す (0回の分類は除く)
+        """
+        return {name: self.category_counts[i + 1] for i, name in enumerate(table.categories) if self.category_counts[i + 1] > 0}
+
+    def __CountRun(self):
+        """結果にする故障期間の応答なしの回数を、分類毎に加える
+        """
+        for i, count in enumerate(self.run_counts):
+            self.category_counts[i] += count
+
+    def __Hold(self, interval : Interval):
+        """閉じた故障期間を保留中の期間とつなげる。確定した期間があれば返す
+        """
+        if self.merge_gap is None:
+            return interval
+        pending = self.pending
+        if pending is None:
+            self.pending = interval
+            return None
+        if interval.start - pending.end < self.merge_gap:
+            self.pending = pending._replace(end=interval.end)
+            return None
+        self.pending = interval
+        return pending
+
+    def __FlushPending(self, now : datetime):
+        """保留中の期間の終わりからmerge_gap_sec秒以上たっていれば確定して返す
+        """
+        pending = self.pending
+        if pending is None or now - pending.end < self.merge_gap:
+            return None
+        self.pending = None
+        return pending
+
+
+class OverloadDetector:
+    """直近m回の平均応答時間から過負荷を逐次判定する
+
+    Description:
+        直近m回の応答時間を長さmのdequeに保持し、合計値を加減算で更新する。
+        応答なしの場合は、時間に含めずskipする。
+    """
+    __slots__ = ("overload_average_count", "overload_limit_ms", "newest_response_times", "total",
+                 "first_overload_time", "last_overload_time")
+
+    def __init__(self, overload_average_count : int = 10, overload_limit_ms : int = 180000):
+        self.overload_average_count = overload_average_count
+        self.overload_limit_ms = overload_limit_ms
+        self.newest_response_times = deque(maxlen=max(overload_average_count, 0))  # 最新m回のデータ
+        self.total = 0
+        self.first_overload_time = None
+        self.last_overload_time = None   # log.datetimeにすると、過負荷ではない状態を観測した時間になる
+
+    def Push(self, log : LogLine):
+        """1サンプル分の判定を進める
+
+        Args:
+            log (LogLine): 時間順に入力するログ
+        Returns:
+            Interval: 過負荷期間が終わった場合はその結果、それ以外はNone
+        """
+        # skip check
+        if log.response_time == -1:     # 応答時間が無い行 (応答なし、その他の状態) は判定しない
+            # エラーの時に回数リセットするならここでdequeを空にする
+            return None
+
+        newest = self.newest_response_times
+        if len(newest) == self.overload_average_count:
+            self.total -= newest[0]
+        newest.append(log.response_time)
+        self.total += log.response_time
+
+        # 規定回数に満たないならskip
+        if len(newest) != self.overload_average_count or self.overload_average_count <= 0:
+            return None
+
+        # 平均時間
+        interval = None
+        ave = self.total // self.overload_average_count
+        if ave >= self.overload_limit_ms:
+            # 過負荷の場合
+            if self.first_overload_time is None:
+                self.first_overload_time = log.datetime
+            self.last_overload_time = log.datetime    # 記録するのを過負荷ではない結果を得た時間にする場合はここを消す
+        else:
+            # 過負荷を抜けた場合
+            if self.first_overload_time is not None:
+                interval = Interval("overload", log.address, self.first_overload_time, self.last_overload_time)
+            self.first_overload_time = None
+        return interval
+
+    def Finish(self, address : str):
+        """過負荷が継続中なら最後に観測した時間までを結果として返す
+        """
+        interval = None
+        if self.first_overload_time is not None:
+            interval = Interval("overload", address, self.first_overload_time, self.last_overload_time)
+        self.first_overload_time = None
+        return interval
+
+
+class OverloadWindowDetector:
+    """直近W秒間の応答時間から過負荷を逐次判定する
+
+    Description:
+        --overload m,t は直近m回で判定するため、ポーリング間隔が違うサーバで結果が変わる。
+        こちらは時間窓 (t-W, t] 内のサンプルで平均値、または、最大値を求めて判定する。
+        窓内のサンプルはdequeに保持して合計値を加減算で更新し、
+        最大値は単調減少のdequeで管理するので、1サンプル当たり償却O(1)で済む。
+        応答なしのサンプルは__checkOverloadと同様に判定から除外する。
+    """
+    __slots__ = (
+        "window", "overload_limit_ms", "use_max",
+        "samples", "max_queue", "total",
+        "first_overload_time", "last_overload_time",
+    )
+
+    def __init__(self, window_sec : int, overload_limit_ms : int, mode : str = "average"):
+        """
+        Args:
+            window_sec (int): 時間窓の長さ[秒]
+            overload_limit_ms (int): 過負荷とみなす応答時間[ms]
+            mode (str, optional): "average" : 窓内の平均, "max" : 窓内の最大. Defaults to "average".
+        """
+        if mode not in ("average", "max"):
+            raise ValueError(f"unknown overload window mode : {mode}")
+        self.window = timedelta(seconds=window_sec)
+        self.overload_limit_ms = overload_limit_ms
+        self.use_max = (mode == "max")
+        self.samples = deque()      # 窓内の (datetime, response_time)
+        self.max_queue = deque()    # 応答時間が単調減少になるように保持する
+        self.total = 0
+        self.first_overload_time = None
+        self.last_overload_time = None
+
+    def Push(self, log : LogLine):
+        """1サンプル分の判定を進める
+
+        Args:
+            log (LogLine): 時間順に入力するログ
+        Returns:
+            Interval: 過負荷期間が終わった場合はその結果、それ以外はNone
+        """
+        if log.response_time == -1:
+            return None
+
+        now = log.datetime
+        restime = log.response_time
+        self.samples.append((now, restime))
+        self.total += restime
+        while self.max_queue and self.max_queue[-1][1] <= restime:
+            self.max_queue.pop()
+        self.max_queue.append((now, restime))
+
+        # 窓から外れたサンプルを捨てる
+        limit = now - self.window
+        while self.samples[0][0] <= limit:
+            self.total -= self.samples.popleft()[1]
+        while self.max_queue[0][0] <= limit:
+            self.max_queue.popleft()
+
+        if self.use_max:
+            value = self.max_queue[0][1]
+        else:
+            value = self.total // len(self.samples)
+
+        interval = None
+        if value >= self.overload_limit_ms:
+            if self.first_overload_time is None:
+                self.first_overload_time = now
+            self.last_overload_time = now
+        else:
+            if self.first_overload_time is not None:
+                interval = Interval("overload", log.address, self.first_overload_time, self.last_overload_time)
+            self.first_overload_time = None
+        return interval
+
+    def Finish(self, address : str):
+        """過負荷が継続中なら最後に観測した時間までを結果として返す
+        """
+        interval = None
+        if self.first_overload_time is not None:
+            interval = Interval("overload", address, self.first_overload_time, self.last_overload_time)
+        self.first_overload_time = None
+        return interval
+
+
+class AnomalyDetector:
+    """応答時間の指数移動平均と分散から、普段より遅い応答を逐次判定する
+
+    Description:
+        サーバ毎に応答時間の指数移動平均と分散だけを保持し、過去のログは持たない。
+        平均 + k × 標準偏差 を超えた応答を異常とし、連続した異常を1つの期間にまとめる。
+        (過負荷の固定の閾値tと違い、サーバ毎の普段の応答時間に合わせて判定される)
+        最初の warmup 回は平均と分散を求めるだけで判定しない。応答なしの場合はskipする。
+    """
+    __slots__ = ("alpha", "k", "warmup", "count", "mean", "variance",
+                 "first_anomaly_time", "last_anomaly_time")
+
+    def __init__(self, alpha : float, k : float = 3.0, warmup : int = None):
+        """
+        Args:
+            alpha (float): 指数移動平均の重み (0 < α <= 1、大きいほど直近の応答を重視する)
+            k (float, optional): 異常とみなす標準偏差の倍数. Defaults to 3.0.
+            warmup (int, optional): 判定を始めるまでの回数. Defaults to None (1 / α).
+        """
+        self.alpha = alpha
+        self.k = k
+        self.warmup = int(round(1 / alpha)) if warmup is None else warmup
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+        self.first_anomaly_time = None
+        self.last_anomaly_time = None
+
+    def Push(self, log : LogLine):
+        """1サンプル分の判定を進める
+
+        Args:
+            log (LogLine): 時間順に入力するログ
+        Returns:
+            Interval: 異常な期間が終わった場合はその結果、それ以外はNone
+        """
+        if log.response_time == -1:
+            return None
+
+        x = log.response_time
+        interval = None
+        if self.count >= self.warmup:
+            if (x - self.mean) ** 2 > self.k * self.k * self.variance and x > self.mean:
+                if self.first_anomaly_time is None:
+                    self.first_anomaly_time = log.datetime
+                self.last_anomaly_time = log.datetime
+            elif self.first_anomaly_time is not None:
+                interval = Interval("anomaly", log.address, self.first_anomaly_time, self.last_anomaly_time)
+                self.first_anomaly_time = None
+
+        # 指数移動平均と分散の更新 (最初の1回は平均をその値にする)
+        if self.count == 0:
+            self.mean = float(x)
+        else:
+            diff = x - self.mean
+            increment = self.alpha * diff
+            self.mean += increment
+            self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+        self.count += 1
+        return interval
+
+    def Finish(self, address : str):
+        """異常が継続中なら最後に観測した時間までを結果として返す
+        """
+        interval = None
+        if self.first_anomaly_time is not None:
+            interval = Interval("anomaly", address, self.first_anomaly_time, self.last_anomaly_time)
+        self.first_anomaly_time = None
+        return interval
+
+
+class HostInventory:
+    """ネットワーク毎のサーバ一覧
+
+    Description:
+        ログに出てきたすべてのサーバを、最初と最後に観測した時刻と一緒にネットワーク毎に保持する。
+        一度も故障していないサーバも、スイッチ故障の判定で母数に入れるために使う。
+    """
+
+    def __init__(self):
+        self.networks = {}      # {ネットワークアドレス : {サーバアドレス : [最初の時刻, 最後の時刻]}}
+        self.last_time = None   # ログ全体の最後の時刻
+
+    def Observe(self, address : str, first_time : datetime, last_time : datetime = None):
+        """サーバを観測したことを記録する
+
+        Args:
+            address (str): サーバのアドレス
+            first_time (datetime): 観測した最初の時刻
+            last_time (datetime, optional): 観測した最後の時刻. Defaults to None (first_timeと同じ).
+        """
+        if last_time is None:
+            last_time = first_time
+        network = network_of(address)
+        hosts = self.networks.get(network)
+        if hosts is None:
+            hosts = self.networks[network] = {}
+        span = hosts.get(address)
+        if span is None:
+            hosts[address] = [first_time, last_time]
+        else:
+            span[0] = min(span[0], first_time)
+            span[1] = max(span[1], last_time)
+        if self.last_time is None or last_time > self.last_time:
+            self.last_time = last_time
+
+    def Hosts(self, network : str) -> dict:
+        """ネットワークに属するサーバの {アドレス : [最初の時刻, 最後の時刻]} を返す
+        """
+        return self.networks.get(network, {})
+
+
+class AvailabilityStats:
+    """故障期間から、サーバ毎・ネットワーク毎の故障時間・MTBF・MTTR・稼働率を集計する
+
+    Description:
+        故障のIntervalを受け取るたびに、アドレス毎の [故障時間[秒], 故障回数] を足し込むだけにする。
+        故障時間は出力する期間と同じ (最初の応答なし 〜 最後の応答なし) で、
+        継続中の故障はログ全体の最後の時刻までとする。
+        集計期間はログ全体の最初から最後の時刻まで。
+    """
+
+    def __init__(self, last_time : datetime = None):
+        """
+        Args:
+            last_time (datetime, optional): ログ全体の最後の時刻 (継続中の故障の終わり). Defaults to None.
+        """
+        self.last_time = last_time
+        self.totals = {}    # {アドレス : [故障時間[秒], 故障回数]}
+        self.pending = []   # last_timeが決まる前に届いた継続中の故障
+
+    def Add(self, interval : Interval):
+        """故障のIntervalを1つ集計する
+        """
+        if interval.end is None and self.last_time is None:
+            self.pending.append(interval)
+            return
+        end = self.last_time if interval.end is None else interval.end
+        total = self.totals.get(interval.address)
+        if total is None:
+            total = self.totals[interval.address] = [0, 0]
+        total[0] += (end - interval.start) // timedelta(seconds=1)
+        total[1] += 1
+
+    def Rows(self, addresses, first_time : datetime, last_time : datetime) -> list:
+        """集計結果を出力用の文字列にする
+
+        Args:
+            addresses : ログに出てきたアドレスの一覧 (この順に出力する)
+            first_time (datetime): ログ全体の最初の時刻
+            last_time (datetime): ログ全体の最後の時刻
+        Returns:
+            list: "アドレス,故障時間[秒],故障回数,MTBF[秒],MTTR[秒],稼働率[%]" のリスト。
+                サーバ毎の行の後に、ネットワーク毎 (所属するサーバの合計) の行を続ける。
+        """
+        self.last_time = last_time
+        pending, self.pending = self.pending, []
+        for interval in pending:
+            self.Add(interval)
+
+        span = 0 if first_time is None else (last_time - first_time) // timedelta(seconds=1)
+        rows = []
+        networks = {}
+        for addr in addresses:
+            downtime, outages = self.totals.get(addr, (0, 0))
+            rows.append(self.__Format(addr, downtime, outages, span))
+            network = networks.setdefault(network_of(addr), [0, 0, 0])
+            network[0] += downtime
+            network[1] += outages
+            network[2] += span
+        for network, (downtime, outages, network_span) in networks.items():
+            rows.append(self.__Format(network, downtime, outages, network_span))
+        return rows
+
+    @staticmethod
+    def __Format(address : str, downtime : int, outages : int, span : int) -> str:
+        """1行分の集計結果を文字列にする (故障がない場合のMTBF・MTTRは "-")
+        """
+        uptime = span - downtime
+        availability = 100.0 if span == 0 else uptime * 100 / span
+        if outages == 0:
+            return f"{address},{downtime},{outages},-,-,{availability:.3f}"
+        return f"{address},{downtime},{outages},{uptime / outages:.1f},{downtime / outages:.1f},{availability:.3f}"
+
+
+class ReversedKey:
+    """大小を逆にして比べる文字列 (値の大きい順のヒープで、同じ値なら辞書順で前の方を大きいとみなす)
+    """
+    __slots__ = ("text",)
+
+    def __init__(self, text : str):
+        self.text = text
+
+    def __eq__(self, other):
+        return self.text == other.text
+
+    def __lt__(self, other):
+        return self.text > other.text
+
+    def __gt__(self, other):
+        return self.text < other.text
+
+
+class TopK:
+    """値の大きい上位k件だけを保持する (最小ヒープ)
+
+    Description:
+        保持するのはk件だけなので、アドレスが何百万あってもメモリは増えない。
+        同じ値の場合はアドレスの辞書順で前のものを上位にするので、追加する順によらず同じ結果になる。
+        別々に集計したTopKはMergeでまとめられる。(同じアドレスを別々に集計していない場合は正確)
+    """
+
+    def __init__(self, k : int):
+        self.k = k
+        self.heap = []      # (値, ReversedKey(アドレス), アドレス)
+
+    def Push(self, address : str, value):
+        """値を1つ追加する
+        """
+        item = (value, ReversedKey(address), address)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def Merge(self, other):
+        """別に集計したTopKを加える
+        """
+        for value, _, address in other.heap:
+            self.Push(address, value)
+
+    def Items(self) -> list:
+        """[(アドレス, 値)] を値の大きい順に返す
+        """
+        return [(address, value) for value, _, address in sorted(self.heap, reverse=True)]
+
+
+class SpaceSaving:
+    """出現回数の多いアドレスを、決まった件数の記録だけで求める (Space-Saving)
+
+    Description:
+        記録がcapacity件に達したら、回数が最小の記録を新しいアドレスに置き換え、その回数を誤差として引き継ぐ。
+        回数は実際以上になり、実際との差は誤差以下になる。
+        最小の記録は、古くなった値を読み飛ばすヒープで探す。
+    """
+
+    def __init__(self, capacity : int):
+        self.capacity = capacity
+        self.counts = {}    # {アドレス : [回数, 誤差]}
+        self.heap = []      # (回数, アドレス) 回数が古いものも含む
+
+    def Add(self, address : str, count : int = 1):
+        """アドレスの回数を加える
+        """
+        counts = self.counts
+        entry = counts.get(address)
+        if entry is None:
+            if len(counts) < self.capacity:
+                entry = counts[address] = [0, 0]
+            else:
+                entry = counts[address] = self.__Evict()
+        entry[0] += count
+        heapq.heappush(self.heap, (entry[0], address))
+        if len(self.heap) > self.capacity * 4:
+            self.heap = [(v[0], k) for k, v in counts.items()]
+            heapq.heapify(self.heap)
+
+    def Merge(self, other):
+        """別に集計したSpaceSavingを加える
+
+        Description:
+            片方にしかないアドレスは、もう片方の最小の回数まではあった可能性があるので、回数と誤差に加える。
+        """
+        min_self = self.MinCount()
+        min_other = other.MinCount()
+        merged = {}
+        for address in set(self.counts) | set(other.counts):
+            a = self.counts.get(address, [min_self, min_self])
+            b = other.counts.get(address, [min_other, min_other])
+            merged[address] = [a[0] + b[0], a[1] + b[1]]
+        top = sorted(merged.items(), key=lambda x: (-x[1][0], x[0]))[:self.capacity]
+        self.counts = dict(top)
+        self.heap = [(v[0], k) for k, v in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def MinCount(self) -> int:
+        """記録にないアドレスの回数の上限 (記録がcapacity件に達していなければ0)
+        """
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(v[0] for v in self.counts.values())
+
+    def Items(self) -> list:
+        """[(アドレス, 回数, 誤差)] を回数の多い順に返す
+        """
+        return sorted(((k, v[0], v[1]) for k, v in self.counts.items()), key=lambda x: (-x[1], x[0]))
+
+    def __Evict(self) -> list:
+        """回数が最小の記録を外して、その回数を誤差にした新しい記録を返す
+        """
+        while True:
+            count, address = heapq.heappop(self.heap)
+            entry = self.counts.get(address)
+            if entry is not None and entry[0] == count:
+                break
+        del self.counts[address]
+        return [count, count]
+
+
+class CountMinSketch:
+    """アドレス毎の回数を、決まった大きさの表で実際以上の値として見積もる (Count-Min)
+
+    Description:
+        depth個のハッシュで表の1か所ずつに加え、見積もりはその最小値にする。
+        ハッシュはプロセスによらないcrc32なので、別のプロセスで集計した表も足し合わせられる。
+    """
+
+    def __init__(self, width : int = 1024, depth : int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = array("q", bytes(8 * width * depth))
+
+    def Add(self, address : str, count : int = 1):
+        for i in self.__Cells(address):
+            self.table[i] += count
+
+    def Estimate(self, address : str) -> int:
+        return min(self.table[i] for i in self.__Cells(address))
+
+    def Merge(self, other):
+        """別に集計した同じ大きさの表を足し合わせる
+        """
+        for i, x in enumerate(other.table):
+            self.table[i] += x
+
+    def __Cells(self, address : str) -> list:
+        data = address.encode("utf-8")
+        return [row * self.width + zlib.crc32(data, row * 0x9E3779B1 & 0xFFFFFFFF) % self.width for row in range(self.depth)]
+
+
+class TopKReport:
+    """故障回数・故障時間・平均応答時間・応答なしの回数の上位K件
+
+    Description:
+        故障回数・故障時間・平均応答時間は、1アドレス分の集計が終わるたびにTopKに入れる。(正確)
+        応答なしの回数はログを1行ずつ読みながら数えられるように、SpaceSavingで候補を求め、
+        CountMinSketchの見積もりと小さい方を使う。(近似。記録の件数はK × 10)
+        どれも別々に集計したものをMergeでまとめられるので、GetInfoParallelではワーカ毎に集計してまとめる。
+    """
+
+    def __init__(self, k : int, table : StatusTable = None):
+        """
+        Args:
+            k (int): 上位の件数
+            table (StatusTable, optional): 応答なしの分類 (AddLogsで使う). Defaults to None (既定の分類).
+        """
+        self.k = k
+        self.table = status_table() if table is None else table
+        self.outages = TopK(k)
+        self.downtime = TopK(k)
+        self.latency = TopK(k)
+        self.failed = SpaceSaving(k * 10)
+        self.failed_sketch = CountMinSketch()
+
+    def AddOutages(self, address : str, outages : int, downtime_sec : int):
+        """1アドレス分の故障回数と故障時間を入れる
+        """
+        self.outages.Push(address, outages)
+        self.downtime.Push(address, downtime_sec)
+
+    def AddLatency(self, address : str, latency_sum : int, samples : int):
+        """1アドレス分の応答時間の合計と回数を入れる
+        """
+        if samples > 0:
+            self.latency.Push(address, latency_sum / samples)
+
+    def AddFailed(self, address : str, count : int = 1):
+        """応答なしの回数を加える
+        """
+        self.failed.Add(address, count)
+        self.failed_sketch.Add(address, count)
+
+    def AddLogs(self, address : str, server_log : list):
+        """1アドレス分のログから、平均応答時間と応答なしの回数を入れる
+        """
+        lookup = self.table.lookup
+        latency_sum = 0
+        samples = 0
+        failed = 0
+        for log in server_log:
+            if lookup.get(log.state):
+                failed += 1
+            elif log.response_time != -1:
+                latency_sum += log.response_time
+                samples += 1
+        self.AddLatency(address, latency_sum, samples)
+        if failed > 0:
+            self.AddFailed(address, failed)
+
+    def Merge(self, other):
+        """別に集計したTopKReportを加える
+        """
+        self.outages.Merge(other.outages)
+        self.downtime.Merge(other.downtime)
+        self.latency.Merge(other.latency)
+        self.failed.Merge(other.failed)
+        self.failed_sketch.Merge(other.failed_sketch)
+
+    def Rows(self) -> dict:
+        """出力用の文字列にする
+
+        Returns:
+            dict: {"top_outages" : ["アドレス,故障回数"], "top_downtime" : ["アドレス,故障時間[秒]"],
+                   "top_latency" : ["アドレス,平均応答時間[ms]"], "top_failed_samples" : ["アドレス,応答なしの回数,最大の誤差"]}
+        """
+        failed = []
+        for address, count, error in self.failed.Items():
+            failed.append((address, min(count, self.failed_sketch.Estimate(address)), error))
+        failed.sort(key=lambda x: (-x[1], x[0]))
+        return {
+            "top_outages": [f"{a},{v}" for a, v in self.outages.Items() if v > 0],
+            "top_downtime": [f"{a},{v}" for a, v in self.downtime.Items() if v > 0],
+            "top_latency": [f"{a},{v:.1f}" for a, v in self.latency.Items()],
+            "top_failed_samples": [f"{a},{c},{e}" for a, c, e in failed[:self.k]],
+        }
+
+
+class HyperLogLog:
+    """異なる値の数を、値そのものを持たずに見積もる (HyperLogLog)
+
+    Description:
+        値をblake2bの64bitのハッシュにし、上位precision bitで選んだレジスタに、残りのbitの先頭の0の数 + 1 の最大を記録する。
+        少ないうちはハッシュの集合で正確に数え、m / 16 個を超えたらm個のレジスタに切り替える。(m = 2 ** precision)
+        レジスタ毎に最大を取れば和集合になるので、別々に数えたものをMergeでまとめられる。
+        標準誤差はおよそ 1.04 / √m。(precision=12 で 1.6%)
+    """
+    __slots__ = ("precision", "sparse", "registers")
+
+    def __init__(self, precision : int = 12):
+        """
+        Args:
+            precision (int, optional): レジスタの数を決めるbit数 (4〜16). Defaults to 12.
+        """
+        if not 4 <= precision <= 16:
+            raise ValueError(f"invalid precision : {precision}")
+        self.precision = precision
+        self.sparse = set()     # 少ないうちのハッシュの集合
+        self.registers = None   # 切り替えた後のレジスタ (bytearray)
+
+    @staticmethod
+    def Hash(value : str) -> int:
+        """値の64bitのハッシュ (プロセスによらず同じ値になる)
+        """
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def AddHash(self, h : int):
+        """Hashで求めたハッシュを加える
+        """
+        if self.registers is None:
+            self.sparse.add(h)
+            if len(self.sparse) > (1 << self.precision) // 16:
+                self.__ToDense()
+            return
+        self.__Update(h)
+
+    def Add(self, value : str):
+        """値を加える
+        """
+        self.AddHash(self.Hash(value))
+
+    def Merge(self, other):
+        """別に数えたHyperLogLogを加える (precisionが同じであること)
+        """
+        if other.precision != self.precision:
+            raise ValueError("precision mismatch")
+        if other.registers is None:
+            for h in other.sparse:
+                self.AddHash(h)
+            return
+        if self.registers is None:
+            self.__ToDense()
+        registers = self.registers
+        for i, r in enumerate(other.registers):
+            if r > registers[i]:
+                registers[i] = r
+
+    def Count(self) -> int:
+        """異なる値の数の見積もりを返す
+        """
+        if self.registers is None:
+            return len(self.sparse)
+        m = 1 << self.precision
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            # 少ない場合は空のレジスタの割合から求める (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def Dump(self) -> dict:
+        """JSONにできる形にする
+        """
+        if self.registers is None:
+            return {"precision": self.precision, "sparse": sorted(self.sparse)}
+        return {"precision": self.precision, "registers": self.registers.hex()}
+
+    @classmethod
+    def Load(cls, data : dict):
+        """Dumpの逆変換
+        """
+        hll = cls(data["precision"])
+        if "registers" in data:
+            hll.registers = bytearray.fromhex(data["registers"])
+        else:
+            hll.sparse = set(data["sparse"])
+        return hll
+
+    def __ToDense(self):
+        self.registers = bytearray(1 << self.precision)
+        for h in self.sparse:
+            self.__Update(h)
+        self.sparse = set()
+
+    def __Update(self, h : int):
+        bits = 64 - self.precision
+        idx = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+
+class CoverageStats:
+    """ネットワーク毎・時間帯毎の、ログを出したサーバの数と応答なしがあったサーバの数 (HyperLogLog)
+
+    Description:
+        (ネットワーク, 時間帯の開始) 毎に2つのHyperLogLogを持ち、サーバのアドレスを加える。
+        アドレスのハッシュは1回だけ求め、同じ時間帯に続けて出てきたサーバは加えない。
+        別々に数えたものはMergeでまとめられる。(GetInfoParallel / MergeShards)
+    """
+
+    def __init__(self, bucket_sec : int = 3600, precision : int = 12, table : StatusTable = None):
+        """
+        Args:
+            bucket_sec (int, optional): 時間帯の長さ[秒]. Defaults to 3600.
+            precision (int, optional): HyperLogLogのprecision. Defaults to 12.
+            table (StatusTable, optional): 応答なしの分類. Defaults to None (既定の分類).
+        """
+        self.bucket_sec = bucket_sec
+        self.precision = precision
+        self.table = status_table() if table is None else table
+        self.cells = {}         # {(ネットワーク, 時間帯の開始[秒]) : [ログを出したサーバ, 応答なしがあったサーバ]}
+        self.__hashes = {}      # {アドレス : (ハッシュ, ネットワーク)}
+        self.__seen = {}        # {アドレス : [最後に加えた時間帯, 応答なしを加えたか]}
+        self.__last_datetime = None
+        self.__last_bucket = 0
+
+    def Add(self, log : LogLine):
+        """1行分を加える
+        """
+        dt = log.datetime
+        if dt is not self.__last_datetime:
+            self.__last_datetime = dt
+            seconds = datetime_to_seconds(dt)
+            self.__last_bucket = seconds - seconds % self.bucket_sec
+        bucket = self.__last_bucket
+        failed = self.table.lookup.get(log.state)
+
+        seen = self.__seen.get(log.address)
+        if seen is not None and seen[0] == bucket and (seen[1] or not failed):
+            return
+        entry = self.__hashes.get(log.address)
+        if entry is None:
+            entry = self.__hashes[log.address] = (HyperLogLog.Hash(log.address), network_of(log.address))
+        h, network = entry
+        cell = self.cells.get((network, bucket))
+        if cell is None:
+            cell = self.cells[(network, bucket)] = [HyperLogLog(self.precision), HyperLogLog(self.precision)]
+        if seen is None or seen[0] != bucket:
+            cell[0].AddHash(h)
+            seen = self.__seen[log.address] = [bucket, False]
+        if failed:
+            cell[1].AddHash(h)
+            seen[1] = True
+
+    def AddLogs(self, server_log : list):
+        """1アドレス分のログを加える
+        """
+        for log in server_log:
+            self.Add(log)
+
+    def Merge(self, other):
+        """別に数えたCoverageStatsを加える
+        """
+        for key, (hosts, failing) in other.cells.items():
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = [HyperLogLog(self.precision), HyperLogLog(self.precision)]
+            cell[0].Merge(hosts)
+            cell[1].Merge(failing)
+
+    def Rows(self) -> list:
+        """出力用の文字列にする (時間帯の開始、ネットワークの順)
+
+        Returns:
+            list: "ネットワーク,時間帯の開始,ログを出したサーバの数,応答なしがあったサーバの数" の文字列
+        """
+        return [f"{network},{seconds_to_datetime(bucket)},{hosts.Count()},{failing.Count()}"
+                for (network, bucket), (hosts, failing) in sorted(self.cells.items(), key=lambda x: (x[0][1], x[0][0]))]
+
+    def Dump(self) -> dict:
+        """JSONにできる形にする (MergeShardsに渡す)
+        """
+        return {"bucket_sec": self.bucket_sec, "precision": self.precision,
+                "cells": [[network, bucket, hosts.Dump(), failing.Dump()]
+                          for (network, bucket), (hosts, failing) in self.cells.items()]}
+
+    @classmethod
+    def Load(cls, data : dict, table : StatusTable = None):
+        """Dumpの逆変換
+        """
+        stats = cls(data["bucket_sec"], data["precision"], table)
+        for network, bucket, hosts, failing in data["cells"]:
+            stats.cells[(network, bucket)] = [HyperLogLog.Load(hosts), HyperLogLog.Load(failing)]
+        return stats
+
+
+class IntervalStore:
+    """故障・過負荷・スイッチ故障の期間を保存するSQLiteのデータベース
+
+    Description:
+        同じ (種類, アドレス, 開始) の期間は上書きするので、同じログを何度入れても重複しない。
+        (継続中だった期間は、後のログで終了が決まった時に更新される)
+        (address, start) と (network, start) に索引を付け、過去のログを読み直さずに検索できるようにする。
+        時刻は出力と同じ "YYYY-MM-DD HH:MM:SS" の文字列で保存する。(文字列の順と時間の順が同じ)
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS intervals ("
+        " kind TEXT NOT NULL, address TEXT NOT NULL, network TEXT NOT NULL,"
+        " start TEXT NOT NULL, end TEXT,"
+        " PRIMARY KEY (kind, address, start))",
+        "CREATE INDEX IF NOT EXISTS intervals_address ON intervals (address, start)",
+        "CREATE INDEX IF NOT EXISTS intervals_network ON intervals (network, start)",
+    )
+
+    def __init__(self, path : str, batch_size : int = 10000):
+        """
+        Args:
+            path (str): データベースのファイル (":memory:" も可)
+            batch_size (int, optional): 1回のexecutemanyで書き込む件数. Defaults to 10000.
+        """
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            for sql in self.SCHEMA:
+                self.connection.execute(sql)
+
+    def Write(self, intervals) -> int:
+        """期間をまとめて書き込む (1回のトランザクション)
+
+        Args:
+            intervals : Intervalのイテレータ
+        Returns:
+            int: 書き込んだ件数
+        """
+        sql = "INSERT OR REPLACE INTO intervals (kind, address, network, start, end) VALUES (?, ?, ?, ?, ?)"
+        count = 0
+        batch = []
+        with self.connection:
+            for interval in intervals:
+                batch.append(self.__Row(interval))
+                if len(batch) >= self.batch_size:
+                    self.connection.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                self.connection.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+    def Query(self, address : str = None, network : str = None, kind : str = None,
+              since : datetime = None, until : datetime = None) -> list:
+        """条件に合う期間を開始時刻の順に返す
+
+        Args:
+            address (str, optional): サーバのアドレス. Defaults to None.
+            network (str, optional): ネットワークアドレス ("10.20.0.0/16" のプレフィックス長は無視する). Defaults to None.
+            kind (str, optional): "broken" / "overload" / "switch_broken". Defaults to None.
+            since (datetime, optional): この時刻以降に続いていた期間. Defaults to None.
+            until (datetime, optional): この時刻以前に始まった期間. Defaults to None.
+        Returns:
+            list: Intervalのリスト
+        """
+        where = []
+        params = []
+        if address is not None:
+            where.append("address = ?")
+            params.append(address)
+        if network is not None:
+            where.append("network = ?")
+            params.append(network.split('/')[0])
+        if kind is not None:
+            where.append("kind = ?")
+            params.append(kind)
+        if until is not None:
+            where.append("start <= ?")
+            params.append(str(until))
+        if since is not None:
+            where.append("(end IS NULL OR end >= ?)")
+            params.append(str(since))
+        sql = "SELECT kind, address, start, end FROM intervals"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start, address, kind"
+        return [
+            Interval(kind, addr, datetime.fromisoformat(start), None if end is None else datetime.fromisoformat(end))
+            for kind, addr, start, end in self.connection.execute(sql, params)
+        ]
+
+    def Close(self):
+        self.connection.close()
+
+    @staticmethod
+    def __Row(interval : Interval) -> tuple:
+        """Intervalをテーブルの1行にする (スイッチ故障のアドレスはネットワークアドレス)
+        """
+        if interval.kind == "switch_broken":
+            network = interval.address
+        else:
+            network = network_of(interval.address)
+        end = None if interval.end is None else str(interval.end)
+        return (interval.kind, interval.address, network, str(interval.start), end)
+
+
+class IntervalIndex:
+    """故障・過負荷・スイッチ故障の期間の索引 (区間木)
+
+    Description:
+        ある時刻に続いていた期間(Stab)と、ある時間帯に重なる期間(Overlap)を O(log n + k) で返す。
+        区間木の各節点は中心の時刻をまたぐ期間を、開始順と終了の逆順の2通りで持つ。
+        時間帯に重なる期間は「開始時刻に続いていた期間」と「時間帯の中で始まった期間」に分けて求める。
+        継続中の期間 (end is None) はいつまでも続いているものとして扱う。
+    """
+
+    def __init__(self, intervals = ()):
+        """
+        Args:
+            intervals : Intervalのイテレータ. Defaults to ().
+        """
+        self.intervals = sorted(intervals, key=self.__SortKey)
+        self.starts = [x.start for x in self.intervals]
+        self.root = self.__Build(self.intervals)
+
+    def Stab(self, at : datetime) -> list:
+        """時刻atに続いていた期間を返す
+
+        Args:
+            at (datetime): 時刻
+        Returns:
+            list: Intervalのリスト (開始順)
+        """
+        result = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if at < center:
+                for x in by_start:
+                    if x.start > at:
+                        break
+                    result.append(x)
+                node = left
+            elif at > center:
+                for x in by_end:
+                    if self.__End(x) < at:
+                        break
+                    result.append(x)
+                node = right
+            else:
+                result.extend(by_start)
+                break
+        result.sort(key=self.__SortKey)
+        return result
+
+    def Overlap(self, since : datetime, until : datetime) -> list:
+        """時間帯 [since, until] に重なる期間を返す
+
+        Args:
+            since (datetime): 時間帯の始まり
+            until (datetime): 時間帯の終わり
+        Returns:
+            list: Intervalのリスト (開始順)
+        """
+        result = self.Stab(since)
+        lo = bisect.bisect_right(self.starts, since)
+        hi = bisect.bisect_right(self.starts, until)
+        result.extend(self.intervals[lo:hi])
+        result.sort(key=self.__SortKey)
+        return result
+
+    def Save(self, path : str):
+        """索引をJSONで保存する (時刻は出力と同じ文字列、継続中の終了はnull)
+        """
+        rows = [[x.kind, x.address, str(x.start), None if x.end is None else str(x.end)] for x in self.intervals]
+        with open(path, "w", encoding="utf-8") as fout:
+            json.dump({"intervals": rows}, fout)
+
+    @classmethod
+    def Load(cls, path : str):
+        """Saveで保存した索引を読み込む
+        """
+        with open(path, "r", encoding="utf-8") as fin:
+            rows = json.load(fin)["intervals"]
+        return cls(
+            Interval(kind, address, datetime.fromisoformat(start), None if end is None else datetime.fromisoformat(end))
+            for kind, address, start, end in rows)
+
+    @staticmethod
+    def __SortKey(interval : Interval):
+        return (interval.start, interval.address, interval.kind)
+
+    @staticmethod
+    def __End(interval : Interval) -> datetime:
+        return datetime.max if interval.end is None else interval.end
+
+    @classmethod
+    def __Build(cls, intervals : list):
+        """開始順の期間から区間木を作る。節点は (中心, 開始順, 終了の逆順, 左, 右)
+        """
+        if not intervals:
+            return None
+        center = intervals[len(intervals) // 2].start
+        left = []
+        middle = []
+        right = []
+        for x in intervals:
+            if cls.__End(x) < center:
+                left.append(x)
+            elif x.start > center:
+                right.append(x)
+            else:
+                middle.append(x)
+        by_end = sorted(middle, key=cls.__End, reverse=True)
+        return (center, middle, by_end, cls.__Build(left), cls.__Build(right))
+
+
+class RollupSeries:
+    """1つのアドレス・1つの粒度の集計 (区間毎の 件数・合計・最小・最大・応答なし の配列)
+
+    Description:
+        i番目の要素が origin + i * 粒度 から始まる区間の集計になる。
+        件数・合計・最小・最大は応答時間があった行、応答なしはStatusTableで応答なしに分類した行の数。
+        件数が0の区間の最小・最大は意味を持たない。
+        どの配列も64bit整数で、応答時間はMAX_VALUEまで入る。(他の処理方法と同じく、32bitを超える値も扱う)
+    """
+    __slots__ = ("count", "total", "minimum", "maximum", "failed")
+    EMPTY_MIN = (1 << 63) - 1
+    MAX_VALUE = EMPTY_MIN - 1
+
+    def __init__(self, length : int = 0):
+        self.count = array("q", bytes(8 * length))
+        self.total = array("q", bytes(8 * length))
+        self.minimum = array("q", [self.EMPTY_MIN]) * length
+        self.maximum = array("q", bytes(8 * length))
+        self.failed = array("q", bytes(8 * length))
+
+    def __len__(self):
+        return len(self.count)
+
+    def Grow(self, length : int):
+        """区間の数をlengthまで増やす (後ろに空の区間を足す)
+        """
+        n = length - len(self.count)
+        if n > 0:
+            self.count.extend(array("q", bytes(8 * n)))
+            self.total.extend(array("q", bytes(8 * n)))
+            self.minimum.extend(array("q", [self.EMPTY_MIN]) * n)
+            self.maximum.extend(array("q", bytes(8 * n)))
+            self.failed.extend(array("q", bytes(8 * n)))
+
+    def Prepend(self, n : int):
+        """先頭にn区間の空の区間を足す (originより前の行が来たとき)
+        """
+        head = RollupSeries(n)
+        for name in self.__slots__:
+            arr = getattr(head, name)
+            arr.extend(getattr(self, name))
+            setattr(self, name, arr)
+
+    def AddSeries(self, other, factor : int = 1):
+        """他の集計を足し込む。factor > 1 のときは、otherのfactor区間を1区間にまとめる
+        """
+        self.Grow((len(other) + factor - 1) // factor)
+        count, total, minimum, maximum, failed = self.count, self.total, self.minimum, self.maximum, self.failed
+        for i in range(len(other)):
+            c = other.count[i]
+            f = other.failed[i]
+            if c == 0 and f == 0:
+                continue
+            j = i // factor
+            failed[j] += f
+            if c > 0:
+                count[j] += c
+                total[j] += other.total[i]
+                if other.minimum[i] < minimum[j]:
+                    minimum[j] = other.minimum[i]
+                if other.maximum[i] > maximum[j]:
+                    maximum[j] = other.maximum[i]
+
+
+class Rollup:
+    """応答時間の多段の集計 (1分・5分・1時間)
+
+    Description:
+        取り込み中にアドレス毎の1分の集計を配列に足していき、Finishで
+        5分は1分から、1時間は5分から、ネットワーク毎の集計はアドレスの集計から作る。
+        区間の起点(origin)は最初の行の時刻を1時間で切り捨てたもので、すべての粒度で共通。
+        保存した集計を読み込めば、ログを読み直さずに粗い粒度の少ない区間だけで長い期間を問い合わせられる。
+    """
+    LEVELS = (60, 300, 3600)
+    MAGIC = b"SLOGRUP2"     # 配列を64bit整数にした形式
+
+    def __init__(self, levels : tuple = LEVELS, table : StatusTable = None):
+        """
+        Args:
+            levels (tuple, optional): 粒度[秒]。細かい順で、それぞれが前の粒度の倍数であること。Defaults to LEVELS.
+            table (StatusTable, optional): 応答なしとして数える状態の分類. Defaults to None (既定の分類).
+        """
+        for finer, coarser in zip(levels, levels[1:]):
+            if coarser % finer != 0:
+                raise ValueError(f"rollup level {coarser} is not a multiple of {finer}")
+        self.levels = tuple(levels)
+        self.table = status_table() if table is None else table
+        self.origin = None
+        self.series = {}    # {アドレス or ネットワーク : {粒度 : RollupSeries}}
+        self.__base = {}    # {アドレス : 最も細かい粒度のRollupSeries} (取り込み中)
+        self.__last_datetime = None
+        self.__last_seconds = 0
+
+    def Add(self, log : LogLine):
+        """1行分を最も細かい粒度の集計に足す
+        """
+        dt = log.datetime
+        if dt is not self.__last_datetime:
+            self.__last_datetime = dt
+            self.__last_seconds = datetime_to_seconds(dt)
+        seconds = self.__last_seconds
+        if self.origin is None:
+            self.origin = seconds - seconds % self.levels[-1]
+        idx = (seconds - self.origin) // self.levels[0]
+        if idx < 0:
+            self.__Rebase(idx)
+            idx = (seconds - self.origin) // self.levels[0]
+
+        series = self.__base.get(log.address)
+        if series is None:
+            series = self.__base[log.address] = RollupSeries()
+        if idx >= len(series.count):
+            # 1区間ずつ伸ばさないように、まとめて確保する
+            series.Grow(idx + 1 + len(series.count) // 2)
+
+        rt = log.response_time
+        if rt != -1:
+            if rt > RollupSeries.MAX_VALUE:
+                raise ValueError(f"response time {rt} is too large for the rollup (max {RollupSeries.MAX_VALUE})")
+            series.count[idx] += 1
+            series.total[idx] += rt
+            minimum = series.minimum
+            if rt < minimum[idx]:
+                minimum[idx] = rt
+            maximum = series.maximum
+            if rt > maximum[idx]:
+                maximum[idx] = rt
+        elif self.table.lookup.get(log.state):
+            series.failed[idx] += 1
+
+    def Finish(self):
+        """取り込みを終えて、粗い粒度とネットワーク毎の集計を作る
+        """
+        if self.origin is None:
+            return self
+        length = max((self.__Used(x) for x in self.__base.values()), default=0)
+        for addr, base in self.__base.items():
+            base.Grow(length)
+            del base.count[length:], base.total[length:], base.minimum[length:], base.maximum[length:], base.failed[length:]
+            self.series[addr] = {self.levels[0]: base}
+            network = self.series.setdefault(network_of(addr), {})
+            network.setdefault(self.levels[0], RollupSeries(length)).AddSeries(base)
+        self.__base = {}
+        for levels in self.series.values():
+            for finer, coarser in zip(self.levels, self.levels[1:]):
+                levels[coarser] = RollupSeries()
+                levels[coarser].AddSeries(levels[finer], coarser // finer)
+        return self
+
+    def Query(self, key : str, level : int, since : datetime = None, until : datetime = None) -> list:
+        """アドレスかネットワークの、ある粒度の集計を返す (行がなかった区間は除く)
+
+        Args:
+            key (str): アドレス ex.) "10.20.30.1/16"、または、ネットワーク ex.) "10.20.0.0"
+            level (int): 粒度[秒]
+            since (datetime, optional): この時刻を含む区間から. Defaults to None.
+            until (datetime, optional): この時刻を含む区間まで. Defaults to None.
+        Returns:
+            list: [(区間の開始時刻, 件数, 合計, 最小, 最大, 応答なし), ...] 件数が0の区間の最小・最大はNone
+        """
+        series = self.series.get(key, {}).get(level)
+        if series is None:
+            return []
+        lo = 0 if since is None else max((datetime_to_seconds(since) - self.origin) // level, 0)
+        hi = len(series) if until is None else min((datetime_to_seconds(until) - self.origin) // level + 1, len(series))
+        result = []
+        for i in range(lo, hi):
+            c = series.count[i]
+            f = series.failed[i]
+            if c == 0 and f == 0:
+                continue
+            start = seconds_to_datetime(self.origin + i * level)
+            if c == 0:
+                result.append((start, 0, 0, None, None, f))
+            else:
+                result.append((start, c, series.total[i], series.minimum[i], series.maximum[i], f))
+        return result
+
+    def Save(self, path : str):
+        """集計を保存する (先頭に MAGIC、JSONのヘッダの長さとヘッダ、続けて配列のbyte列)
+        """
+        entries = []
+        for key in sorted(self.series):
+            for level in self.levels:
+                entries.append([key, level, len(self.series[key][level])])
+        header = json.dumps({"origin": self.origin, "levels": list(self.levels), "entries": entries}).encode("utf-8")
+        with open(path, "wb") as fout:
+            fout.write(self.MAGIC)
+            fout.write(struct.pack("<Q", len(header)))
+            fout.write(header)
+            for key, level, _ in entries:
+                series = self.series[key][level]
+                for name in RollupSeries.__slots__:
+                    getattr(series, name).tofile(fout)
+
+    @classmethod
+    def Load(cls, path : str):
+        """Saveで保存した集計を読み込む
+        """
+        with open(path, "rb") as fin:
+            if fin.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"not a rollup file : {path}")
+            size, = struct.unpack("<Q", fin.read(8))
+            header = json.loads(fin.read(size).decode("utf-8"))
+            rollup = cls(tuple(header["levels"]))
+            rollup.origin = header["origin"]
+            for key, level, length in header["entries"]:
+                series = RollupSeries()
+                for name in RollupSeries.__slots__:
+                    getattr(series, name).fromfile(fin, length)
+                rollup.series.setdefault(key, {})[level] = series
+        return rollup
+
+    def __Rebase(self, idx : int):
+        """originより前の行が来たので、originを1番粗い粒度の単位で前にずらす
+        """
+        step = self.levels[-1] // self.levels[0]
+        n = (-idx + step - 1) // step * step
+        self.origin -= n * self.levels[0]
+        for series in self.__base.values():
+            series.Prepend(n)
+
+    @staticmethod
+    def __Used(series : RollupSeries) -> int:
+        """行があった最後の区間までの長さ
+        """
+        for i in range(len(series) - 1, -1, -1):
+            if series.count[i] or series.failed[i]:
+                return i + 1
+        return 0
+
+
+class IntervalRing:
+    """プロセス間でIntervalを受け渡す、共有メモリ上の固定長レコードのリングバッファ
+
+    Description:
+        書き込み側(ワーカ)1つと、読み出し側(親プロセス)1つで使う。
+        先頭に [書いた数, 読んだ数, 書き込み終了フラグ] を置き、その後ろに固定長のレコードを並べる。
+        先頭の3つはネイティブの8byte整数のmemoryviewで1回で読み書きする。
+        (structの"<q"は1byteずつ書くので、途中の値を読んで読んだ数を戻してしまい、同じレコードを2回読むことがある)
+        レコードはstructで共有メモリを直接読み書きするので、pickleでの受け渡しが発生しない。
+        いっぱいの時は、書き込み側が読み出されるまで待つ。
+    """
+    HEADER = struct.Struct("<qqq")
+    RECORD = struct.Struct("<B7xqqq48s")    # 種類, 順番, 開始[秒], 終了[秒], アドレス
+    KINDS = ("broken", "overload", "switch_broken", "host", "anomaly", "category", "parse")
+    VALUE_KINDS = ("category", "parse")     # 時刻の代わりに2つの整数を持つ種類 (分類の番号と回数、空行と隔離した行の数)
+    NO_END = -(1 << 63)                     # 継続中 (Interval.endがNone)
+
+    def __init__(self, capacity : int = 4096, name : str = None):
+        """
+        Args:
+            capacity (int, optional): 保持できるレコード数. Defaults to 4096.
+            name (str, optional): 既存の共有メモリの名前。Noneの場合は新しく作る. Defaults to None.
+        """
+        self.capacity = capacity
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER.size + self.RECORD.size * capacity)
+            self.HEADER.pack_into(self.shm.buf, 0, 0, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.header = self.shm.buf[:self.HEADER.size].cast("q")
+
+    def Put(self, kind : str, order : int, start : datetime, end : datetime, address : str):
+        """レコードを1件書き込む。いっぱいの時は空くまで待つ
+
+        Args:
+            kind (str): KINDSのいずれか
+            order (int): 結果を並べる順番 (アドレスがファイルに最初に出てきた行番号)
+            start (datetime): 開始時刻
+            end (datetime): 終了時刻。継続中はNone
+            address (str): アドレス
+        """
+        self.PutValues(kind, order, datetime_to_seconds(start), self.NO_END if end is None else datetime_to_seconds(end),
+            address)
+
+    def PutValues(self, kind : str, order : int, first : int, second : int, address : str = ""):
+        """時刻の代わりに2つの整数を持つレコードを1件書き込む。いっぱいの時は空くまで待つ
+
+        Args:
+            kind (str): KINDSのいずれか (VALUE_KINDS以外は、firstとsecondが開始と終了の秒数)
+            order (int): 結果を並べる順番
+            first (int): 1つ目の値
+            second (int): 2つ目の値
+            address (str, optional): アドレス. Defaults to "".
+        """
+        header = self.header
+        head = header[0]
+        while head - header[1] >= self.capacity:
+            time.sleep(0.0005)
+        offset = self.HEADER.size + (head % self.capacity) * self.RECORD.size
+        self.RECORD.pack_into(self.shm.buf, offset, self.KINDS.index(kind), order, first, second, address.encode("ascii"))
+        # レコードを書き終えてから書いた数を進める
+        header[0] = head + 1
+
+    def CloseWriter(self):
+        """書き込みが終わったことを読み出し側に知らせる
+        """
+        self.header[2] = 1
+
+    def Drain(self):
+        """読み出せるレコードをすべて読み出す
+
+        Returns:
+            (list, bool): [(種類, 順番, 開始, 終了, アドレス)] と、書き込みが終わってすべて読み出したか
+                (VALUE_KINDSの種類は、開始と終了の代わりに書き込んだ2つの整数)
+        """
+        buf = self.shm.buf
+        header = self.header
+        closed = header[2]
+        head = header[0]
+        tail = header[1]
+        records = []
+        for i in range(tail, head):
+            offset = self.HEADER.size + (i % self.capacity) * self.RECORD.size
+            kind, order, start, end, address = self.RECORD.unpack_from(buf, offset)
+            kind = self.KINDS[kind]
+            address = intern_address(address.rstrip(b"\0").decode("ascii"))
+            if kind in self.VALUE_KINDS:
+                records.append((kind, order, start, end, address))
+                continue
+            records.append((
+                kind,
+                order,
+                seconds_to_datetime(start),
+                None if end == self.NO_END else seconds_to_datetime(end),
+                address,
+            ))
+        header[1] = head
+        return records, bool(closed) and head == header[0]
+
+    def Close(self):
+        """共有メモリを閉じる (作った側は削除もする)
+        """
+        self.header.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+PARALLEL_BATCH_BYTES = 256 * 1024     # GetInfoParallelで、親プロセスがワーカ毎にまとめて送る行のbyte数
+
+def parallel_worker(line_queue, worker_index : int, ring_name : str, ring_capacity : int, options : dict,
+                    quarantine_file : str = None, report_queue = None):
+    """GetInfoParallelのワーカプロセス
+
+    Description:
+        親プロセスがアドレスのハッシュで分けて送る行 ((UTF-8のbyte列, 行番号のarray) のまとまり、最後はNone) を
+        1回だけデコード・変換して判定し、サーバ毎の観測期間と故障・過負荷のIntervalをリングバッファに書き込む。
+        応答なしの分類毎の回数と、空行・隔離した行の数も、リングバッファに固定長のレコードで書く。
+        (不正な行はファイルの行番号を付けて、ワーカ毎のquarantine_fileに書き出す)
+        report_queueがある場合は、担当分の平均応答時間と応答なしの回数のTopKReport (top_kを指定した場合) と
+        CoverageStats (coverage_bucket_secを指定した場合) を送る。
+    """
+    ring = IntervalRing(ring_capacity, name=ring_name)
+    reader = LogReader(quarantine_file)
+    try:
+        first_line = {}     # アドレスがファイルに最初に出てきた行番号 (不正な行は除く)
+        current = [0]       # 今変換している行の行番号
+
+        def numbered_lines():
+            while True:
+                batch = line_queue.get()
+                if batch is None:
+                    return
+                data, numbers = batch
+                for number, line in zip(numbers, data.decode("utf-8", "surrogateescape").split("\n")):
+                    current[0] = number
+                    yield number, line
+
+        def logs():
+            for log in reader.Iter(numbered_lines(), numbered=True):
+                if log.address not in first_line:
+                    first_line[log.address] = current[0]
+                yield log
+
+        parser = ServerLogParser()
+        parser.ParseLogRecords(logs(), reader.counters)
+        for addr, server_log in parser.ServerLogs.items():
+            ring.Put("host", first_line[addr], server_log[0].datetime, server_log[-1].datetime, addr)
+        for interval in parser.IterIntervals(**options):
+            ring.Put(interval.kind, first_line[interval.address], interval.start, interval.end, interval.address)
+        categories = status_table(options["failure_codes"]).categories
+        for addr, counts in parser.FailureCategories.items():
+            for name, count in counts.items():
+                ring.PutValues("category", first_line[addr], categories.index(name), count, addr)
+        ring.PutValues("parse", 0, reader.counters["blank"], reader.counters["quarantined"])
+        if report_queue is not None:
+            report = None
+            if options["top_k"] > 0:
+                report = TopKReport(options["top_k"], status_table(options["failure_codes"]))
+                for addr, server_log in parser.ServerLogs.items():
+                    report.AddLogs(addr, server_log)
+            coverage = None
+            if options["coverage_bucket_sec"] > 0:
+                coverage = CoverageStats(options["coverage_bucket_sec"], table=status_table(options["failure_codes"]))
+                for server_log in parser.ServerLogs.values():
+                    coverage.AddLogs(server_log)
+            report_queue.put((report, coverage))
+    finally:
+        reader.Close()
+        ring.CloseWriter()
+        ring.Close()
+
+
+SHARD_MANIFEST = "manifest.json"
+
+def partition_log(filename : str, out_dir : str, shards : int, quarantine_file : str = None) -> dict:
+    """ログをネットワークアドレスのハッシュでshards個のファイルに分ける
+
+    Description:
+        同じネットワークのサーバは同じファイルに入るので、故障・過負荷に加えてスイッチ故障もファイル毎に判定できる。
+        out_dirには shard-NNN.log と、分けたファイルの一覧・アドレスが最初に出てきた順・ログ全体の最初と最後の時刻を
+        書いた manifest.json を作る。(ファイル毎の結果をまとめる時に、GetInfoと同じ順に並べるのに使う)
+
+    Args:
+        filename (str): 対象にするログファイルのパス
+        out_dir (str): 書き出し先のディレクトリ
+        shards (int): 分ける数
+        quarantine_file (str, optional): 不正な行の書き出し先. Defaults to None.
+    Returns:
+        dict: manifest.json の内容
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    names = [f"shard-{i:03d}.log" for i in range(shards)]
+    outputs = [open(os.path.join(out_dir, x), "w", encoding="utf-8") for x in names]
+    reader = LogReader(quarantine_file)
+    shard_of = {}
+    first_time = None
+    last_time = None
+    try:
+        for line in reader.Iter(iter_log_lines(filename), raw=True):
+            time_text, addr, _ = line.split(',', 2)
+            shard = shard_of.get(addr)
+            if shard is None:
+                shard = shard_of[addr] = zlib.crc32(network_of(addr).encode("utf-8")) % shards
+            outputs[shard].write(line if line.endswith("\n") else line + "\n")
+            # 時刻は固定長なので文字列のまま比べる
+            if first_time is None or time_text < first_time:
+                first_time = time_text
+            if last_time is None or time_text > last_time:
+                last_time = time_text
+    finally:
+        reader.Close()
+        for fout in outputs:
+            fout.close()
+
+    manifest = {
+        "source": os.path.abspath(filename),
+        "shards": names,
+        "addresses": list(shard_of),
+        "first_time": None if first_time is None else str(datetime.strptime(first_time, '%Y%m%d%H%M%S')),
+        "last_time": None if last_time is None else str(datetime.strptime(last_time, '%Y%m%d%H%M%S')),
+        "parse": reader.counters,
+    }
+    with open(os.path.join(out_dir, SHARD_MANIFEST), "w", encoding="utf-8") as fout:
+        json.dump(manifest, fout)
+    return manifest
+
+
+def run_shard(manifest_file : str, shard_index : int, out_file : str = None, **options) -> str:
+    """partition_logで分けた1ファイルを判定して、結果をJSONで書き出す
+
+    Description:
+        サーバ毎の観測期間・応答時間の合計と回数・応答なしの回数と、故障・過負荷・スイッチ故障の期間、
+        応答なしの分類毎の回数、ネットワーク・時間帯毎のサーバの数のHyperLogLogを書く。
+        スイッチ故障の離脱の判定にはログ全体の最後の時刻を使う。(manifest.json から読む)
+        別のマシンで実行する場合は、manifest.json と担当の shard-NNN.log を同じディレクトリに置く。
+
+    Args:
+        manifest_file (str): manifest.json のパス
+        shard_index (int): 担当するファイルの番号
+        out_file (str, optional): 書き出し先. Defaults to None (shard-NNN.json).
+        options : 判定条件 (GetInfoと同じ)
+    Returns:
+        str: 書き出したファイルのパス
+    """
+    with open(manifest_file, "r", encoding="utf-8") as fin:
+        manifest = json.load(fin)
+    shard_dir = os.path.dirname(os.path.abspath(manifest_file))
+    shard_file = os.path.join(shard_dir, manifest["shards"][shard_index])
+    if out_file is None:
+        out_file = os.path.splitext(shard_file)[0] + ".json"
+
+    opts = DetectOptions(**options)
+    lookup = status_table(opts.failure_codes).lookup
+    parser = ServerLogParser()
+    parser.ParseLogFile(shard_file)
+    if manifest["last_time"] is not None:
+        parser.Inventory.last_time = datetime.fromisoformat(manifest["last_time"])
+    hosts = []
+    for addr in parser.ServerLogs:
+        server_log = parser.ServerLogs[addr]
+        latency_sum = samples = failed = 0
+        for log in server_log:
+            if lookup.get(log.state):
+                failed += 1
+            elif log.response_time != -1:
+                latency_sum += log.response_time
+                samples += 1
+        hosts.append([addr, str(server_log[0].datetime), str(server_log[-1].datetime), latency_sum, samples, failed])
+    intervals = [[x.kind, x.address, str(x.start), None if x.end is None else str(x.end)]
+                 for _, network_intervals in parser.IterNetworkIntervals(**options) for x in network_intervals]
+    coverage = None
+    if opts.coverage_bucket_sec > 0:
+        coverage = CoverageStats(opts.coverage_bucket_sec, table=status_table(opts.failure_codes))
+        for server_log in parser.ServerLogs.values():
+            coverage.AddLogs(server_log)
+        coverage = coverage.Dump()
+    with open(out_file, "w", encoding="utf-8") as fout:
+        json.dump({"hosts": hosts, "intervals": intervals, "categories": parser.FailureCategories, "coverage": coverage}, fout)
+    return out_file
+
+
+class ServerLogParser:
+    """_summary_
+
+    Returns:
+    """
+    broken_codes = ["-"]
+    ServerLogs = {}
+    Return_data = {
+        "broken":[],
+        "overload":[]
+    }
+    result_cache_size = 32      # GetInfoの結果を保持する件数 (LRU)
+
+    def __init__(self, filename : str = ""):
+        self.result_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.__sweep_tables = None
+        self.Inventory = HostInventory()
+        self.ParseStats = {}
+        self.MemoryStats = {}
+        self.CurrentStats = {}
+        self.FailureCategories = {}     # {アドレス : {分類名 : 回数}} (直前の判定の、故障期間の応答なしの分類毎の回数)
+        self.Coverage = None            # ParseLogFileで数えたCoverageStats
+        self.__spiller = None
+        if filename != "":
+            self.ParseLogFile(filename)
+        return
+
+    def ParseLogFile(self, filename : str, quarantine_file : str = None, memory_limit_bytes : int = 0, tmp_dir : str = None,
+                     rollup : Rollup = None, coverage : CoverageStats = None, since : datetime = None, until : datetime = None):
+        """
+        Description:
+            ログの中から、故障したことがあるサーバを特定する。
+            得られる故障期間を出力するが、回復しない場合は現在までの時間を算出する。
+            重複がある場合は、
+        Args:
+            対象にするログファイルのパス (アーカイブ形式の場合は先頭で判定して読む)
+            quarantine_file : 不正な行の書き出し先 (件数はParseStatsに入る。アーカイブは変換時に検査済みなので使わない)
+            memory_limit_bytes : 保持するログの上限[byte]。超えた分は一時ファイルに書き出す (0 : 上限なし、使用量はMemoryStatsに入る)
+            tmp_dir : 書き出し先
+            rollup : 読みながら応答時間を集計する先 (読み終えたら粗い粒度も作る)
+            coverage : 読みながらネットワーク・時間帯毎のサーバの数を数える先 (Coverageに入り、GetInfoで使う)
+            since, until : この時刻の範囲の行だけを読む (アーカイブ形式の場合は範囲外のブロックを展開せずに飛ばす)
+        Returns:
+            {
+                "サーバアドレス" : [
+                        {
+                            <LogLine>
+                        },
+                        {
+                            # 繰り返し 
+                        }
+                    ],
+                ... # 繰り返し
+            }
+
+        """
+        if is_archive(filename):
+            archive = ArchiveReader(filename)
+            return self.__ParseLogs(archive.Iter(since, until), archive.counters, memory_limit_bytes, tmp_dir, rollup, coverage)
+        with open_log(filename) as fin:
+            return self.ParseLogLines(fin, quarantine_file, memory_limit_bytes, tmp_dir, rollup, coverage, since, until)
+
+    def ParseLogLines(self, lines, quarantine_file : str = None, memory_limit_bytes : int = 0, tmp_dir : str = None,
+                      rollup : Rollup = None, coverage : CoverageStats = None, since : datetime = None, until : datetime = None):
+        """ParseLogFileのファイルの代わりに、ログの行のイテレータを読み込む
+
+        Args:
+            lines : ログの行のイテレータ
+            quarantine_file (str, optional): 不正な行の書き出し先. Defaults to None.
+            memory_limit_bytes (int, optional): 保持するログの上限[byte] (0 : 上限なし). Defaults to 0.
+            tmp_dir (str, optional): 上限を超えた分の書き出し先. Defaults to None.
+            rollup (Rollup, optional): 読みながら応答時間を集計する先. Defaults to None.
+            coverage (CoverageStats, optional): 読みながらネットワーク・時間帯毎のサーバの数を数える先. Defaults to None.
+            since (datetime, optional): この時刻より前の行を除く. Defaults to None.
+            until (datetime, optional): この時刻より後の行を除く. Defaults to None.
+        Returns:
+            ParseLogFileと同じ
+        """
+        reader = LogReader(quarantine_file)
+        logs = reader.Iter(lines)
+        if since is not None or until is not None:
+            logs = (log for log in logs
+                    if (since is None or log.datetime >= since) and (until is None or log.datetime <= until))
+        try:
+            return self.__ParseLogs(logs, reader.counters, memory_limit_bytes, tmp_dir, rollup, coverage)
+        finally:
+            reader.Close()
+
+    def ParseLogRecords(self, logs, counters : dict, memory_limit_bytes : int = 0, tmp_dir : str = None):
+        """ParseLogFileのファイルの代わりに、変換済みのLogLineのイテレータを読み込む (GetInfoParallelのワーカ)
+
+        Args:
+            logs : LogLineのイテレータ
+            counters (dict): 読み込みの件数 (LogReader.countersなど。読み終えるとParseStatsに入る)
+            memory_limit_bytes (int, optional): 保持するログの上限[byte] (0 : 上限なし). Defaults to 0.
+            tmp_dir (str, optional): 上限を超えた分の書き出し先. Defaults to None.
+        Returns:
+            ParseLogFileと同じ
+        """
+        return self.__ParseLogs(logs, counters, memory_limit_bytes, tmp_dir)
+
+    def __ParseLogs(self, logs, counters : dict, memory_limit_bytes : int, tmp_dir : str, rollup : Rollup = None,
+                    coverage : CoverageStats = None):
+        """LogLineのイテレータを読み込む (ParseLogFile / ParseLogLinesの本体)
+        """
+        # clear
+        self.ServerLogs = {}
+        self.result_cache.clear()
+        self.__sweep_tables = None
+        self.Inventory = HostInventory()
+        if self.__spiller is not None:
+            self.__spiller.Close()
+        spiller = self.__spiller = LogSpiller(memory_limit_bytes, tmp_dir) if memory_limit_bytes > 0 else None
+
+        # 上から読んでアドレス毎に振り分ける
+        self.Coverage = coverage
+        if spiller is None and rollup is None and coverage is None:
+            for log in logs:
+                self.__LogAppend(log)
+        else:
+            for log in logs:
+                self.__LogAppend(log)
+                if spiller is not None:
+                    spiller.Track(log.address, self.ServerLogs)
+                if rollup is not None:
+                    rollup.Add(log)
+                if coverage is not None:
+                    coverage.Add(log)
+        if rollup is not None:
+            rollup.Finish()
+        self.ParseStats = counters
+        self.MemoryStats = {} if spiller is None else spiller.counters
+        
+        # アドレス毎に時間順にログをソートして、ネットワーク毎のサーバ一覧に入れる
+        for addr in self.ServerLogs:
+            server_log = self.ServerLogs[addr]
+            server_log.sort(key=lambda x: x.datetime)
+            if spiller is not None and addr in spiller.spans:
+                self.Inventory.Observe(addr, *spiller.spans[addr])
+            if server_log:
+                self.Inventory.Observe(addr, server_log[0].datetime, server_log[-1].datetime)
+        
+        return iter(self.ServerLogs)
+
+    def GetInfo(self, min_access_count : int = 0, overload_average_count : int = 10, overload_limit_time_ms : int = 180000, **options):
+        """サーバー毎にログをパースして、応答がないipに関する情報を返す
+
+        Args:
+            min_access_count (int, optional): 最低の連続アクセス回数. Defaults to 0.
+            overload_average_count (int, optional): _description_. Defaults to 10.
+            overload_time_ms (int, optional): _description_. Defaults to 180000.
+            options : その他の判定条件 (DetectOptionsを参照)
+                overload_window_sec (int, optional): 0より大きい場合は回数ではなく直近W秒間で過負荷を判定する. Defaults to 0.
+                overload_window_mode (str, optional): 時間窓の集計方法 "average" / "max". Defaults to "average".
+                storm_bin_sec (int, optional): 0より大きい場合は同時多発故障を判定する. Defaults to 0.
+                storm_ratio (float, optional): 同時多発故障とみなす故障中のネットワークの割合. Defaults to 0.5.
+                top_k (int, optional): 0より大きい場合は故障回数などの上位K件を出す. Defaults to 0.
+                availability (bool, optional): Trueの場合は故障時間・MTBF・MTTR・稼働率を集計する. Defaults to False.
+                anomaly_alpha (float, optional): 0より大きい場合は応答時間の異常を判定する. Defaults to 0.
+                anomaly_k (float, optional): 異常とみなす標準偏差の倍数. Defaults to 3.0.
+                broken_close_count (int, optional): 故障期間を閉じる連続した応答の回数. Defaults to 1.
+                broken_merge_gap_sec (int, optional): この秒数未満の間隔の故障期間をつなげる. Defaults to 0.
+                failure_codes (tuple, optional): 応答なしとみなす (分類名, 状態) の組. Defaults to (("broken", "-"),).
+                coverage_bucket_sec (int, optional): 0より大きい場合はネットワーク・時間帯毎のサーバの数を出す. Defaults to 0.
+
+        Returns:
+            _type_: 故障、または、
+
+        """
+        opts = DetectOptions(min_access_count, overload_average_count, overload_limit_time_ms, **options)
+        cached = self.__GetCache(opts)
+        if cached is not None:
+            self.Return_data = cached
+            return self.Return_data
+
+        # 各アドレス事の検査
+        report = None
+        if opts.top_k > 0:
+            report = TopKReport(opts.top_k, status_table(opts.failure_codes))
+            for addr in self.ServerLogs:
+                report.AddLogs(addr, self.__Logs(addr))
+        coverage = None
+        if opts.coverage_bucket_sec > 0:
+            coverage = self.__Coverage(opts)
+        self.Return_data = self.__BuildReturnData(self.__IterIntervals(opts), opts, self.__LogSpan, report, coverage=coverage)
+
+        self.__SetCache(opts, self.Return_data)
+        return self.Return_data        
+
+    def IterIntervals(self, **options):
+        """サーバ毎に故障・過負荷の期間を順に返すジェネレータ
+
+        Description:
+            判定はサーバ毎に必要になった時に行うので、途中で止めれば残りのサーバは判定しない。
+            引数はGetInfoと同じ。
+
+        Yields:
+            Interval: サーバ毎に故障 → 過負荷の順で、それぞれ時間順
+        """
+        return self.__IterIntervals(DetectOptions(**options))
+
+    def IterNetworkIntervals(self, **options):
+        """ネットワーク毎に、所属するサーバの期間とスイッチ故障の期間を順に返すジェネレータ
+
+        Description:
+            ネットワークはアドレスが最初に出てきた順。1ネットワーク分ずつ判定する。
+            引数はGetInfoと同じ。
+
+        Yields:
+            (str, list): ネットワークアドレスと、そのネットワークのIntervalのリスト (スイッチ故障は最後)
+        """
+        opts = DetectOptions(**options)
+        networks = {}
+        for addr in self.ServerLogs:
+            networks.setdefault(network_of(addr), []).append(addr)
+
+        table = status_table(opts.failure_codes)
+        self.FailureCategories = {}
+        for network, addresses in networks.items():
+            intervals = []
+            for addr in addresses:
+                broken_detector = self.__CreateDetectors(opts)[0]
+                intervals.extend(self.__RunDetector(broken_detector, self.__Logs(addr)))
+                self.__RecordCategories(addr, broken_detector, table)
+            broken_log = list(intervals)
+            for addr in addresses:
+                server_log = self.__Logs(addr)
+                for detector in self.__CreateDetectors(opts)[1:]:
+                    intervals.extend(self.__RunDetector(detector, server_log))
+            intervals.extend(self.__checkSwitchBroken(broken_log, opts))
+            yield network, intervals
+
+    def BuildIntervalIndex(self, **options) -> IntervalIndex:
+        """故障・過負荷・スイッチ故障の期間から、時刻で検索する索引を作る
+
+        Args:
+            options : 判定条件 (GetInfoと同じ)
+        Returns:
+            IntervalIndex: 索引
+        """
+        return IntervalIndex(x for _, intervals in self.IterNetworkIntervals(**options) for x in intervals)
+
+    def StoreIntervals(self, store : IntervalStore, **options) -> int:
+        """故障・過負荷・スイッチ故障の期間をIntervalStoreに書き込む
+
+        Args:
+            store (IntervalStore): 書き込み先
+            options : 判定条件 (GetInfoと同じ)
+        Returns:
+            int: 書き込んだ件数
+        """
+        return store.Write(x for _, intervals in self.IterNetworkIntervals(**options) for x in intervals)
+
+    def GetInfoSweep(self, min_access_counts : list, overload_average_counts : list, overload_limit_times_ms : list,
+                     switch_threshold : float = 1.0, switch_member_timeout_sec : int = 0,
+                     failure_codes : tuple = DEFAULT_FAILURE_CODES):
+        """N, m, t の全組み合わせの結果を、1回のパースからまとめて求める
+
+        Description:
+            故障の連続回数はサーバ毎に1回だけ求めておき、Nごとの結果はそれを絞り込むだけにする。
+            応答時間の累積和もサーバ毎に1回だけ求め、すべてのmで共有する。
+            (スイッチの故障はNだけで決まるので、Nごとに1回だけ求める)
+            求めた結果はGetInfoと同じLRUに入るので、後から同じ条件でGetInfoを呼ぶと再計算しない。
+
+        Args:
+            min_access_counts (list): Nの一覧
+            overload_average_counts (list): mの一覧
+            overload_limit_times_ms (list): tの一覧
+            switch_threshold (float, optional): GetInfoと同じ. Defaults to 1.0.
+            switch_member_timeout_sec (int, optional): GetInfoと同じ. Defaults to 0.
+            failure_codes (tuple, optional): GetInfoと同じ. Defaults to DEFAULT_FAILURE_CODES.
+
+        Returns:
+            dict: {(N, m, t) : GetInfoと同じ形式の結果}
+        """
+        switch_options = dict(switch_threshold=switch_threshold, switch_member_timeout_sec=switch_member_timeout_sec,
+                              failure_codes=failure_codes)
+        table = status_table(failure_codes)
+        if self.__sweep_tables is None or self.__sweep_tables[0] is not table:
+            self.__sweep_tables = (table, self.__BuildSweepTables(table))
+        tables = self.__sweep_tables[1]
+
+        # Nごとの故障とスイッチの故障 (既定以外の分類では、分類毎の回数も)
+        broken_results = {}
+        for n in min_access_counts:
+            broken = []
+            categories = []
+            for addr, (runs, _, _) in tables.items():
+                counts = [0] * (len(table.categories) + 1)
+                for count, first_broken, last_broken, repaired, run_counts in runs:
+                    if count >= n:
+                        broken.append(Interval("broken", addr, first_broken, last_broken if repaired else None))
+                        for i, c in enumerate(run_counts):
+                            counts[i] += c
+                categories.extend(f"{addr},{name},{counts[i + 1]}"
+                                  for i, name in enumerate(table.categories) if counts[i + 1] > 0)
+            switch_broken = self.__checkSwitchBroken(broken, DetectOptions(**switch_options))
+            broken_results[n] = ([format_interval(x) for x in broken], [format_interval(x) for x in switch_broken],
+                                 categories)
+
+        # (m, t)ごとの過負荷
+        overload_results = {}
+        for m in overload_average_counts:
+            for t in overload_limit_times_ms:
+                overload = []
+                for addr, (_, times, prefix) in tables.items():
+                    overload.extend(format_interval(x) for x in self.__OverloadFromPrefix(addr, times, prefix, m, t))
+                overload_results[(m, t)] = overload
+
+        return_data = {}
+        for n in min_access_counts:
+            for m in overload_average_counts:
+                for t in overload_limit_times_ms:
+                    broken, switch_broken, categories = broken_results[n]
+                    result = {
+                        "broken": list(broken),
+                        "overload": list(overload_results[(m, t)]),
+                        "switch_broken": list(switch_broken),
+                    }
+                    if not table.is_default:
+                        result["failure_categories"] = list(categories)
+                    self.__SetCache(DetectOptions(n, m, t, **switch_options), result)
+                    return_data[(n, m, t)] = result
+
+        return return_data
+
+    def GetInfoExternal(self, filename : str, memory_limit_bytes : int = 64 * 1024 * 1024, tmp_dir : str = None,
+                        quarantine_file : str = None, **options):
+        """ファイル全体をメモリに載せずに、ParseLogFile + GetInfoと同じ結果を返す
+
+        Description:
+            ExternalLogSorterで時刻順に並べ替えた行を、サーバ毎の判定器に1行ずつ流す。
+            メモリに残るのはソート用のバッファと、サーバ毎の判定器の状態と結果だけになる。
+            結果の並びはGetInfoと同じく、ファイル内でアドレスが最初に出てきた順にする。
+
+        Args:
+            filename (str): 対象にするログファイルのパス
+            memory_limit_bytes (int, optional): ソート用に保持する行の上限[byte]. Defaults to 64MB.
+            tmp_dir (str, optional): ソート途中のファイルの置き場所. Defaults to None.
+            quarantine_file (str, optional): 不正な行の書き出し先. Defaults to None.
+            options : 判定条件 (GetInfoと同じ)
+
+        Returns:
+            GetInfoと同じ
+        """
+        opts = DetectOptions(**options)
+        sorter = ExternalLogSorter(memory_limit_bytes, tmp_dir)
+        reader = LogReader(quarantine_file)
+        address_order = {}
+        first_time = None
+        last_time = None
+        try:
+            for line in reader.Iter(iter_log_lines(filename), raw=True):
+                addr = line.split(',', 2)[1]
+                if addr not in address_order:
+                    address_order[intern_address(addr)] = None
+                sorter.Add(line)
+            self.ParseStats = reader.counters
+
+            # アドレス毎に (判定器の一覧, 結果, [最初の時刻, 最後の時刻], [応答時間の合計, 回数])
+            states = {}
+            report = TopKReport(opts.top_k, status_table(opts.failure_codes)) if opts.top_k > 0 else None
+            coverage = self.__NewCoverage(opts)
+            for log in LogReader().Iter(sorter.Merge()):
+                if first_time is None:
+                    first_time = log.datetime
+                last_time = log.datetime
+                self.__FeedDetectors(states, log, opts, report)
+                if coverage is not None:
+                    coverage.Add(log)
+        finally:
+            reader.Close()
+            sorter.Close()
+
+        self.Return_data = self.__FinishDetectors(states, address_order, first_time, last_time, opts, report, coverage)
+        return self.Return_data
+
+    def GetInfoStream(self, lines, allowed_lateness_sec : int = 0, quarantine_file : str = None, **options):
+        """時刻順とは限らない行のイテレータを、全体を並べ替えずに判定する
+
+        Description:
+            WatermarkReordererでアドレス毎に少しだけ並べ直してから、サーバ毎の判定器に1行ずつ流す。
+            判定器に渡すのはウォーターマークより前になった行だけなので、期間もその時点で確定する。
+            許容する遅れより遅れて届いた行は判定に使わず、件数をParseStatsの"late"に入れる。
+            遅れた行がなければ、結果はParseLogFile + GetInfoと同じになる。
+
+        Args:
+            lines : ログの行のイテレータ (ファイルやパイプをそのまま渡せる)
+            allowed_lateness_sec (int, optional): 許容する遅れ[秒]. Defaults to 0.
+            quarantine_file (str, optional): 不正な行の書き出し先. Defaults to None.
+            options : 判定条件 (GetInfoと同じ)
+
+        Returns:
+            GetInfoと同じ
+        """
+        opts = DetectOptions(**options)
+        reader = LogReader(quarantine_file)
+        reorderer = WatermarkReorderer(allowed_lateness_sec)
+        address_order = {}
+        first_time = None
+        last_time = None
+        states = {}
+        report = TopKReport(opts.top_k, status_table(opts.failure_codes)) if opts.top_k > 0 else None
+        coverage = self.__NewCoverage(opts)
+        try:
+            for log in reader.Iter(lines):
+                released = reorderer.Push(log)
+                # 遅れて捨てた行でなければ、まだヒープに残っている
+                if log.address not in address_order and reorderer.heaps.get(log.address):
+                    address_order[log.address] = None
+                for x in released:
+                    if first_time is None or x.datetime < first_time:
+                        first_time = x.datetime
+                    if last_time is None or x.datetime > last_time:
+                        last_time = x.datetime
+                    self.__FeedDetectors(states, x, opts, report)
+                    if coverage is not None:
+                        coverage.Add(x)
+            for x in reorderer.Flush():
+                if first_time is None or x.datetime < first_time:
+                    first_time = x.datetime
+                if last_time is None or x.datetime > last_time:
+                    last_time = x.datetime
+                self.__FeedDetectors(states, x, opts, report)
+                if coverage is not None:
+                    coverage.Add(x)
+        finally:
+            reader.Close()
+        self.ParseStats = dict(reader.counters, late=reorderer.counters["late"], reordered=reorderer.counters["reordered"],
+                               buffered_high_water=reorderer.counters["buffered_high_water"])
+
+        self.Return_data = self.__FinishDetectors(states, address_order, first_time, last_time, opts, report, coverage)
+        return self.Return_data
+
+    def GetCurrentStatus(self, filename : str, min_access_count : int = 0, lookback_sec : int = 0, addresses = None,
+                         block_size : int = 64 * 1024, allowed_lateness_sec : int = 0,
+                         failure_codes : tuple = DEFAULT_FAILURE_CODES):
+        """ログを末尾から読んで、現在も故障が続いているサーバと故障の開始時刻を返す
+
+        Description:
+            時刻順に書かれたログを末尾から読み、サーバ毎に最後の応答なしの連続を遡る。
+            行の遅れはallowed_lateness_sec秒までとし、応答が得られた時刻よりその秒数だけ前の行まで遡ったら、
+            それより前に書かれた行はその応答より後の時刻になり得ないのでサーバを確定する。
+            addresses (稼働中のサーバの一覧、partitionのmanifest.jsonなど) のすべてが確定するか、
+            最後の時刻からlookback_sec秒より前の行に来たら読むのをやめる。
+            (addressesもlookback_secも無い時は、まだ出てきていないサーバがあり得るので先頭まで読む)
+            (確定しないまま終わった故障の開始は、読んだ範囲で最も古い応答なしの時刻になる)
+            読む量は直近のログの量で決まり、ファイルの大きさにはよらない。
+            アーカイブ形式は末尾から読めないので受け付けない (ValueError)。
+
+        Args:
+            filename (str): 対象にするログファイルのパス (時刻順のテキスト)
+            min_access_count (int, optional): 最低の連続アクセス回数. Defaults to 0.
+            lookback_sec (int, optional): 遡る秒数 (0 : ファイルの先頭まで). Defaults to 0.
+            addresses (optional): 確定したら読むのをやめるアドレスの一覧. Defaults to None (先頭か遡る秒数まで読む).
+            block_size (int, optional): 1回に読むbyte数. Defaults to 64KB.
+            allowed_lateness_sec (int, optional): 行が時刻順から遅れて書かれる最大の秒数. Defaults to 0.
+            failure_codes (tuple, optional): 応答なしとみなす (分類名, 状態) の組. Defaults to DEFAULT_FAILURE_CODES.
+
+        Returns:
+            {"current_broken" : 故障が続いている期間のリスト (GetInfoのbrokenと同じ形式、開始時刻順)}
+        """
+        if is_archive(filename):
+            raise ValueError(f"archive file cannot be read from the end : {filename} (use the text log)")
+        remaining = set(addresses) if addresses else None
+        lookup = status_table(failure_codes).lookup
+        states = {}     # {アドレス : [応答の最新の時刻, その後の応答なしの時刻のリスト, 確定したか]}
+        pending = []    # 確定を待つサーバ (-応答の時刻[秒], アドレス) のヒープ
+        limit_time = None
+        lines = ReverseLineReader(filename, block_size)
+        for log in LogReader().Iter(lines):
+            if limit_time is None:
+                limit_time = log.datetime - timedelta(seconds=lookback_sec) if lookback_sec > 0 else datetime.min
+            if log.datetime < limit_time:
+                break
+
+            # 応答の時刻が、今の行の時刻 + 遅れ以後のサーバは、これ以上遡っても変わらない
+            resolve_sec = datetime_to_seconds(log.datetime) + allowed_lateness_sec
+            while pending and -pending[0][0] >= resolve_sec:
+                # 応答の時刻が更新された古い方の要素は、新しい方で確定済み
+                addr = heapq.heappop(pending)[1]
+                state = states[addr]
+                if state[2]:
+                    continue
+                state[2] = True
+                if remaining is not None:
+                    remaining.discard(addr)
+            if remaining is not None and not remaining:
+                break
+
+            state = states.get(log.address)
+            if state is None:
+                state = states[log.address] = [None, [], False]
+            elif state[2]:
+                continue
+            if lookup.get(log.state):
+                if state[0] is None or log.datetime > state[0]:
+                    state[1].append(log.datetime)
+                continue
+
+            # 応答が得られたので、その後の応答なしの連続が今の故障 (遅れて書かれた応答ならより新しい方を使う)
+            if state[0] is None or log.datetime > state[0]:
+                state[0] = log.datetime
+                state[1] = [x for x in state[1] if x >= log.datetime]
+                heapq.heappush(pending, (-datetime_to_seconds(log.datetime), log.address))
+
+        broken = []
+        for addr, (_, fail_times, _) in states.items():
+            count = len(fail_times)
+            if count > 0 and count >= min_access_count:
+                broken.append(Interval("broken", addr, min(fail_times), None))
+        broken.sort(key=lambda x: (x.start, x.address))
+        self.CurrentStats = {"bytes_read": lines.bytes_read, "addresses": len(states)}
+
+        self.Return_data = {"current_broken": [format_interval(x) for x in broken]}
+        return self.Return_data
+
+    def GetInfoParallel(self, filename : str, workers : int = 4, ring_capacity : int = 4096, quarantine_file : str = None, **options):
+        """複数のプロセスで判定して、ParseLogFile + GetInfoと同じ結果を返す
+
+        Description:
+            親プロセスがファイルを1回だけ読み、アドレスの列だけを切り出して、アドレスのハッシュで担当のワーカに行を送る。
+            行のデコード・変換・検査と判定は担当のワーカが1回だけ行う。
+            結果はワーカ毎の共有メモリのリングバッファ(IntervalRing)に固定長のレコードで書かれ、
+            親プロセスはそれを直接読み出して、スイッチ故障などネットワーク単位の判定だけを行う。
+            結果のリストをpickleで受け渡さないので、ワーカが増えても集約の負荷は増えない。
+
+        Args:
+            filename (str): 対象にするログファイルのパス
+            workers (int, optional): ワーカプロセスの数. Defaults to 4.
+            ring_capacity (int, optional): ワーカ毎のリングバッファのレコード数. Defaults to 4096.
+            quarantine_file (str, optional): 不正な行の書き出し先 (ワーカ毎に書いたものを行番号順にまとめる). Defaults to None.
+            options : 判定条件 (GetInfoと同じ)
+
+        Returns:
+            GetInfoと同じ
+        """
+        opts = DetectOptions(**options)
+        rings = [IntervalRing(ring_capacity) for _ in range(workers)]
+        line_queues = [multiprocessing.Queue(maxsize=8) for _ in range(workers)]
+        # 上位K件・カバレッジは、ワーカ毎に集計したものを受け取ってまとめる
+        collect = opts.top_k > 0 or opts.coverage_bucket_sec > 0
+        report_queue = multiprocessing.Queue() if collect else None
+        parts = [None if quarantine_file is None else f"{quarantine_file}.{i}" for i in range(workers)]
+        processes = [
+            multiprocessing.Process(target=parallel_worker,
+                args=(line_queues[i], i, rings[i].name, ring_capacity, opts._asdict(), parts[i], report_queue))
+            for i in range(workers)
+        ]
+        records = []
+        report = None
+        coverage = self.__NewCoverage(opts)
+        try:
+            for process in processes:
+                process.start()
+            line_count = self.__SendLines(filename, line_queues, processes)
+
+            # すべてのワーカの書き込みが終わるまで読み出す
+            active = set(range(workers))
+            while active:
+                received = 0
+                for i in list(active):
+                    ret, finished = rings[i].Drain()
+                    records.extend(ret)
+                    received += len(ret)
+                    if not finished and not processes[i].is_alive():
+                        # 終了直前に書かれた分を読んでから確認する
+                        ret, finished = rings[i].Drain()
+                        records.extend(ret)
+                        if not finished:
+                            raise RuntimeError(f"worker {i} exited without finishing : exitcode={processes[i].exitcode}")
+                    if finished:
+                        active.discard(i)
+                if received == 0:
+                    time.sleep(0.0005)
+
+            # 大きいデータが残っているとワーカが終了できないので、joinの前に受け取る
+            # (待つ間にワーカが異常終了していたら、届かない集計を待ち続けずにエラーにする)
+            if report_queue is not None:
+                report = TopKReport(opts.top_k, status_table(opts.failure_codes)) if opts.top_k > 0 else None
+                for _ in range(workers):
+                    while True:
+                        try:
+                            worker_report, worker_coverage = report_queue.get(timeout=0.1)
+                            break
+                        except queue.Empty:
+                            pass
+                        failed = [p.exitcode for p in processes if p.exitcode not in (None, 0)]
+                        if failed:
+                            raise RuntimeError(f"worker failed : exitcode={failed[0]}")
+                        if all(p.exitcode is not None for p in processes) and report_queue.empty():
+                            # 正常に終了したワーカの分は送信済みなので、少し待っても届かなければ失われている
+                            try:
+                                worker_report, worker_coverage = report_queue.get(timeout=1)
+                                break
+                            except queue.Empty:
+                                raise RuntimeError("worker exited without sending its report")
+                    if report is not None:
+                        report.Merge(worker_report)
+                    if coverage is not None:
+                        coverage.Merge(worker_coverage)
+
+            for process in processes:
+                process.join()
+                if process.exitcode != 0:
+                    raise RuntimeError(f"worker failed : exitcode={process.exitcode}")
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            for line_queue in line_queues:
+                line_queue.close()
+                line_queue.cancel_join_thread()
+            for ring in rings:
+                ring.Close()
+            if quarantine_file is not None:
+                self.__MergeQuarantine(quarantine_file, parts)
+
+        # アドレスがファイルに最初に出てきた順 (同じアドレスは1つのワーカから順に届く)
+        records.sort(key=lambda x: x[1])
+
+        self.Inventory = HostInventory()
+        category_names = status_table(opts.failure_codes).categories
+        categories = {}
+        addresses = []
+        intervals = []
+        blank = quarantined = 0
+        for kind, _, start, end, address in records:
+            if kind == "host":
+                addresses.append(address)
+                self.Inventory.Observe(address, start, end)
+            elif kind == "category":
+                categories.setdefault(address, {})[category_names[start]] = end
+            elif kind == "parse":
+                blank += start
+                quarantined += end
+            else:
+                intervals.append(Interval(kind, address, start, end))
+        self.ParseStats = {"lines": line_count, "parsed": line_count - blank - quarantined, "blank": blank,
+                           "quarantined": quarantined}
+
+        def log_span():
+            hosts = [span for x in self.Inventory.networks.values() for span in x.values()]
+            return addresses, min((x[0] for x in hosts), default=None), max((x[1] for x in hosts), default=None)
+
+        self.FailureCategories = categories
+        self.Return_data = self.__BuildReturnData(iter(intervals), opts, log_span, report, coverage=coverage)
+        return self.Return_data
+
+    @staticmethod
+    def __SendLines(filename : str, line_queues : list, processes : list) -> int:
+        """ファイルを1回だけ読み、行をアドレスのハッシュで分けてワーカに送る (GetInfoParallel)
+
+        Description:
+            行はデコードせず、アドレスの列を切り出すだけにする。(変換と検査は担当のワーカが行う)
+            ワーカ毎にPARALLEL_BATCH_BYTESずつまとめて、ファイルの行番号のarrayと一緒に送る。
+            アドレスの列がない行 (空行など) は、件数を数えて隔離するために1つ目のワーカに送る。
+
+        Returns:
+            int: ファイルの行数
+        """
+        workers = len(line_queues)
+        buffers = [bytearray() for _ in range(workers)]
+        numbers = [array("q") for _ in range(workers)]
+        shard_of = {}
+
+        def send(i, batch):
+            # ワーカが異常終了していたら、空くのを待ち続けずにエラーにする
+            while True:
+                try:
+                    line_queues[i].put(batch, timeout=0.1)
+                    return
+                except queue.Full:
+                    if not processes[i].is_alive():
+                        raise RuntimeError(f"worker {i} exited while receiving lines : exitcode={processes[i].exitcode}")
+
+        line_no = 0
+        for line in iter_log_bytes(filename):
+            line_no += 1
+            fields = line.split(b",", 2)
+            if len(fields) == 3:
+                shard = shard_of.get(fields[1])
+                if shard is None:
+                    shard = shard_of[fields[1]] = zlib.crc32(fields[1]) % workers
+            else:
+                shard = 0
+            buf = buffers[shard]
+            buf += line
+            if not line.endswith(b"\n"):
+                buf += b"\n"
+            numbers[shard].append(line_no)
+            if len(buf) >= PARALLEL_BATCH_BYTES:
+                send(shard, (bytes(buf), numbers[shard]))
+                buffers[shard] = bytearray()
+                numbers[shard] = array("q")
+        for i in range(workers):
+            if numbers[i]:
+                send(i, (bytes(buffers[i]), numbers[i]))
+            send(i, None)
+        return line_no
+
+    @staticmethod
+    def __MergeQuarantine(quarantine_file : str, parts : list):
+        """ワーカ毎に書き出した不正な行を、行番号順に1つのファイルにまとめる (GetInfoParallel)
+        """
+        parts = [x for x in parts if os.path.isfile(x)]
+        if not parts:
+            return
+        files = [open(x, "r", encoding="utf-8", errors="surrogateescape") for x in parts]
+        try:
+            with open(quarantine_file, "w", encoding="utf-8", errors="surrogateescape") as fout:
+                fout.writelines(heapq.merge(*files, key=lambda line: int(line.split("\t", 1)[0])))
+        finally:
+            for fin in files:
+                fin.close()
+            for part in parts:
+                os.remove(part)
+
+    def GetInfoSharded(self, filename : str, shards : int = 4, work_dir : str = None, quarantine_file : str = None, **options):
+        """ログをネットワーク毎のファイルに分け、ファイル毎に別のプロセスで判定してまとめる
+
+        Description:
+            partition_logで分けたファイルを、それぞれ "04.py shard-run" のサブプロセスで判定し、MergeShardsでまとめる。
+            複数のマシンで分担する場合も、同じ手順 (partition → shard-run → merge) をサブコマンドで実行する。
+
+        Args:
+            filename (str): 対象にするログファイルのパス
+            shards (int, optional): 分ける数. Defaults to 4.
+            work_dir (str, optional): 分けたファイルと結果の置き場所. Defaults to None (一時ディレクトリ).
+            quarantine_file (str, optional): 不正な行の書き出し先. Defaults to None.
+            options : 判定条件 (GetInfoと同じ)
+
+        Returns:
+            GetInfoと同じ
+        """
+        opts = DetectOptions(**options)
+        tmp_dir = tempfile.mkdtemp(prefix="slog-shard-") if work_dir is None else None
+        shard_dir = tmp_dir or work_dir
+        try:
+            partition_log(filename, shard_dir, shards, quarantine_file)
+            manifest_file = os.path.join(shard_dir, SHARD_MANIFEST)
+            processes = [
+                subprocess.Popen([sys.executable, os.path.abspath(__file__), "shard-run", manifest_file, str(i),
+                                  "--options", json.dumps(opts._asdict())])
+                for i in range(shards)
+            ]
+            for i, process in enumerate(processes):
+                if process.wait() != 0:
+                    raise RuntimeError(f"shard {i} failed : exitcode={process.returncode}")
+            return self.MergeShards(manifest_file, **options)
+        finally:
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def MergeShards(self, manifest_file : str, result_files : list = None, **options):
+        """run_shardで書き出したファイル毎の結果をまとめて、ParseLogFile + GetInfoと同じ結果を返す
+
+        Description:
+            サーバ毎の期間はmanifest.jsonのアドレスが最初に出てきた順に、スイッチ故障は
+            そのネットワークのサーバが最初に故障した順に並べ直す。同時多発故障・稼働率・上位K件はここで求める。
+
+        Args:
+            manifest_file (str): partition_logで作った manifest.json のパス
+            result_files (list, optional): run_shardの結果のパス. Defaults to None (manifest.json と同じ場所の shard-NNN.json).
+            options : 判定条件 (run_shardと同じであること)
+
+        Returns:
+            GetInfoと同じ
+        """
+        opts = DetectOptions(**options)
+        with open(manifest_file, "r", encoding="utf-8") as fin:
+            manifest = json.load(fin)
+        if result_files is None:
+            shard_dir = os.path.dirname(os.path.abspath(manifest_file))
+            result_files = [os.path.join(shard_dir, os.path.splitext(x)[0] + ".json") for x in manifest["shards"]]
+        order = {intern_address(x): i for i, x in enumerate(manifest["addresses"])}
+
+        hosts = {}
+        intervals = []
+        switch_intervals = []
+        self.FailureCategories = {}
+        coverage = self.__NewCoverage(opts)
+        for result_file in result_files:
+            with open(result_file, "r", encoding="utf-8") as fin:
+                result = json.load(fin)
+            for addr, first_time, last_time, latency_sum, samples, failed in result["hosts"]:
+                hosts[intern_address(addr)] = (datetime.fromisoformat(first_time), datetime.fromisoformat(last_time),
+                                               latency_sum, samples, failed)
+            for kind, addr, start, end in result["intervals"]:
+                interval = Interval(kind, intern_address(addr), datetime.fromisoformat(start),
+                                    None if end is None else datetime.fromisoformat(end))
+                (switch_intervals if kind == "switch_broken" else intervals).append(interval)
+            for addr, categories in result["categories"].items():
+                self.FailureCategories[intern_address(addr)] = categories
+            if coverage is not None:
+                coverage.Merge(CoverageStats.Load(result["coverage"]))
+        self.ParseStats = manifest["parse"]
+
+        # ファイル毎にはネットワーク順なので、アドレスが最初に出てきた順に並べ直す (同じアドレスの中の順は保つ)
+        intervals.sort(key=lambda x: order[x.address])
+        network_rank = {}
+        for x in intervals:
+            if x.kind == "broken":
+                network_rank.setdefault(network_of(x.address), len(network_rank))
+        switch_intervals.sort(key=lambda x: network_rank[x.address])
+
+        self.Inventory = HostInventory()
+        addresses = [x for x in order if x in hosts]
+        report = TopKReport(opts.top_k, status_table(opts.failure_codes)) if opts.top_k > 0 else None
+        for addr in addresses:
+            first_time, last_time, latency_sum, samples, failed = hosts[addr]
+            self.Inventory.Observe(addr, first_time, last_time)
+            if report is not None:
+                report.AddLatency(addr, latency_sum, samples)
+                if failed > 0:
+                    report.AddFailed(addr, failed)
+
+        def log_span():
+            # 変換できた行がない場合はNone (__LogSpanと同じ)
+            first_time, last_time = manifest["first_time"], manifest["last_time"]
+            return (addresses, None if first_time is None else datetime.fromisoformat(first_time),
+                    None if last_time is None else datetime.fromisoformat(last_time))
+
+        self.Return_data = self.__BuildReturnData(iter(intervals), opts, log_span, report, switch_intervals, coverage)
+        return self.Return_data
+
+    def OutputResult(self, return_data : dict = None):
+        """動作結果をリストにして返すだけの関数
+
+        Args:
+            return_data (dict, optional): 出力する結果. Defaults to None (直前のGetInfoの結果).
+        Returns:
+            _type_: _description_
+        """
+        if return_data is None:
+            return_data = self.Return_data
+        result = []
+        for key in return_data:
+            result.append(f"## {key}")
+            for x in return_data[key]:
+                result.append(x)
+            result.append("")
+        
+        return result
+
+    def __GetCache(self, key : tuple):
+        """LRUから結果を取り出す。見つからない場合はNone
+        """
+        cached = self.result_cache.get(key)
+        if cached is None:
+            self.cache_misses += 1
+            return None
+        self.cache_hits += 1
+        self.result_cache.move_to_end(key)
+        # 呼び出し側で書き換えられてもキャッシュが壊れないようにコピーを返す
+        return {k: list(v) for k, v in cached.items()}
+
+    def __SetCache(self, key : tuple, return_data : dict):
+        """LRUに結果を入れる。件数を超えたら古いものから捨てる
+        """
+        self.result_cache[key] = {k: list(v) for k, v in return_data.items()}
+        self.result_cache.move_to_end(key)
+        while len(self.result_cache) > self.result_cache_size:
+            self.result_cache.popitem(last=False)
+
+    def __BuildSweepTables(self, table : StatusTable):
+        """パラメータスイープ用に、サーバ毎の故障の連続回数と応答時間の累積和を求める
+
+        Args:
+            table (StatusTable): 応答なしの分類
+        Returns:
+            dict: {アドレス : (故障の一覧, 応答時間を得た時間の一覧, 応答時間の累積和)}
+                故障の一覧は [連続回数, 故障開始, 故障終了, 回復したか, 分類毎の回数] のリスト
+        """
+        lookup = table.lookup
+        tables = {}
+        for addr in self.ServerLogs:
+            runs = []
+            times = []
+            prefix = [0]
+            current = None
+            for log in self.__Logs(addr):
+                category = lookup.get(log.state)
+                if category:
+                    if current is None:
+                        current = [0, log.datetime, log.datetime, False, [0] * (len(table.categories) + 1)]
+                        runs.append(current)
+                    current[0] += 1
+                    current[4][category] += 1
+                    current[2] = log.datetime
+                    continue
+                if current is not None:
+                    current[3] = True
+                current = None
+                if log.response_time != -1:
+                    times.append(log.datetime)
+                    prefix.append(prefix[-1] + log.response_time)
+            tables[addr] = (runs, times, prefix)
+        return tables
+
+    @staticmethod
+    def __OverloadFromPrefix(address : str, times : list, prefix : list, overload_average_count : int, overload_limit_ms : int):
+        """累積和から直近m回の平均を求めて、OverloadDetectorと同じ過負荷のIntervalを返す
+        """
+        return_data = []
+        m = overload_average_count
+        if m <= 0:
+            return return_data
+        first_overload_time = None
+        last_overload_time = None
+        for i in range(m, len(prefix)):
+            if (prefix[i] - prefix[i - m]) // m >= overload_limit_ms:
+                if first_overload_time is None:
+                    first_overload_time = times[i - 1]
+                last_overload_time = times[i - 1]
+            else:
+                if first_overload_time is not None:
+                    return_data.append(Interval("overload", address, first_overload_time, last_overload_time))
+                first_overload_time = None
+        if first_overload_time is not None:
+            return_data.append(Interval("overload", address, first_overload_time, last_overload_time))
+        return return_data
+
+    def __LogAppend(self, log : LogLine):
+        """ 1行分のLogLineを、ServerLogsにアドレス別に入れる
+
+        Args:
+            log (LogLine): ログの1行
+        Returns:
+            なし
+        """
+        server_log = self.ServerLogs.get(log.address)
+        if server_log is None:
+            server_log = self.ServerLogs[log.address] = []
+        server_log.append(log)
+
+    def __checkBroken(self, server_log: list, min_access_count : int = 0, close_count : int = 1, merge_gap_sec : int = 0,
+                      table : StatusTable = None):
+        """サーバの故障期間のデータを収集する内部関数
+
+        Args:
+            server_log (list): 時間順にソート済みのログ
+            min_access_count (int, optional): 最低の連続アクセス回数. Defaults to 0.
+            close_count (int, optional): 故障期間を閉じる連続した応答の回数. Defaults to 1.
+            merge_gap_sec (int, optional): この秒数未満の間隔の故障期間をつなげる. Defaults to 0.
+            table (StatusTable, optional): 応答なしの分類 (分類毎の回数はFailureCategoriesに入る). Defaults to None.
+
+        Returns:
+            Intervalのジェネレータ
+        """
+        if table is None:
+            table = status_table()
+        detector = BrokenDetector(min_access_count, close_count, merge_gap_sec, table)
+        yield from self.__RunDetector(detector, server_log)
+        self.__RecordCategories(server_log[-1].address, detector, table)
+
+    def __RecordCategories(self, address : str, detector : BrokenDetector, table : StatusTable):
+        """判定を終えた故障の判定器から、分類毎の回数をFailureCategoriesに入れる (既定の分類では数えない)
+        """
+        if not table.is_default:
+            categories = detector.Categories(table)
+            if categories:
+                self.FailureCategories[address] = categories
+
+
+    def __checkOverload(self,
+        server_log: list, overload_average_count : int = 10, overload_limit_ms : int = 180000):
+        """ サーバ事に過負荷の時間を計算する
+        Description:
+            過負荷の時間を計算する
+            応答なしの場合は、時間に含めずskipする。
+
+        Args:
+            server_log (list): 時間順にソート済みのログ
+            overload_average_count (int, optional): 平均化する回数. Defaults to 10.
+            overload_time_ms (int, optional): _description_. Defaults to 180000.
+        """
+        return self.__RunDetector(OverloadDetector(overload_average_count, overload_limit_ms), server_log)
+
+
+    def __checkOverloadWindow(self,
+        server_log: list, window_sec : int, overload_limit_ms : int = 180000, mode : str = "average"):
+        """ 直近W秒間の応答時間で、サーバ毎に過負荷の時間を計算する
+
+        Args:
+            server_log (list): 時間順にソート済みのログ
+            window_sec (int): 時間窓の長さ[秒]
+            overload_limit_ms (int, optional): 過負荷とみなす応答時間. Defaults to 180000.
+            mode (str, optional): "average" / "max". Defaults to "average".
+        """
+        return self.__RunDetector(OverloadWindowDetector(window_sec, overload_limit_ms, mode), server_log)
+
+
+    @staticmethod
+    def __CreateDetectors(opts : DetectOptions):
+        """1サーバ分の (故障の判定器, 過負荷の判定器[, 異常検知の判定器]) を作る
+        """
+        if opts.overload_window_sec > 0:
+            overload_detector = OverloadWindowDetector(opts.overload_window_sec, opts.overload_limit_time_ms, opts.overload_window_mode)
+        else:
+            overload_detector = OverloadDetector(opts.overload_average_count, opts.overload_limit_time_ms)
+        broken_detector = BrokenDetector(opts.min_access_count, opts.broken_close_count, opts.broken_merge_gap_sec,
+                                         status_table(opts.failure_codes))
+        if opts.anomaly_alpha > 0:
+            return broken_detector, overload_detector, AnomalyDetector(opts.anomaly_alpha, opts.anomaly_k)
+        return broken_detector, overload_detector
+
+    def __IterIntervals(self, opts : DetectOptions):
+        """IterIntervalsの本体
+        """
+        table = status_table(opts.failure_codes)
+        self.FailureCategories = {}
+        for addr in self.ServerLogs:
+            server_logs = self.__Logs(addr)
+
+            # 故障チェック
+            yield from self.__checkBroken(server_log=server_logs, min_access_count=opts.min_access_count,
+                close_count=opts.broken_close_count, merge_gap_sec=opts.broken_merge_gap_sec, table=table)
+
+            # オーバーロードのチェック
+            # -- ループ重複は気にしない
+            yield from self.__checkOverloadAny(server_logs, opts)
+
+            # 応答時間の異常のチェック
+            if opts.anomaly_alpha > 0:
+                yield from self.__RunDetector(AnomalyDetector(opts.anomaly_alpha, opts.anomaly_k), server_logs)
+
+    def __checkOverloadAny(self, server_log : list, opts : DetectOptions):
+        """判定条件に合わせて、回数、または、時間窓で過負荷を判定する
+        """
+        if opts.overload_window_sec > 0:
+            return self.__checkOverloadWindow(server_log=server_log, overload_limit_ms=opts.overload_limit_time_ms,
+                window_sec=opts.overload_window_sec, mode=opts.overload_window_mode)
+        return self.__checkOverload(server_log=server_log, overload_limit_ms=opts.overload_limit_time_ms,
+            overload_average_count=opts.overload_average_count)
+
+    def __LogSpan(self):
+        """ログに出てきたアドレスの一覧と、最初と最後の時刻を返す
+        """
+        spans = [span for x in self.Inventory.networks.values() for span in x.values()]
+        first_time = min((x[0] for x in spans), default=None)
+        last_time = max((x[1] for x in spans), default=None)
+        return self.ServerLogs.keys(), first_time, last_time
+
+    def __Logs(self, address : str) -> list:
+        """アドレスのすべてのログを時間順に返す (一時ファイルに書き出した分は読み戻す)
+        """
+        if self.__spiller is None:
+            return self.ServerLogs[address]
+        return self.__spiller.Load(address, self.ServerLogs[address])
+
+    def __BuildReturnData(self, intervals, opts : DetectOptions, log_span, report : TopKReport = None, switch_intervals : list = None,
+                          coverage : CoverageStats = None):
+        """サーバ毎のIntervalから、ネットワーク単位の判定を加えて結果を作る
+
+        Args:
+            intervals : サーバ毎のIntervalのイテレータ (アドレス順)
+            opts (DetectOptions): 判定条件
+            log_span : アドレスの一覧と最初と最後の時刻を返す関数 (必要な時だけ呼ぶ)
+            report (TopKReport, optional): 平均応答時間と応答なしの回数を集計済みのもの (top_kを指定した場合). Defaults to None.
+            switch_intervals (list, optional): 判定済みのスイッチ故障のInterval (MergeShards). Defaults to None (ここで判定する).
+            coverage (CoverageStats, optional): 数え終えたネットワーク・時間帯毎のサーバの数 (coverage_bucket_secを指定した場合). Defaults to None.
+        Returns:
+            GetInfoと同じ
+        """
+        return_data = {
+            "broken":[],
+            "overload":[],
+            "switch_broken":[]
+        }
+        if opts.anomaly_alpha > 0:
+            return_data["anomaly"] = []
+        broken_log = []
+        stats = AvailabilityStats() if opts.availability else None
+        for interval in intervals:
+            if interval.kind == "broken":
+                broken_log.append(interval)
+                if stats is not None:
+                    stats.Add(interval)
+            return_data[interval.kind].append(format_interval(interval))
+
+        # 故障回数・故障時間の上位K件 (故障はアドレス毎にまとまって届くので、1アドレス分ずつ入れる)
+        if report is not None:
+            last_time = log_span()[2]
+            address = None
+            outages = downtime = 0
+            for interval in broken_log:
+                if interval.address != address:
+                    if address is not None:
+                        report.AddOutages(address, outages, downtime)
+                    address = interval.address
+                    outages = downtime = 0
+                end = last_time if interval.end is None else interval.end
+                outages += 1
+                downtime += (end - interval.start) // timedelta(seconds=1)
+            if address is not None:
+                report.AddOutages(address, outages, downtime)
+
+        # 同一ネットワークのエラーチェック
+        ret = self.__checkSwitchBroken(broken_log, opts) if switch_intervals is None else switch_intervals
+        return_data["switch_broken"].extend(format_interval(x) for x in ret)
+
+        # 複数ネットワークの同時故障のチェック
+        if opts.storm_bin_sec > 0:
+            addresses, first_time, last_time = log_span()
+            networks = {network_of(x) for x in addresses}
+            return_data["storm"] = self.__checkStorm(broken_log, len(networks), first_time, last_time,
+                opts.storm_bin_sec, opts.storm_ratio)
+
+        # 応答なしの分類毎の回数 (既定の分類以外を設定した場合)
+        if not status_table(opts.failure_codes).is_default:
+            return_data["failure_categories"] = [
+                f"{addr},{category},{count}"
+                for addr in log_span()[0] if addr in self.FailureCategories
+                for category, count in self.FailureCategories[addr].items()]
+
+        # 故障時間・稼働率の集計
+        if stats is not None:
+            return_data["availability"] = stats.Rows(*log_span())
+
+        if report is not None:
+            return_data.update(report.Rows())
+
+        if coverage is not None:
+            return_data["coverage"] = coverage.Rows()
+
+        return return_data
+
+    def __Coverage(self, opts : DetectOptions) -> CoverageStats:
+        """読み込み時に数えたCoverageStatsを返す。条件が違う場合は読み込んだログから数え直す
+        """
+        coverage = self.Coverage
+        if coverage is not None and coverage.bucket_sec == opts.coverage_bucket_sec \
+                and coverage.table is status_table(opts.failure_codes):
+            return coverage
+        coverage = self.__NewCoverage(opts)
+        for addr in self.ServerLogs:
+            coverage.AddLogs(self.__Logs(addr))
+        return coverage
+
+    def __FeedDetectors(self, states : dict, log : LogLine, opts : DetectOptions, report : TopKReport):
+        """時刻順に届く1行を、そのアドレスの判定器に渡す (GetInfoExternal / GetInfoStream)
+
+        Args:
+            states (dict): アドレス毎に (判定器の一覧, 結果, [最初の時刻, 最後の時刻], [応答時間の合計, 回数])
+        """
+        state = states.get(log.address)
+        if state is None:
+            state = states[log.address] = (self.__CreateDetectors(opts), [], [log.datetime, log.datetime], [0, 0])
+        state[2][1] = log.datetime
+        for detector in state[0]:
+            interval = detector.Push(log)
+            if interval is not None:
+                state[1].append(interval)
+        if report is not None:
+            if report.table.lookup.get(log.state):
+                report.AddFailed(log.address)
+            elif log.response_time != -1:
+                state[3][0] += log.response_time
+                state[3][1] += 1
+
+    @staticmethod
+    def __NewCoverage(opts : DetectOptions) -> CoverageStats:
+        """coverage_bucket_secを指定した場合のCoverageStatsを作る (指定なしはNone)
+        """
+        if opts.coverage_bucket_sec <= 0:
+            return None
+        return CoverageStats(opts.coverage_bucket_sec, table=status_table(opts.failure_codes))
+
+    def __FinishDetectors(self, states : dict, address_order : dict, first_time : datetime, last_time : datetime,
+                          opts : DetectOptions, report : TopKReport, coverage : CoverageStats = None) -> dict:
+        """__FeedDetectorsで判定した結果をまとめて、GetInfoと同じ形にする
+        """
+        self.Inventory = HostInventory()
+        for addr in address_order:
+            self.Inventory.Observe(addr, *states[addr][2])
+            if report is not None:
+                report.AddLatency(addr, *states[addr][3])
+
+        table = status_table(opts.failure_codes)
+        self.FailureCategories = {}
+
+        def iter_intervals():
+            for addr in address_order:
+                detectors, intervals, _, _ = states[addr]
+                yield from intervals
+                for detector in detectors:
+                    interval = detector.Finish(addr)
+                    while interval is not None:
+                        yield interval
+                        interval = detector.Finish(addr)
+                self.__RecordCategories(addr, detectors[0], table)
+
+        def log_span():
+            return address_order, first_time, last_time
+
+        return self.__BuildReturnData(iter_intervals(), opts, log_span, report, coverage=coverage)
+
+    def __RunDetector(self, detector, server_log : list):
+        """1サーバ分のログを判定器に順に入れて、得られたIntervalを順に返す
+        """
+        for log in server_log:
+            interval = detector.Push(log)
+            if interval is not None:
+                yield interval
+
+        interval = detector.Finish(server_log[-1].address)
+        while interval is not None:
+            yield interval
+            interval = detector.Finish(server_log[-1].address)
+
+
+    def __checkSwitchBroken(self, broken_log : list, opts : DetectOptions = DetectOptions()):
+        """ネットワークスイッチの故障状態を出力する
+
+        Description:
+            ネットワーク内で故障中のサーバの割合がswitch_threshold以上の期間を、スイッチの故障とする。
+            母数はInventoryにある、その時点でログに出てきているサーバの数。(一度も故障していないサーバも含む)
+            サーバの参加・離脱と故障の開始・終了をイベントにして時間順に処理し、
+            故障中の数と母数をカウンタで増減するだけなので、イベント数に比例する時間で判定できる。
+
+        Args:
+            broken_log (list): 故障のInterval
+            opts (DetectOptions, optional): 判定条件 (switch_threshold, switch_member_timeout_sec を使う)
+        Returns:
+            list: スイッチ故障のInterval (addressはネットワークアドレス)
+        """
+        # 同時刻のイベントの処理順 (参加と故障開始 → 故障終了 → 離脱)
+        PHASE_DOWN, PHASE_UP, PHASE_LEAVE = 0, 1, 2
+        member_timeout = timedelta(seconds=opts.switch_member_timeout_sec)
 
         # ネットワーク一覧を生成
+        networks = {}
         for broken in broken_log:
-            splt = broken.split(',')
-            ipadr = splt[0]
-            ip = netaddr.IPNetwork(ipadr)
-            txt_ip_network = f"{ip.network}"
-            if txt_ip_network not in networks:
-                networks[txt_ip_network] = {}
-                networks[txt_ip_network]["address"] = set()
-                networks[txt_ip_network]["log"] = []
-            networks[txt_ip_network]["address"].add(str(ip))
-            networks[txt_ip_network]["log"].append(broken.split(','))
-
-
-        # ネットワーク分繰り返す
-        # ネットワーク一覧から
+            networks.setdefault(network_of(broken.address), []).append(broken)
+
         return_data = []
-        for netwk in networks:
-            tgt = networks[netwk]
-
-            # 開始時間順にログをソート
-            tgt["log"].sort(key=lambda x: x[1])
-
-            # エラーのフラグテーブルを生成
-            flg_tables = {}
-            for addr in tgt["address"]:
-                flg_tables[addr] = {
-                    "state" : 0,
-                    "endtime" : datetime.max
-                }
-            
-            # 時間順に検索して、エラーのフラグを立てる
-            sw_crash_datetime = None
-            last_end_time = None
-            size = len(tgt["address"])
-
-            sw_error_flag = 0
-            for log in tgt["log"]:
-                addr = log[0]
-                starttime = log[1]
-                endtime = log[2]
-                current_datetime = datetime.strptime(starttime, '%Y-%m-%d %H:%M:%S')
-                if endtime == "----/--/-- --:--:--":
-                    end_datetime = datetime.max
-                else:
-                    end_datetime = datetime.strptime(endtime, '%Y-%m-%d %H:%M:%S')
-
-                flg_tables[addr] = {
-                    "state" : 1,
-                    "endtime" : end_datetime
-                }
-
-                # total check -- すべてエラーかチェックする
-                s = sum([flg_tables[d]["state"] for d in flg_tables])
-                if s >= size:
-                    sw_error_flag = 1
-                    if sw_crash_datetime == None:
-                        sw_crash_starttime = current_datetime
-                    sw_crash_endtime = min([x["endtime"] for x in flg_tables.values()])
-                    if sw_crash_endtime == datetime.max:
-                        sw_crash_endtime = "----/--/-- --:--:--"
-                    return_data.append(f"{netwk},{sw_crash_starttime},{sw_crash_endtime}")
-                else:
-                    if sw_error_flag == 1:
-                        print(f"sw_crash_endtime === {sw_crash_endtime}")
-                        sw_crash_endtime = min([x["endtime"] for x in flg_tables.values()])
-                        sw_error_flag = 0
+        for netwk, logs in networks.items():
+            # 故障が継続中のサーバはネットワークから外さない
+            ongoing = {log.address for log in logs if log.end is None}
+
+            # (時刻, 処理順, 故障数の増減, 母数の増減)
+            events = []
+            for addr, (first_time, last_time) in self.Inventory.Hosts(netwk).items():
+                events.append((first_time, PHASE_DOWN, 0, 1))
+                leave_time = last_time + member_timeout
+                if opts.switch_member_timeout_sec > 0 and addr not in ongoing \
+                        and self.Inventory.last_time is not None and leave_time < self.Inventory.last_time:
+                    events.append((leave_time, PHASE_LEAVE, 0, -1))
+            for log in logs:
+                events.append((log.start, PHASE_DOWN, 1, 0))
+                if log.end is not None:
+                    events.append((log.end, PHASE_UP, -1, 0))
+            events.sort(key=lambda x: (x[0], x[1]))
+
+            # 時間順に検索して、故障中の数と母数を増減する
+            down_count = 0
+            member_count = 0
+            sw_crash_starttime = None
+            for i, (event_time, phase, down_delta, member_delta) in enumerate(events):
+                down_count += down_delta
+                member_count += member_delta
+                # 同じ時刻・処理順のイベントをすべて反映してから判定する
+                if i + 1 < len(events) and events[i + 1][:2] == (event_time, phase):
+                    continue
+
+                if down_count > 0 and down_count >= opts.switch_threshold * member_count:
+                    if sw_crash_starttime is None:
+                        sw_crash_starttime = event_time
+                elif sw_crash_starttime is not None:
+                    # 故障終了の時刻はまだ故障を観測していた時刻なので、スイッチ故障に含める
+                    return_data.append(Interval("switch_broken", netwk, sw_crash_starttime, event_time))
+                    sw_crash_starttime = None
+
+            if sw_crash_starttime is not None:
+                return_data.append(Interval("switch_broken", netwk, sw_crash_starttime, None))
+
+        return return_data
+
+
+    def __checkStorm(self, broken_log : list, network_count : int, first_time : datetime, last_time : datetime,
+                     bin_sec : int, ratio : float):
+        """多数のネットワークで同時に故障している時間帯を検出する
+
+        Description:
+            ログの期間をbin_sec秒毎の区間に分けて、区間毎に故障中のネットワーク数とサーバ数を数える。
+            故障期間を区間番号の範囲に直し、重なりをまとめてから差分配列に+1/-1するだけなので、
+            故障期間の数と区間の数に比例する時間で済む。(継続中の故障はログの最後の時刻まで数える)
+            故障中のネットワークの割合がratio以上の区間を結果にする。
+
+        Args:
+            broken_log (list): 故障のInterval (アドレス毎に時間順)
+            network_count (int): ログに出てきたネットワークの数
+            first_time (datetime): ログの最初の時刻
+            last_time (datetime): ログの最後の時刻
+            bin_sec (int): 区間の長さ[秒]
+            ratio (float): 同時多発故障とみなす割合
+        Returns:
+            list: "区間開始,区間終了,故障中のネットワーク数,ネットワーク数,故障中のサーバ数" の文字列
+        """
+        return_data = []
+        if not broken_log or network_count == 0:
+            return return_data
+
+        base = datetime_to_seconds(first_time) // bin_sec * bin_sec
+        bin_count = (datetime_to_seconds(last_time) - base) // bin_sec + 1
+        host_diff = array("i", bytes(4 * (bin_count + 1)))
+        network_diff = array("i", bytes(4 * (bin_count + 1)))
+
+        # サーバ毎の区間 (同じサーバの重なりは数えない)
+        network_ranges = {}
+        last_address = None
+        last_bin = -1
+        for broken in broken_log:
+            end = last_time if broken.end is None else broken.end
+            b0 = (datetime_to_seconds(broken.start) - base) // bin_sec
+            b1 = (datetime_to_seconds(end) - base) // bin_sec
+            if broken.address == last_address:
+                b0 = max(b0, last_bin + 1)
+            else:
+                last_address = broken.address
+                last_bin = -1
+            if b0 > b1:
+                continue
+            last_bin = b1
+            host_diff[b0] += 1
+            host_diff[b1 + 1] -= 1
+            network_ranges.setdefault(network_of(broken.address), []).append((b0, b1))
+
+        # ネットワーク毎の区間 (重なりをまとめる)
+        for ranges in network_ranges.values():
+            ranges.sort()
+            cur0, cur1 = ranges[0]
+            for b0, b1 in ranges[1:]:
+                if b0 <= cur1:
+                    cur1 = max(cur1, b1)
+                    continue
+                network_diff[cur0] += 1
+                network_diff[cur1 + 1] -= 1
+                cur0, cur1 = b0, b1
+            network_diff[cur0] += 1
+            network_diff[cur1 + 1] -= 1
+
+        hosts = 0
+        networks = 0
+        for i in range(bin_count):
+            hosts += host_diff[i]
+            networks += network_diff[i]
+            if networks > 0 and networks / network_count >= ratio:
+                bin_start = seconds_to_datetime(base + i * bin_sec)
+                bin_end = seconds_to_datetime(base + (i + 1) * bin_sec)
+                return_data.append(f"{bin_start},{bin_end},{networks},{network_count},{hosts}")
+
+        return return_data
+
+
+class QuerySnapshot:
+    """常駐プロセスで使う、読み込み済みのログと結果のLRU
+
+    Description:
+        読み込んだ後のServerLogParserは変更しないので、複数のスレッドから同時に参照できる。
+        再読み込みは新しいQuerySnapshotを作って差し替える。(処理中の問い合わせは古い方を使い続ける)
+        結果は (判定条件, 絞り込み条件) をキーにしたLRUに入れ、同じ問い合わせは判定し直さない。
+        判定はGILのためスレッドを分けても速くならないので、結果がない時だけロックして1つずつ行う。
+    """
+
+    def __init__(self, filename : str, cache_size : int = 256):
+        """
+        Args:
+            filename (str): 対象にするログファイルのパス (アーカイブ形式も可)
+            cache_size (int, optional): 結果を保持する件数. Defaults to 256.
+        """
+        self.filename = filename
+        self.cache_size = cache_size
+        self.loaded_at = datetime.now()
+        self.parser = ServerLogParser(filename)
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.__cache_lock = threading.Lock()
+        self.__parser_lock = threading.Lock()
+
+    def Query(self, options : dict, address : str = None, network : str = None,
+              since : datetime = None, until : datetime = None) -> dict:
+        """GetInfoと同じ結果を、アドレス・ネットワーク・時間帯で絞り込んで返す
+
+        Description:
+            判定はログ全体で行い、期間の行 (アドレス,開始,終了) だけを絞り込む。
+            storm などの期間ではない行はそのまま返す。
+
+        Args:
+            options (dict): 判定条件 (GetInfoと同じ)
+            address (str, optional): サーバのアドレス (そのネットワークのスイッチ故障も含める). Defaults to None.
+            network (str, optional): ネットワークアドレス. Defaults to None.
+            since (datetime, optional): この時刻以降に続いていた期間. Defaults to None.
+            until (datetime, optional): この時刻以前に始まった期間. Defaults to None.
+        Returns:
+            GetInfoと同じ形式
+        """
+        opts = DetectOptions(**options)
+        key = (opts, address, network, since, until)
+        with self.__cache_lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache_hits += 1
+                self.cache.move_to_end(key)
+                return cached
+            self.cache_misses += 1
+
+        with self.__parser_lock:
+            return_data = self.parser.GetInfo(**opts._asdict())
+        if address is not None or network is not None or since is not None or until is not None:
+            return_data = {k: self.__Filter(k, v, address, network, since, until) for k, v in return_data.items()}
+        else:
+            return_data = {k: list(v) for k, v in return_data.items()}
+
+        with self.__cache_lock:
+            self.cache[key] = return_data
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return return_data
+
+    def Status(self) -> dict:
+        """読み込んだログと結果のLRUの状態を返す
+        """
+        return {
+            "file": self.filename,
+            "loaded_at": str(self.loaded_at),
+            "addresses": len(self.parser.ServerLogs),
+            "parse": self.parser.ParseStats,
+            "cache": {"size": len(self.cache), "hits": self.cache_hits, "misses": self.cache_misses},
+        }
+
+    @staticmethod
+    def __Filter(kind : str, rows : list, address : str, network : str, since : datetime, until : datetime) -> list:
+        """期間の行を絞り込む
+        """
+        if kind not in ("broken", "overload", "switch_broken", "anomaly"):
+            return list(rows)
+        address_network = None if address is None else network_of(address)
+        network = None if network is None else network.split('/')[0]
+        since = None if since is None else str(since)
+        until = None if until is None else str(until)
+        result = []
+        for row in rows:
+            addr, start, end = row.split(',')
+            if kind == "switch_broken":
+                if address is not None and addr != address_network:
+                    continue
+                if network is not None and addr != network:
+                    continue
+            else:
+                if address is not None and addr != address:
+                    continue
+                if network is not None and network_of(addr) != network:
+                    continue
+            # 時刻は "YYYY-MM-DD HH:MM:SS" なので文字列のまま比較できる (継続中の終了は無限大)
+            if until is not None and start > until:
+                continue
+            if since is not None and not end.startswith("----") and end < since:
+                continue
+            result.append(row)
+        return result
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """常駐プロセスのHTTPの問い合わせを処理する
+
+        GET  /info?min_access_count=2&overload=5,300&since=20201019130000&address=10.20.30.1/16 ...
+             (DetectOptionsの項目名をそのまま指定できる。overload=m,t は overload_average_count と overload_limit_time_ms)
+        GET  /status
+        POST /reload
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        snapshot = self.server.snapshot    # 処理中に差し替えられても、この問い合わせでは同じものを使う
+        try:
+            if url.path == "/info":
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                self.__Reply(200, snapshot.Query(*parse_query_params(params)))
+            elif url.path == "/status":
+                self.__Reply(200, snapshot.Status())
+            else:
+                self.__Reply(404, {"error": f"not found : {url.path}"})
+        except (ValueError, TypeError) as e:
+            self.__Reply(400, {"error": str(e)})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/reload":
+            self.__Reply(404, {"error": f"not found : {self.path}"})
+            return
+        old = self.server.snapshot
+        self.server.snapshot = QuerySnapshot(old.filename, old.cache_size)
+        self.__Reply(200, self.server.snapshot.Status())
+
+    def address_string(self):
+        # Unixソケットの場合はclient_addressが文字列になる
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def __Reply(self, status : int, body : dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class QueryHTTPServer(ThreadingHTTPServer):
+    """TCPで待ち受ける常駐プロセス"""
+    daemon_threads = True
+
+    def __init__(self, address : tuple, snapshot : QuerySnapshot, verbose : bool = False):
+        self.snapshot = snapshot
+        self.verbose = verbose
+        super().__init__(address, QueryRequestHandler)
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class QueryUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        """Unixソケットで待ち受ける常駐プロセス"""
+        daemon_threads = True
+
+        def __init__(self, path : str, snapshot : QuerySnapshot, verbose : bool = False):
+            self.snapshot = snapshot
+            self.verbose = verbose
+            super().__init__(path, QueryRequestHandler)
+
+
+def parse_query_params(params : dict):
+    """/info のパラメータを QuerySnapshot.Query の引数にする
 
-        return return_data
+    Args:
+        params (dict): {名前 : 値の文字列}
+    Returns:
+        (dict, str, str, datetime, datetime): 判定条件, address, network, since, until
+    """
+    params = dict(params)
+    options = {}
+    overload = params.pop("overload", None)
+    if overload is not None:
+        m, t = overload.split(',')
+        options["overload_average_count"] = int(m)
+        options["overload_limit_time_ms"] = int(t)
+    address = params.pop("address", None)
+    network = params.pop("network", None)
+    since = until = None
+    if "since" in params:
+        since = parse_time(params.pop("since"))
+        if since is None:
+            raise ValueError("invalid since")
+    if "until" in params:
+        until = parse_time(params.pop("until"))
+        if until is None:
+            raise ValueError("invalid until")
+    for name, value in params.items():
+        if name not in DetectOptions._field_defaults:
+            raise ValueError(f"unknown parameter : {name}")
+        default = DetectOptions._field_defaults[name]
+        if name == "failure_codes":
+            options[name] = parse_failure_codes(value)
+        elif isinstance(default, bool):
+            options[name] = value.lower() in ("1", "true", "yes")
+        else:
+            options[name] = type(default)(value)
+    return options, address, network, since, until
 
 
 def get_param_from_argv(tag : str) -> str:
@@ -372,7 +4173,7 @@ def get_param_from_argv(tag : str) -> str:
     if tag in sys.argv:
         idx = sys.argv.index(tag)
         idx1 = idx + 1
-        if argv_length >= (idx1):
+        if argv_length > idx1:
             param = sys.argv[idx1]
         else:
             param = ""
@@ -380,6 +4181,198 @@ def get_param_from_argv(tag : str) -> str:
     return param
 
 
+def parse_size(text : str) -> int:
+    """"64M" のようなサイズ指定をbyte数にする
+
+    Args:
+        text (str): 数字、または、数字 + K/M/G
+    Returns:
+        int: byte数。指定がない、または、エラー入力の時は0。
+    """
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper()
+    scale = 1
+    if text[-1:] in units:
+        scale = units[text[-1]]
+        text = text[:-1]
+    if not text.isdecimal():
+        return 0
+    return int(text) * scale
+
+
+def parse_float(text : str) -> float:
+    """"0.5" のような数値指定をfloatにする
+
+    Args:
+        text (str): 数値
+    Returns:
+        float: 数値。エラー入力の時はNone。
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_time(text : str) -> datetime:
+    """"20201019130424" (ログと同じ形式)、または、"2020-10-19 13:04:24" をdatetimeにする
+
+    Args:
+        text (str): 時刻
+    Returns:
+        datetime: 時刻。エラー入力の時はNone。
+    """
+    try:
+        if text.isdecimal():
+            return datetime.strptime(text, '%Y%m%d%H%M%S')
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+def load_addresses(filename : str) -> list:
+    """サーバの一覧を読む (1行に1つのアドレス、または、partitionで書き出したmanifest.json)
+
+    Args:
+        filename (str): 一覧のファイルのパス
+    Returns:
+        list: アドレスのリスト
+    """
+    with open(filename, "r", encoding="utf-8") as fin:
+        text = fin.read()
+    if text.lstrip().startswith("{"):
+        return json.loads(text)["addresses"]
+    return [x.strip() for x in text.splitlines() if x.strip() != ""]
+
+
+def serve_main():
+    """serve サブコマンド : ログを1回だけ読み込んで、GetInfoと同じ結果をHTTPで返し続ける
+
+        > python q04/04.py serve --file LOG [--port PORT | --unix PATH] [--cache N]
+    """
+    in_file = get_param_from_argv("--file")
+    if not os.path.isfile(in_file):
+        print(f"target file not found : {in_file}")
+        sys.exit()
+    cache_size = get_param_from_argv("--cache")
+    cache_size = int(cache_size) if cache_size.isdecimal() else 256
+    snapshot = QuerySnapshot(in_file, cache_size)
+    unix_path = get_param_from_argv("--unix")
+    if unix_path != "":
+        server = QueryUnixServer(unix_path, snapshot, verbose=True)
+        print(f"serving {in_file} on {unix_path}", file=sys.stderr)
+    else:
+        port = get_param_from_argv("--port")
+        port = int(port) if port.isdecimal() else 8080
+        server = QueryHTTPServer(("127.0.0.1", port), snapshot, verbose=True)
+        print(f"serving {in_file} on http://127.0.0.1:{port}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_path != "" and os.path.exists(unix_path):
+            os.remove(unix_path)
+
+
+def archive_main():
+    """archive サブコマンド : テキストのログをアーカイブ形式に変換する
+
+        > python q04/04.py archive LOG ARCHIVE [--block-records N] [--quarantine PATH]
+    """
+    if len(sys.argv) < 4 or not os.path.isfile(sys.argv[2]):
+        print("please input log file path and archive file path.")
+        sys.exit()
+    block_records = get_param_from_argv("--block-records")
+    block_records = int(block_records) if block_records.isdecimal() else 4096
+    quarantine_file = get_param_from_argv("--quarantine") or None
+    counters = convert_to_archive(sys.argv[2], sys.argv[3], block_records, quarantine_file)
+    src_size = os.path.getsize(sys.argv[2])
+    dst_size = os.path.getsize(sys.argv[3])
+    print(f"lines={counters['parsed']} text={src_size} archive={dst_size} ratio={src_size / max(dst_size, 1):.1f}")
+
+
+def rollup_main():
+    """rollup サブコマンド : 保存した応答時間の集計から、アドレスかネットワークの区間毎の値を出力する
+
+        > python q04/04.py rollup ROLLUP --key ADDRESS|NETWORK [--level 60|300|3600] [--from T1] [--to T2]
+    """
+    if len(sys.argv) < 3 or not os.path.isfile(sys.argv[2]):
+        print("please input rollup file path.")
+        sys.exit()
+    rollup = Rollup.Load(sys.argv[2])
+    key = get_param_from_argv("--key")
+    level = get_param_from_argv("--level")
+    level = int(level) if level.isdecimal() else rollup.levels[-1]
+    if level not in rollup.levels:
+        print(f"please input --level from {','.join(str(x) for x in rollup.levels)}.")
+        sys.exit()
+    since = parse_time(get_param_from_argv("--from"))
+    until = parse_time(get_param_from_argv("--to"))
+    print("start,count,average,min,max,failed")
+    for start, count, total, minimum, maximum, failed in rollup.Query(key, level, since, until):
+        if count == 0:
+            print(f"{start},0,,,,{failed}")
+        else:
+            print(f"{start},{count},{total / count:.1f},{minimum},{maximum},{failed}")
+
+
+def shard_main():
+    """partition / shard-run / merge サブコマンド : 複数のマシン・プロセスでネットワーク毎に分担して判定する
+
+        > python q04/04.py partition LOG DIR [--shards N] [--quarantine PATH]
+        > python q04/04.py shard-run DIR/manifest.json I [--options JSON]
+        > python q04/04.py merge DIR/manifest.json [--options JSON]
+
+        JSONは判定条件 (GetInfoのキーワード引数) ex.) '{"overload_average_count": 2, "overload_limit_time_ms": 200}'
+    """
+    command = sys.argv[1]
+    if len(sys.argv) < 3 or (command != "partition" and not os.path.isfile(sys.argv[2])):
+        print("please input log file path or manifest file path.")
+        sys.exit()
+    options = json.loads(get_param_from_argv("--options") or "{}")
+    if command == "partition":
+        if len(sys.argv) < 4:
+            print("please input output directory.")
+            sys.exit()
+        shards = get_param_from_argv("--shards")
+        shards = int(shards) if shards.isdecimal() else 4
+        manifest = partition_log(sys.argv[2], sys.argv[3], shards, get_param_from_argv("--quarantine") or None)
+        print(f"addresses={len(manifest['addresses'])} shards={shards} : {os.path.join(sys.argv[3], SHARD_MANIFEST)}")
+    elif command == "shard-run":
+        run_shard(sys.argv[2], int(sys.argv[3]), **options)
+    else:
+        parser = ServerLogParser()
+        parser.MergeShards(sys.argv[2], **options)
+        for o in parser.OutputResult():
+            print(o)
+
+
+def query_main():
+    """query サブコマンド : 保存した索引から、ある時刻に続いていた期間、または、時間帯に重なる期間を出力する
+
+        > python q04/04.py query INDEX --at T
+        > python q04/04.py query INDEX --from T1 --to T2
+    """
+    if len(sys.argv) < 3 or not os.path.isfile(sys.argv[2]):
+        print("please input index file path.")
+        sys.exit()
+    index = IntervalIndex.Load(sys.argv[2])
+    at = parse_time(get_param_from_argv("--at"))
+    since = parse_time(get_param_from_argv("--from"))
+    until = parse_time(get_param_from_argv("--to"))
+    if at is not None:
+        result = index.Stab(at)
+    elif since is not None and until is not None:
+        result = index.Overlap(since, until)
+    else:
+        print("please input --at T, or --from T1 --to T2.")
+        sys.exit()
+    for x in result:
+        print(f"{x.kind},{format_interval(x)}")
+
+
 if __name__=="__main__":
     limit_time = 0
     argv_length = len(sys.argv)
@@ -388,6 +4381,22 @@ if __name__=="__main__":
         print("please input text file path.")
         sys.exit()
 
+    if sys.argv[1] == "query":
+        query_main()
+        sys.exit()
+    if sys.argv[1] == "archive":
+        archive_main()
+        sys.exit()
+    if sys.argv[1] == "rollup":
+        rollup_main()
+        sys.exit()
+    if sys.argv[1] in ("partition", "shard-run", "merge"):
+        shard_main()
+        sys.exit()
+    if sys.argv[1] == "serve":
+        serve_main()
+        sys.exit()
+
     # min_access_count の抽出 # N指定
     cmd_key = "--min-access-count"
     min_access_count = get_param_from_argv(cmd_key)
@@ -409,21 +4418,278 @@ if __name__=="__main__":
             overload_m = int(overload_m)
             overload_t = int(overload_t)
 
+    # overload-window の抽出 # W[,average|max] 指定
+    cmd_key = "--overload-window"
+    overload_window = get_param_from_argv(cmd_key)
+    overload_window_sec = 0         # 0 : 回数で判定する
+    overload_window_mode = "average"
+    splt = overload_window.split(',')
+    if splt[0].isdecimal():
+        overload_window_sec = int(splt[0])
+        if len(splt) == 2:
+            overload_window_mode = splt[1]
+        if overload_window_mode not in ("average", "max"):
+            print(f"usage : --overload-window W[,average|max] ({overload_window})")
+            sys.exit()
+
+    # storm の抽出 # 区間の長さ[秒],割合 指定
+    cmd_key = "--storm"
+    storm = get_param_from_argv(cmd_key).split(',')
+    storm_bin_sec = 0       # 0 : 判定しない
+    storm_ratio = 0.5
+    if storm[0].isdecimal():
+        storm_bin_sec = int(storm[0])
+        if len(storm) == 2:
+            storm_ratio = parse_float(storm[1])
+        if storm_ratio is None or not 0 < storm_ratio <= 1:
+            print(f"usage : --storm S[,r] (0 < r <= 1) ({','.join(storm)})")
+            sys.exit()
+
+    # switch-threshold の抽出 # 割合[,離脱までの秒数] 指定
+    cmd_key = "--switch-threshold"
+    switch = get_param_from_argv(cmd_key).split(',')
+    switch_threshold = 1.0          # すべてのサーバが故障した場合のみ
+    switch_member_timeout_sec = 0   # 0 : ネットワークから外さない
+    if switch[0] != "":
+        switch_threshold = parse_float(switch[0])
+        if switch_threshold is None or not 0 < switch_threshold <= 1:
+            print(f"usage : --switch-threshold r[,T] (0 < r <= 1) ({','.join(switch)})")
+            sys.exit()
+        if len(switch) == 2 and switch[1].isdecimal():
+            switch_member_timeout_sec = int(switch[1])
+
+    # anomaly の抽出 # α[,k] 指定
+    cmd_key = "--anomaly"
+    anomaly = get_param_from_argv(cmd_key).split(',')
+    anomaly_alpha = 0       # 0 : 判定しない
+    anomaly_k = 3.0
+    if anomaly[0] != "":
+        anomaly_alpha = parse_float(anomaly[0])
+        if len(anomaly) == 2:
+            anomaly_k = parse_float(anomaly[1])
+        if anomaly_alpha is None or anomaly_k is None or not (0 < anomaly_alpha <= 1 and anomaly_k > 0):
+            print(f"usage : --anomaly alpha[,k] (0 < alpha <= 1, k > 0) ({','.join(anomaly)})")
+            sys.exit()
+
+    # hysteresis の抽出 # 回復とみなす連続した応答の回数[,つなげる間隔[秒]] 指定
+    cmd_key = "--hysteresis"
+    hysteresis = get_param_from_argv(cmd_key).split(',')
+    broken_close_count = 1      # 1回の応答で回復とみなす
+    broken_merge_gap_sec = 0    # 0 : つなげない
+    if hysteresis[0].isdecimal():
+        broken_close_count = max(int(hysteresis[0]), 1)
+        if len(hysteresis) == 2 and hysteresis[1].isdecimal():
+            broken_merge_gap_sec = int(hysteresis[1])
+
+    # failure-codes の抽出 # 分類=状態|状態,分類=状態 指定 (既定は broken=-)
+    cmd_key = "--failure-codes"
+    failure_codes = get_param_from_argv(cmd_key)
+    failure_codes = parse_failure_codes(failure_codes) if failure_codes != "" else DEFAULT_FAILURE_CODES
+
+    # coverage の抽出 # 指定時はネットワーク・時間帯毎のサーバの数を出す ([時間帯の長さ[秒]] 指定)
+    cmd_key = "--coverage"
+    coverage_bucket_sec = 0
+    if cmd_key in sys.argv:
+        coverage_bucket_sec = get_param_from_argv(cmd_key)
+        coverage_bucket_sec = int(coverage_bucket_sec) if coverage_bucket_sec.isdecimal() else 3600
+
+    # current の抽出 # 指定時は末尾から読んで現在の故障だけを出力する ([遡る秒数[,許容する遅れ[秒]]] 指定)
+    cmd_key = "--current"
+    current = None
+    current_lateness = 0
+    if cmd_key in sys.argv:
+        current = get_param_from_argv(cmd_key).split(',')
+        if len(current) == 2 and current[1].isdecimal():
+            current_lateness = int(current[1])
+        current = int(current[0]) if current[0].isdecimal() else 0
+
+    # addresses の抽出 # サーバの一覧 (--current ではすべて確定したら読むのをやめる)
+    cmd_key = "--addresses"
+    addresses_file = get_param_from_argv(cmd_key)
+
+    # stream の抽出 # 指定時はファイル全体を並べ替えずに、許容する遅れ[秒]の範囲で並べ直して判定する
+    cmd_key = "--stream"
+    stream = None
+    if cmd_key in sys.argv:
+        stream = get_param_from_argv(cmd_key)
+        stream = int(stream) if stream.isdecimal() else 0
+
+    # from / to の抽出 # 指定時はこの時刻の範囲の行だけを読む (アーカイブ形式は範囲外のブロックを飛ばす)
+    since = parse_time(get_param_from_argv("--from"))
+    until = parse_time(get_param_from_argv("--to"))
+
+    # index の抽出 # 指定時は判定した期間の索引を保存する (query サブコマンドで検索する)
+    cmd_key = "--index"
+    index_file = get_param_from_argv(cmd_key)
+
+    # store の抽出 # 指定時は判定した期間をSQLiteのデータベースに保存する
+    cmd_key = "--store"
+    store_file = get_param_from_argv(cmd_key)
+
+    # rollup の抽出 # 指定時は応答時間の多段の集計を保存する (rollup サブコマンドで検索する)
+    cmd_key = "--rollup"
+    rollup_file = get_param_from_argv(cmd_key)
+
+    # top の抽出 # 故障回数などの上位K件 指定
+    cmd_key = "--top"
+    top_k = get_param_from_argv(cmd_key)
+    top_k = int(top_k) if top_k.isdecimal() else 0
+
+    # availability の抽出 # 指定時は故障時間・稼働率を集計する
+    availability = "--availability" in sys.argv
+
+    # sweep の抽出 # N1,N2,.../m1,m2,.../t1,t2,... 指定
+    cmd_key = "--sweep"
+    sweep = [x.split(',') for x in get_param_from_argv(cmd_key).split('/')]
+    if len(sweep) == 3 and all(v.isdecimal() for x in sweep for v in x):
+        sweep = [[int(v) for v in x] for x in sweep]
+    else:
+        sweep = None
+
+    # workers の抽出 # 指定時は複数のプロセスで判定する
+    cmd_key = "--workers"
+    workers = get_param_from_argv(cmd_key)
+    workers = int(workers) if workers.isdecimal() else 0
+
+    # shards の抽出 # 指定時はネットワーク毎のファイルに分けて、ファイル毎に別のプロセスで判定する
+    cmd_key = "--shards"
+    shards = get_param_from_argv(cmd_key)
+    shards = int(shards) if shards.isdecimal() else 0
+
+    # sort-memory の抽出 # 指定時はファイル全体をメモリに載せずに処理する
+    cmd_key = "--sort-memory"
+    sort_memory = parse_size(get_param_from_argv(cmd_key))
+
+    # max-memory の抽出 # 指定時は保持するログが上限を超えた分を一時ファイルに書き出す
+    cmd_key = "--max-memory"
+    max_memory = parse_size(get_param_from_argv(cmd_key))
+
+    # quarantine の抽出 # 不正な行の書き出し先
+    cmd_key = "--quarantine"
+    quarantine_file = get_param_from_argv(cmd_key) or None
+
     # 対象ファイル名
     cmd_key = "--file"
     in_file = get_param_from_argv(cmd_key)
-    if os.path.isfile(in_file):
-        parser = ServerLogParser(in_file)
-    else:
+    if not os.path.isfile(in_file):
         print(f"target file not found : {in_file}")
         sys.exit()
 
+    if (since is not None or until is not None) and (current is not None or stream is not None or shards > 0
+                                                     or workers > 0 or sort_memory > 0):
+        print("--from / --to cannot be used with --current, --stream, --shards, --workers or --sort-memory.")
+        sys.exit()
+    if current is not None and is_archive(in_file):
+        print(f"--current cannot read an archive file from the end : {in_file}")
+        sys.exit()
+    # アーカイブには変換時 (archive --quarantine) に検査を通った行しか入っていない
+    if quarantine_file is not None and is_archive(in_file):
+        print(f"--quarantine cannot be used with an archive file (lines were checked by archive --quarantine) : {in_file}")
+        sys.exit()
+    # 判定した期間を保存するオプションは、ログ全体を読み込んでから判定する通常の処理でのみ使える
+    modes = [name for name, used in [("--current", current is not None), ("--stream", stream is not None),
+                                     ("--shards", shards > 0), ("--workers", workers > 0),
+                                     ("--sort-memory", sort_memory > 0), ("--sweep", sweep is not None)] if used]
+    # スイープは N, m, t とスイッチ故障・応答なしの分類だけで判定するので、他の判定条件は黙って無視せずにエラーにする
+    if sweep is not None:
+        ignored = [x for x in ["--min-access-count", "--overload", "--overload-window", "--storm", "--anomaly",
+                               "--hysteresis", "--availability", "--top", "--coverage"] if x in sys.argv]
+        if ignored:
+            print(f"--sweep cannot be used with {', '.join(ignored)}.")
+            sys.exit()
+    # メモリ上限はログを保持する通常の処理とスイープでのみ使える (他の処理はそれぞれのやり方でメモリを抑える)
+    if max_memory > 0 and [x for x in modes if x != "--sweep"]:
+        print(f"--max-memory cannot be used with {', '.join(x for x in modes if x != '--sweep')}.")
+        sys.exit()
+    if store_file != "" and modes:
+        print(f"--store cannot be used with {', '.join(modes)}.")
+        sys.exit()
+    if index_file != "" and modes:
+        print(f"--index cannot be used with {', '.join(modes)}.")
+        sys.exit()
+    if rollup_file != "" and modes:
+        print(f"--rollup cannot be used with {', '.join(modes)}.")
+        sys.exit()
+
     # メイン処理実行
-    parser.GetInfo(
+    options = dict(
         min_access_count=min_access_count,
         overload_average_count=overload_m,
         overload_limit_time_ms=overload_t,
+        overload_window_sec=overload_window_sec,
+        overload_window_mode=overload_window_mode,
+        storm_bin_sec=storm_bin_sec,
+        storm_ratio=storm_ratio,
+        switch_threshold=switch_threshold,
+        switch_member_timeout_sec=switch_member_timeout_sec,
+        availability=availability,
+        top_k=top_k,
+        anomaly_alpha=anomaly_alpha,
+        anomaly_k=anomaly_k,
+        broken_close_count=broken_close_count,
+        broken_merge_gap_sec=broken_merge_gap_sec,
+        failure_codes=failure_codes,
+        coverage_bucket_sec=coverage_bucket_sec,
     )
+    parser = ServerLogParser()
+    if sweep is not None:
+        # 全組み合わせを1回のパースで求めて、条件毎に出力する
+        parser.ParseLogFile(in_file, quarantine_file=quarantine_file, memory_limit_bytes=max_memory, since=since, until=until)
+        results = parser.GetInfoSweep(*sweep, switch_threshold=switch_threshold,
+            switch_member_timeout_sec=switch_member_timeout_sec, failure_codes=failure_codes)
+        for (n, m, t), return_data in results.items():
+            print(f"# min_access_count={n} overload={m},{t}")
+            for o in parser.OutputResult(return_data):
+                print(o)
+        sys.exit()
+    elif current is not None:
+        addresses = load_addresses(addresses_file) if addresses_file != "" else None
+        parser.GetCurrentStatus(in_file, min_access_count=min_access_count, lookback_sec=current, addresses=addresses,
+                                allowed_lateness_sec=current_lateness, failure_codes=failure_codes)
+        print(f"current : bytes_read={parser.CurrentStats['bytes_read']} addresses={parser.CurrentStats['addresses']}",
+            file=sys.stderr)
+    elif stream is not None:
+        parser.GetInfoStream(iter_log_lines(in_file), allowed_lateness_sec=stream, quarantine_file=quarantine_file, **options)
+        print(f"stream : late={parser.ParseStats['late']} reordered={parser.ParseStats['reordered']}"
+            f" buffered_high_water={parser.ParseStats['buffered_high_water']}", file=sys.stderr)
+    elif shards > 0:
+        parser.GetInfoSharded(in_file, shards=shards, quarantine_file=quarantine_file, **options)
+    elif workers > 0:
+        parser.GetInfoParallel(in_file, workers=workers, quarantine_file=quarantine_file, **options)
+    elif sort_memory > 0:
+        parser.GetInfoExternal(in_file, memory_limit_bytes=sort_memory, quarantine_file=quarantine_file, **options)
+    else:
+        rollup = Rollup(table=status_table(failure_codes)) if rollup_file != "" else None
+        # カバレッジは読み込みながら数える
+        coverage = None
+        if coverage_bucket_sec > 0:
+            coverage = CoverageStats(coverage_bucket_sec, table=status_table(failure_codes))
+        try:
+            parser.ParseLogFile(in_file, quarantine_file=quarantine_file, memory_limit_bytes=max_memory, rollup=rollup,
+                                coverage=coverage, since=since, until=until)
+        except ValueError as e:
+            # 集計に入らない応答時間 (Rollup.Add)
+            print(f"--rollup : {e}")
+            sys.exit()
+        parser.GetInfo(**options)
+        if rollup is not None:
+            rollup.Save(rollup_file)
+        if max_memory > 0:
+            stats = parser.MemoryStats
+            print(f"memory : limit={stats['limit_bytes']} high_water={stats['high_water_bytes']}"
+                f" spilled_addresses={stats['spilled_addresses']} spilled_lines={stats['spilled_lines']}", file=sys.stderr)
+        if store_file != "":
+            store = IntervalStore(store_file)
+            try:
+                count = parser.StoreIntervals(store, **options)
+            finally:
+                store.Close()
+            print(f"stored {count} intervals : {store_file}", file=sys.stderr)
+        if index_file != "":
+            parser.BuildIntervalIndex(**options).Save(index_file)
+
+    if parser.ParseStats.get("quarantined", 0) > 0:
+        print(f"quarantined {parser.ParseStats['quarantined']} lines : {quarantine_file}", file=sys.stderr)
 
     output = parser.OutputResult()
 
@@ -438,12 +4704,13 @@ if __name__=="__main__":
 testdata_path = "testdata/04"
 
 
-def diff_test(in_txt : str, valid_txt : str, min_access_count: int, overload_average_count: int, overload_limit_time_ms: int):
+def diff_test(in_txt : str, valid_txt : str, min_access_count: int, overload_average_count: int, overload_limit_time_ms: int, **options):
     """テストデータとの照合をする。一致しなかったエラー行をすべて返す
 
     Args:
         ret (_type_): 関数の戻り値
         valid_txt (_type_): テスト用テキストのパス
+        options : GetInfoに追加で渡すオプション
 
     Returns:
         error_line: 比較でエラーになった行を積み上げる
@@ -453,7 +4720,8 @@ def diff_test(in_txt : str, valid_txt : str, min_access_count: int, overload_ave
     ret = parser.GetInfo(
         min_access_count=min_access_count,
         overload_average_count=overload_average_count,
-        overload_limit_time_ms=overload_limit_time_ms)
+        overload_limit_time_ms=overload_limit_time_ms,
+        **options)
     result = parser.OutputResult()
 
     with open(valid_txt, "r", encoding="utf-8") as fin:
@@ -488,6 +4756,20 @@ def test_log1():
 
     assert diffs == []
 
+def test_logline_slots_and_intern():
+    """LogLineがインスタンス辞書を持たず、同じアドレスの文字列を共有しているか
+    """
+    global testdata_path
+    parser = ServerLogParser(f"{testdata_path}/log_1.txt")
+    for addr, server_log in parser.ServerLogs.items():
+        for log in server_log:
+            assert not hasattr(log, "__dict__")
+            assert log.address is addr
+
+    log = LogLine().Parse("20201019133124,10.20.30.1/16,-\n")
+    assert log.address is intern_address("10.20.30.1/16")
+    assert log.state == "-" and log.response_time == -1
+
 def _test_log2():
     """テスト用のコード
     """
@@ -508,3 +4790,853 @@ def _test_log2():
     )
 
     assert diffs == []
+
+def test_overload_window_average():
+    """時間窓(平均)での過負荷判定のテスト
+    """
+    global testdata_path
+    diffs = diff_test(
+        in_txt = f"{testdata_path}/log_2.txt",
+        valid_txt = f"{testdata_path}/valid_2-1.txt",
+        min_access_count=0,
+        overload_average_count=2,
+        overload_limit_time_ms=200,
+        overload_window_sec=30,
+    )
+
+    assert diffs == []
+
+def test_overload_window_max():
+    """時間窓(最大)での過負荷判定のテスト
+    """
+    global testdata_path
+    diffs = diff_test(
+        in_txt = f"{testdata_path}/log_2.txt",
+        valid_txt = f"{testdata_path}/valid_2-2.txt",
+        min_access_count=0,
+        overload_average_count=2,
+        overload_limit_time_ms=300,
+        overload_window_sec=30,
+        overload_window_mode="max",
+    )
+
+    assert diffs == []
+
+    # average と max 以外の集計方法は、平均として黙って扱わずにエラーにする
+    ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_2.txt",
+                          "--overload", "2,300", "--overload-window", "30,mx"], capture_output=True, text=True, check=True)
+    assert ret.stdout.strip() == "usage : --overload-window W[,average|max] (30,mx)"
+
+def test_external_sort():
+    """時刻順に並んでいないログを、小さいメモリ上限で外部ソートして処理するテスト
+    """
+    global testdata_path
+    options = dict(min_access_count=0, overload_average_count=2, overload_limit_time_ms=200)
+
+    parser = ServerLogParser()
+    parser.GetInfoExternal(f"{testdata_path}/log_3.txt", memory_limit_bytes=200, **options)
+    external = parser.OutputResult()
+
+    parser = ServerLogParser(f"{testdata_path}/log_3.txt")
+    parser.GetInfo(**options)
+    assert external == parser.OutputResult()
+
+    with open(f"{testdata_path}/valid_1.txt", "r", encoding="utf-8") as fin:
+        assert [x.rstrip() for x in external][:10] == [x.rstrip() for x in fin]
+
+def test_external_sorter_merge():
+    """ランに分けて書き出しても、同じ時刻の行は入力順を保つか
+    """
+    lines = [f"2020101913{m:02d}00,10.0.0.{i}/24,{i}" for i, m in enumerate([5, 1, 3, 1, 5, 0, 3, 1])]
+    sorter = ExternalLogSorter(memory_limit_bytes=150)
+    for line in lines:
+        sorter.Add(line)
+    assert len(sorter.run_files) > 1
+    assert list(sorter.Merge()) == sorted(lines, key=lambda x: x[:14])
+    assert sorter.run_files == []
+
+def test_sweep():
+    """スイープの結果が、条件毎にGetInfoを呼んだ結果と一致するか
+    """
+    for in_txt in (f"{testdata_path}/log_1.txt", "testdata/03/log2.txt"):
+        parser = ServerLogParser(in_txt)
+        results = parser.GetInfoSweep([0, 1, 2, 3], [1, 2, 3], [100, 150, 200])
+        assert len(results) == 4 * 3 * 3
+
+        for (n, m, t), return_data in results.items():
+            single = ServerLogParser(in_txt)
+            expected = single.GetInfo(min_access_count=n, overload_average_count=m, overload_limit_time_ms=t)
+            assert return_data == expected
+
+    # スイープで使わない判定条件は、黙って無視せずにエラーにする
+    command = [sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_1.txt", "--sweep", "0,1/2/200"]
+    ret = subprocess.run(command, capture_output=True, text=True, check=True)
+    assert ret.stdout.startswith("# min_access_count=0 overload=2,200\n")
+    ret = subprocess.run(command + ["--hysteresis", "2", "--top", "3"], capture_output=True, text=True, check=True)
+    assert ret.stdout.strip() == "--sweep cannot be used with --hysteresis, --top."
+
+def test_result_cache():
+    """同じ条件のGetInfoはLRUから返し、古いものは捨てられるか
+    """
+    parser = ServerLogParser(f"{testdata_path}/log_1.txt")
+    first = parser.GetInfo(min_access_count=0, overload_average_count=2, overload_limit_time_ms=200)
+    first["broken"].append("dummy")
+    second = parser.GetInfo(min_access_count=0, overload_average_count=2, overload_limit_time_ms=200)
+    assert parser.cache_hits == 1
+    assert "dummy" not in second["broken"]
+
+    parser.GetInfoSweep([0], [2], [200])
+    assert parser.GetInfo(min_access_count=0, overload_average_count=2, overload_limit_time_ms=200) == second
+    assert parser.cache_hits == 2
+
+    parser.result_cache_size = 2
+    for n in range(3):
+        parser.GetInfo(min_access_count=n)
+    assert len(parser.result_cache) == 2
+
+def test_iter_intervals():
+    """ジェネレータのAPIがGetInfoと同じ結果を返し、途中で止められるか
+    """
+    global testdata_path
+    options = dict(min_access_count=0, overload_average_count=2, overload_limit_time_ms=200)
+    parser = ServerLogParser(f"{testdata_path}/log_1.txt")
+    return_data = parser.GetInfo(**options)
+
+    intervals = list(parser.IterIntervals(**options))
+    assert [format_interval(x) for x in intervals if x.kind == "broken"] == return_data["broken"]
+    assert intervals[-1].end is not None
+
+    first = next(parser.IterIntervals(**options))
+    assert first == Interval("broken", "10.20.30.1/30", datetime(2020, 10, 19, 13, 4, 24), datetime(2020, 10, 19, 13, 8, 24))
+
+    networks = list(parser.IterNetworkIntervals(**options))
+    assert [x[0] for x in networks] == ["10.20.30.0"]
+    switch_broken = [format_interval(x) for x in networks[0][1] if x.kind == "switch_broken"]
+    assert switch_broken == return_data["switch_broken"]
+
+def test_storm():
+    """複数ネットワークの同時故障の区間を検出できるか
+    """
+    global testdata_path
+    diffs = diff_test(
+        in_txt = f"{testdata_path}/log_4.txt",
+        valid_txt = f"{testdata_path}/valid_4.txt",
+        min_access_count=0,
+        overload_average_count=10,
+        overload_limit_time_ms=1800,
+        storm_bin_sec=60,
+        storm_ratio=0.5,
+    )
+
+    assert diffs == []
+
+    parser = ServerLogParser(f"{testdata_path}/log_4.txt")
+    assert parser.GetInfo(storm_bin_sec=60, storm_ratio=0.7)["storm"] == [
+        "2020-10-19 13:02:00,2020-10-19 13:03:00,3,4,4"]
+    assert "storm" not in parser.GetInfo()
+
+    # 割合が数値でない、または、範囲外の時は使い方を出す
+    for ratio in ["abc", "0", "1.5"]:
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_4.txt",
+                              "--storm", f"60,{ratio}"], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == f"usage : --storm S[,r] (0 < r <= 1) (60,{ratio})"
+
+def test_switch_threshold():
+    """一度も故障していないサーバや、途中で増減するサーバを母数に入れて判定できるか
+    """
+    global testdata_path
+    parser = ServerLogParser(f"{testdata_path}/log_5.txt")
+    assert sorted(parser.Inventory.Hosts("10.5.0.0")) == ["10.5.0.1/16", "10.5.0.2/16", "10.5.0.3/16", "10.5.0.4/16"]
+
+    # 10.5.0.3 は故障していないので、すべて故障にはならない
+    assert parser.GetInfo()["switch_broken"] == []
+
+    # 2/3 が故障した時点から、10.5.0.4 が増えて 2/4 になるまで
+    assert parser.GetInfo(switch_threshold=0.6)["switch_broken"] == [
+        "10.5.0.0,2020-10-19 13:03:10,2020-10-19 13:06:30"]
+
+    # 10.5.0.3 が最後の観測から60秒で外れてから、10.5.0.4 が増えるまで
+    assert parser.GetInfo(switch_threshold=1.0, switch_member_timeout_sec=60)["switch_broken"] == [
+        "10.5.0.0,2020-10-19 13:05:20,2020-10-19 13:06:30"]
+
+    external = ServerLogParser()
+    assert external.GetInfoExternal(f"{testdata_path}/log_5.txt", switch_threshold=0.6)["switch_broken"] == [
+        "10.5.0.0,2020-10-19 13:03:10,2020-10-19 13:06:30"]
+
+    # 割合が数値でない、または、範囲外の時は使い方を出す
+    for switch in ["abc", "0", "1.5,60"]:
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_5.txt",
+                              "--switch-threshold", switch], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == f"usage : --switch-threshold r[,T] (0 < r <= 1) ({switch})"
+
+def test_parallel():
+    """複数プロセスで判定しても、GetInfoと同じ結果になるか (リングバッファが一周する小さいサイズで確認)
+    """
+    global testdata_path
+    cases = [
+        ("log_1.txt", dict(overload_average_count=2, overload_limit_time_ms=200)),
+        ("log_2.txt", dict(overload_average_count=2, overload_limit_time_ms=200, overload_window_sec=30)),
+        ("log_4.txt", dict(storm_bin_sec=60, storm_ratio=0.5)),
+        ("log_5.txt", dict(switch_threshold=0.6)),
+    ]
+    for in_txt, options in cases:
+        expected = ServerLogParser(f"{testdata_path}/{in_txt}").GetInfo(**options)
+        parser = ServerLogParser()
+        assert parser.GetInfoParallel(f"{testdata_path}/{in_txt}", workers=3, ring_capacity=2, **options) == expected
+
+    # 変換できる行がない場合も、1つのプロセスで判定した結果と同じになる
+    options = dict(availability=True, storm_bin_sec=60, top_k=3)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in [("empty.txt", ""), ("garbage.txt", "\n\ngarbage\nx,y\n")]:
+            filename = os.path.join(tmp, name)
+            with open(filename, "w", encoding="utf-8") as fout:
+                fout.write(text)
+            expected = ServerLogParser(filename).GetInfo(**options)
+            assert ServerLogParser().GetInfoParallel(filename, workers=2, **options) == expected
+
+def test_quarantine():
+    """不正な行を隔離しても、処理が止まらずに正常な行だけで判定できるか
+    """
+    global testdata_path
+    options = dict(overload_average_count=2, overload_limit_time_ms=200)
+    expected = ServerLogParser(f"{testdata_path}/log_1.txt").GetInfo(**options)
+    with tempfile.TemporaryDirectory() as tmp:
+        quarantine_file = os.path.join(tmp, "quarantine.txt")
+        parser = ServerLogParser()
+        parser.ParseLogFile(f"{testdata_path}/log_6.txt", quarantine_file=quarantine_file)
+        assert parser.GetInfo(**options) == expected
+        assert parser.ParseStats == {"lines": 21, "parsed": 14, "blank": 1, "quarantined": 6}
+        with open(quarantine_file, "r", encoding="utf-8") as fin:
+            assert [int(line.split('\t')[0]) for line in fin] == [6, 9, 12, 15, 18, 21]
+
+        assert ServerLogParser().GetInfoExternal(f"{testdata_path}/log_6.txt", memory_limit_bytes=256, tmp_dir=tmp, **options) == expected
+        os.remove(quarantine_file)
+        parser = ServerLogParser()
+        assert parser.GetInfoParallel(f"{testdata_path}/log_6.txt", workers=3, quarantine_file=quarantine_file, **options) == expected
+        assert parser.ParseStats == {"lines": 21, "parsed": 14, "blank": 1, "quarantined": 6}
+        # ワーカ毎に隔離した行は、ファイルの行番号順に1つにまとまる
+        with open(quarantine_file, "r", encoding="utf-8") as fin:
+            assert [int(line.split('\t')[0]) for line in fin] == [6, 9, 12, 15, 18, 21]
+        assert sorted(os.listdir(tmp)) == ["quarantine.txt"]
+
+def test_availability():
+    """故障時間・MTBF・MTTR・稼働率の集計 (継続中の故障はログの最後の時刻まで数える)
+    """
+    lines = [
+        "20201019130000,10.20.30.1/30,10",
+        "20201019130100,10.20.30.1/30,-",
+        "20201019130200,10.20.30.1/30,-",
+        "20201019130300,10.20.30.1/30,10",
+        "20201019130400,10.20.30.2/30,-",
+        "20201019131000,10.20.30.1/30,10",
+    ]
+    parser = ServerLogParser()
+    parser.ParseLogLines(lines)
+    ret = parser.GetInfo(availability=True)
+    assert ret["availability"] == [
+        "10.20.30.1/30,60,1,540.0,60.0,90.000",
+        "10.20.30.2/30,360,1,240.0,360.0,40.000",
+        "10.20.30.0,420,2,390.0,210.0,65.000",
+    ]
+    assert "availability" not in parser.GetInfo()
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+        assert ServerLogParser().GetInfoExternal(filename, availability=True) == ret
+        assert ServerLogParser().GetInfoParallel(filename, workers=2, availability=True) == ret
+
+def test_interval_store():
+    """期間をSQLiteに保存して検索できるか (同じログを2回入れても重複しない)
+    """
+    global testdata_path
+    options = dict(overload_average_count=2, overload_limit_time_ms=200)
+    parser = ServerLogParser(f"{testdata_path}/log_1.txt")
+    store = IntervalStore(":memory:", batch_size=2)
+    try:
+        assert parser.StoreIntervals(store, **options) == 5
+        parser.StoreIntervals(store, **options)
+        assert len(store.Query()) == 5
+
+        switch = store.Query(kind="switch_broken", network="10.20.30.0/30")
+        assert [format_interval(x) for x in switch] == parser.GetInfo(**options)["switch_broken"]
+        ret = store.Query(address="10.20.30.1/30", since=datetime(2020, 10, 19, 13, 10, 0))
+        assert [format_interval(x) for x in ret] == ["10.20.30.1/30,2020-10-19 13:12:24,2020-10-19 13:12:24"]
+        ret = store.Query(network="10.20.30.0", kind="broken", until=datetime(2020, 10, 19, 13, 5, 0))
+        assert [x.start for x in ret] == [datetime(2020, 10, 19, 13, 4, 24)]
+    finally:
+        store.Close()
+
+    # 通常の処理以外では保存できないので、黙って無視せずにエラーにする
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "intervals.db")
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_1.txt",
+                              "--store", db, "--workers", "2"], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == "--store cannot be used with --workers."
+        assert not os.path.exists(db)
+
+def test_anomaly():
+    """普段の応答時間から外れた期間だけを異常として、過負荷と同じ形式で返すか
+    """
+    global testdata_path
+    times = [100, 110, 90, 105, 95, 100, 900, 950, 100, 105, 95, 100, 110, 90, 105, 95, 100, 98, 102, 100, 800, 100]
+    lines = [f"202010191300{i:02d},10.20.30.1/30,{t}" for i, t in enumerate(times)]
+    lines.insert(7, "20201019130006,10.20.30.1/30,-")    # 応答なしは判定に含めない
+    parser = ServerLogParser()
+    parser.ParseLogLines(lines)
+    options = dict(overload_average_count=2, overload_limit_time_ms=5000, anomaly_alpha=0.2, anomaly_k=3.0)
+    ret = parser.GetInfo(**options)
+    assert ret["overload"] == []
+    assert ret["anomaly"] == [
+        "10.20.30.1/30,2020-10-19 13:00:06,2020-10-19 13:00:06",
+        "10.20.30.1/30,2020-10-19 13:00:20,2020-10-19 13:00:20",
+    ]
+    assert "anomaly" not in parser.GetInfo()
+    network_intervals = [x for _, intervals in parser.IterNetworkIntervals(**options) for x in intervals]
+    assert [format_interval(x) for x in network_intervals if x.kind == "anomaly"] == ret["anomaly"]
+
+    # αやkが数値でない、または、範囲外の時は使い方を出す
+    for anomaly in ["abc", "0", "1.5", "0.2,abc", "0.2,0"]:
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_2.txt",
+                              "--anomaly", anomaly], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == f"usage : --anomaly alpha[,k] (0 < alpha <= 1, k > 0) ({anomaly})"
+
+def test_hysteresis():
+    """応答と応答なしを繰り返すサーバの故障期間を、閉じる回数と間隔でまとめられるか
+    """
+    states = ["-", "10", "-", "-", "10", "10", "-", "10", "10", "10"]
+    lines = [f"2020101913{i:02d}00,10.20.30.1/30,{x}" for i, x in enumerate(states)]
+    lines.append("20201019132000,10.20.30.1/30,-")
+    parser = ServerLogParser()
+    parser.ParseLogLines(lines)
+
+    def broken(**options):
+        return [x.split(',', 1)[1] for x in parser.GetInfo(**options)["broken"]]
+
+    ongoing = "2020-10-19 13:20:00,----/--/-- --:--:--"
+    assert broken() == [
+        "2020-10-19 13:00:00,2020-10-19 13:00:00", "2020-10-19 13:02:00,2020-10-19 13:03:00",
+        "2020-10-19 13:06:00,2020-10-19 13:06:00", ongoing]
+    assert broken(broken_close_count=2) == [
+        "2020-10-19 13:00:00,2020-10-19 13:03:00", "2020-10-19 13:06:00,2020-10-19 13:06:00", ongoing]
+    assert broken(broken_merge_gap_sec=240) == ["2020-10-19 13:00:00,2020-10-19 13:06:00", ongoing]
+    assert broken(broken_merge_gap_sec=240, min_access_count=2) == ["2020-10-19 13:02:00,2020-10-19 13:03:00"]
+    assert broken(broken_merge_gap_sec=900) == ["2020-10-19 13:00:00,----/--/-- --:--:--"]
+
+def test_memory_limit():
+    """保持するログが上限を超えた分を一時ファイルに書き出しても、同じ結果になるか
+    """
+    global testdata_path
+    options = dict(storm_bin_sec=60, availability=True, broken_merge_gap_sec=120)
+    expected = ServerLogParser(f"{testdata_path}/log_4.txt").GetInfo(**options)
+    with tempfile.TemporaryDirectory() as tmp:
+        parser = ServerLogParser()
+        parser.ParseLogFile(f"{testdata_path}/log_4.txt", memory_limit_bytes=LogSpiller.line_bytes * 4, tmp_dir=tmp)
+        stats = parser.MemoryStats
+        assert stats["spilled_addresses"] > 0 and stats["spilled_lines"] > 0
+        assert stats["high_water_bytes"] <= LogSpiller.line_bytes * 5
+        assert parser.GetInfo(**options) == expected
+        assert parser.GetInfoSweep([0], [10], [180000])[(0, 10, 180000)]["broken"] == ServerLogParser(f"{testdata_path}/log_4.txt").GetInfo()["broken"]
+        assert os.listdir(tmp) != []
+
+        # 読み直すと前回の一時ファイルは消える
+        parser.ParseLogFile(f"{testdata_path}/log_1.txt")
+        assert os.listdir(tmp) == []
+
+    # ログを保持しない処理ではメモリ上限を使わないので、黙って無視せずにエラーにする
+    ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_4.txt",
+                          "--max-memory", "2K", "--workers", "2", "--shards", "2"], capture_output=True, text=True, check=True)
+    assert ret.stdout.strip() == "--max-memory cannot be used with --shards, --workers."
+    ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_4.txt",
+                          "--max-memory", "2K", "--sweep", "0/10/180000"], capture_output=True, text=True, check=True)
+    assert ret.stdout.startswith("# min_access_count=0 overload=10,180000\n")
+
+def test_interval_index():
+    """索引の検索結果が、すべての期間を調べた結果と同じか (保存して読み直しても同じか)
+    """
+    global testdata_path
+    options = dict(storm_bin_sec=60)
+    parser = ServerLogParser(f"{testdata_path}/log_4.txt")
+    index = parser.BuildIntervalIndex(**options)
+    intervals = index.intervals
+    assert len(intervals) > 0
+
+    def end_of(x):
+        return datetime.max if x.end is None else x.end
+
+    def expected(since, until):
+        return sorted((x for x in intervals if x.start <= until and end_of(x) >= since),
+            key=lambda x: (x.start, x.address, x.kind))
+
+    first = intervals[0].start
+    times = [first + timedelta(seconds=i * 15) for i in range(-4, 80)]
+    for t in times:
+        assert index.Stab(t) == expected(t, t)
+        assert index.Overlap(t, t + timedelta(seconds=90)) == expected(t, t + timedelta(seconds=90))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.json")
+        index.Save(path)
+        loaded = IntervalIndex.Load(path)
+        assert loaded.intervals == intervals
+        assert loaded.Stab(times[10]) == index.Stab(times[10])
+
+        # 通常の処理以外では索引を作れないので、黙って無視せずにエラーにする
+        os.remove(path)
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_1.txt",
+                              "--index", path, "--stream", "0", "--sort-memory", "1M"], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == "--index cannot be used with --stream, --sort-memory."
+        assert not os.path.exists(path)
+
+def test_current_status():
+    """末尾から読んだ現在の故障が、全体を判定した結果の継続中の故障と同じか
+    """
+    global testdata_path
+    for in_txt in ["log_1.txt", "log_2.txt", "log_4.txt", "log_5.txt"]:
+        parser = ServerLogParser(f"{testdata_path}/{in_txt}")
+        expected = sorted(x for x in parser.GetInfo()["broken"] if x.endswith("----/--/-- --:--:--"))
+        ret = ServerLogParser().GetCurrentStatus(f"{testdata_path}/{in_txt}", block_size=16)
+        assert sorted(ret["current_broken"]) == expected
+
+    # 応答が戻った行まで遡れば、それより前は読まない
+    lines = ["20201019130000,10.20.30.1/30,10", "20201019130000,10.20.30.2/30,-"] * 50
+    lines += ["20201019131000,10.20.30.1/30,-", "20201019131000,10.20.30.2/30,10", "20201019131100,10.20.30.1/30,-"]
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+        parser = ServerLogParser()
+        ret = parser.GetCurrentStatus(filename, addresses=["10.20.30.1/30", "10.20.30.2/30"], block_size=64)
+        assert ret["current_broken"] == ["10.20.30.1/30,2020-10-19 13:10:00,----/--/-- --:--:--"]
+        assert parser.CurrentStats["bytes_read"] < os.path.getsize(filename) // 4
+        assert parser.GetCurrentStatus(filename, min_access_count=3)["current_broken"] == []
+        assert parser.GetCurrentStatus(filename, lookback_sec=30)["current_broken"] == [
+            "10.20.30.1/30,2020-10-19 13:11:00,----/--/-- --:--:--"]
+
+        # 一覧が無いCLIの既定は先頭まで読み、--addresses (manifest.jsonも可) を渡すと途中でやめる
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines[:2] * 3000 + lines) + "\n")
+        command = [sys.executable, os.path.abspath(__file__), "--file", filename, "--current"]
+        ret = subprocess.run(command, capture_output=True, text=True, check=True)
+        assert ret.stdout.split("\n")[:2] == ["## current_broken", "10.20.30.1/30,2020-10-19 13:10:00,----/--/-- --:--:--"]
+        assert f"bytes_read={os.path.getsize(filename)} " in ret.stderr
+        manifest = partition_log(filename, os.path.join(tmp, "shards"), 2)
+        ret = subprocess.run(command + ["--addresses", os.path.join(tmp, "shards", SHARD_MANIFEST)],
+                             capture_output=True, text=True, check=True)
+        assert ret.stdout.split("\n")[:2] == ["## current_broken", "10.20.30.1/30,2020-10-19 13:10:00,----/--/-- --:--:--"]
+        assert f"bytes_read={os.path.getsize(filename)} " not in ret.stderr
+        assert load_addresses(os.path.join(tmp, "shards", SHARD_MANIFEST)) == manifest["addresses"]
+
+        # 遅れて書かれた行があっても、許容する遅れの分だけ余分に遡って、全体を並べ替えた判定と同じになる
+        lines = ["20201019130000,10.20.30.1/30,10", "20201019130000,10.20.30.2/30,10"] * 50
+        lines += ["20201019131040,10.20.30.1/30,-", "20201019131030,10.20.30.2/30,10", "20201019131035,10.20.30.1/30,10"]
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+        expected = [x for x in ServerLogParser(filename).GetInfo()["broken"] if x.endswith("----/--/-- --:--:--")]
+        assert expected == ["10.20.30.1/30,2020-10-19 13:10:40,----/--/-- --:--:--"]
+        ret = parser.GetCurrentStatus(filename, addresses=["10.20.30.1/30", "10.20.30.2/30"], block_size=64,
+                                      allowed_lateness_sec=10)
+        assert ret["current_broken"] == expected
+        assert parser.CurrentStats["bytes_read"] < os.path.getsize(filename) // 4
+
+def test_archive():
+    """アーカイブ形式に変換しても同じ結果になり、時間帯の外のブロックを飛ばせるか
+    """
+    global testdata_path
+    options = dict(storm_bin_sec=60, availability=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        for in_txt in ["log_3.txt", "log_4.txt"]:
+            archive = os.path.join(tmp, f"{in_txt}.slog")
+            convert_to_archive(f"{testdata_path}/{in_txt}", archive, block_records=4)
+            assert is_archive(archive) and not is_archive(f"{testdata_path}/{in_txt}")
+            assert os.path.getsize(archive) < os.path.getsize(f"{testdata_path}/{in_txt}")
+            expected = ServerLogParser(f"{testdata_path}/{in_txt}").GetInfo(**options)
+            assert ServerLogParser(archive).GetInfo(**options) == expected
+
+        archive = os.path.join(tmp, "log_4.txt.slog")
+        reader = ArchiveReader(archive)
+        since = datetime(2020, 10, 19, 13, 5, 0)
+        logs = list(reader.Iter(since=since))
+        with open(f"{testdata_path}/log_4.txt", "r", encoding="utf-8") as fin:
+            expected = [x for x in LogReader().Iter(fin) if x.datetime >= since]
+        assert [(x.address, x.datetime, x.state, x.response_time) for x in logs] == \
+            [(x.address, x.datetime, x.state, x.response_time) for x in expected]
+        assert reader.counters["blocks_skipped"] > 0
+
+        # 時間帯の指定はParseLogFileから使え、テキストでも同じ行を読む
+        until = datetime(2020, 10, 19, 13, 20, 0)
+        parser = ServerLogParser()
+        parser.ParseLogFile(archive, since=since, until=until)
+        assert parser.ParseStats["blocks_skipped"] > 0
+        expected = ServerLogParser()
+        expected.ParseLogFile(f"{testdata_path}/log_4.txt", since=since, until=until)
+        assert parser.GetInfo(**options) == expected.GetInfo(**options)
+
+        # 1行ずつ読む方法でも、アーカイブ形式をテキストと同じに読む
+        expected = ServerLogParser(f"{testdata_path}/log_4.txt").GetInfo(**options)
+        assert ServerLogParser().GetInfoExternal(archive, memory_limit_bytes=64, **options) == expected
+        assert ServerLogParser().GetInfoStream(iter_log_lines(archive), **options) == expected
+        assert ServerLogParser().GetInfoParallel(archive, workers=2, **options) == expected
+        assert ServerLogParser().GetInfoSharded(archive, shards=2, **options) == expected
+        try:
+            ServerLogParser().GetCurrentStatus(archive)
+            assert False
+        except ValueError:
+            pass
+
+        # 不正な行は変換時に除かれているので、読む時の --quarantine は黙って無視せずにエラーにする
+        quarantine_file = os.path.join(tmp, "quarantine.txt")
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", archive,
+                              "--quarantine", quarantine_file], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == (
+            f"--quarantine cannot be used with an archive file (lines were checked by archive --quarantine) : {archive}")
+        assert not os.path.exists(quarantine_file)
+
+    # 2byte以上のvarintと負の差
+    buf = bytearray()
+    for x in [0, 127, 128, 300, 1 << 40]:
+        encode_varint(x, buf)
+    pos = 0
+    for x in [0, 127, 128, 300, 1 << 40]:
+        value, pos = decode_varint(buf, pos)
+        assert value == x
+    assert [unzigzag(zigzag(x)) for x in [-3, -1, 0, 1, 5]] == [-3, -1, 0, 1, 5]
+
+def test_query_server():
+    """常駐プロセスの問い合わせが、GetInfoと同じ結果を返すか (同時の問い合わせと結果のLRU)
+    """
+    global testdata_path
+    import urllib.request
+    snapshot = QuerySnapshot(f"{testdata_path}/log_1.txt", cache_size=2)
+    server = QueryHTTPServer(("127.0.0.1", 0), snapshot)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def get(path):
+        with urllib.request.urlopen(base + path) as res:
+            return json.loads(res.read().decode("utf-8"))
+
+    try:
+        expected = ServerLogParser(f"{testdata_path}/log_1.txt").GetInfo(overload_average_count=2, overload_limit_time_ms=200)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(get("/info?overload=2,200"))) for _ in range(8)]
+        for x in threads:
+            x.start()
+        for x in threads:
+            x.join()
+        assert results == [expected] * 8
+        assert snapshot.cache_misses + snapshot.cache_hits == 8 and snapshot.cache_hits >= 1
+
+        ret = get("/info?overload=2,200&address=10.20.30.1/30&since=20201019131000")
+        assert ret["broken"] == ["10.20.30.1/30,2020-10-19 13:12:24,2020-10-19 13:12:24"]
+        assert ret["switch_broken"] == ["10.20.30.0,2020-10-19 13:12:24,2020-10-19 13:12:24"]
+        assert get("/info?min_access_count=2&availability=true")["broken"] == expected["broken"][0:1] + expected["broken"][2:]
+        assert get("/status")["addresses"] == 2
+        try:
+            get("/info?unknown=1")
+            assert False
+        except urllib.error.HTTPError as e:
+            assert e.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_top_k():
+    """上位K件が処理方法によらず同じになり、近似の回数が誤差の範囲に入るか
+    """
+    global testdata_path
+    options = dict(top_k=2, min_access_count=1)
+    expected = ServerLogParser(f"{testdata_path}/log_5.txt").GetInfo(**options)
+    assert len(expected["top_outages"]) == 2
+    assert ServerLogParser().GetInfoExternal(f"{testdata_path}/log_5.txt", **options) == expected
+    assert ServerLogParser().GetInfoParallel(f"{testdata_path}/log_5.txt", workers=3, **options) == expected
+
+    # 追加する順によらない
+    a = TopK(2)
+    b = TopK(2)
+    for addr, value in [("a", 1), ("b", 3), ("c", 3), ("d", 2)]:
+        a.Push(addr, value)
+    for addr, value in [("d", 2), ("c", 3), ("b", 3), ("a", 1)]:
+        b.Push(addr, value)
+    assert a.Items() == b.Items() == [("b", 3), ("c", 3)]
+
+    # 一方がもう一方の先頭と同じアドレスでも、辞書順で前の方を残す
+    for order in [["10.0.0.1", "10.0.0.10"], ["10.0.0.10", "10.0.0.1"]]:
+        c = TopK(1)
+        for addr in order:
+            c.Push(addr, 5)
+        assert c.Items() == [("10.0.0.1", 5)]
+
+    # 記録より多いアドレスでも、回数は実際以上で、誤差を引くと実際以下になる
+    counts = {f"10.0.0.{i}/24": (i % 7 + 1) * (3 if i < 5 else 1) for i in range(40)}
+    first = SpaceSaving(10)
+    second = SpaceSaving(10)
+    for i, (addr, n) in enumerate(counts.items()):
+        for _ in range(n):
+            (first if i % 2 else second).Add(addr)
+    first.Merge(second)
+    for addr, count, error in first.Items():
+        assert count - error <= counts[addr] <= count
+    heavy = max(counts, key=counts.get)
+    assert heavy in [x[0] for x in first.Items()[:3]]
+
+def test_rollup():
+    """多段の集計が、ログから直接求めた区間毎の値と一致し、保存・読み込みで変わらないか
+    """
+    global testdata_path
+    for in_txt, levels in [("log_3.txt", (10, 60, 300)), ("log_4.txt", Rollup.LEVELS)]:
+        rollup = Rollup(levels)
+        parser = ServerLogParser()
+        parser.ParseLogFile(f"{testdata_path}/{in_txt}", rollup=rollup)
+        with open(f"{testdata_path}/{in_txt}", "r", encoding="utf-8") as fin:
+            logs = list(LogReader().Iter(fin))
+        for level in levels:
+            expected = {}
+            for log in logs:
+                seconds = datetime_to_seconds(log.datetime)
+                start = seconds_to_datetime(seconds - (seconds - rollup.origin) % level)
+                for key in (log.address, network_of(log.address)):
+                    cell = expected.setdefault(key, {}).setdefault(start, [0, 0, None, None, 0])
+                    if log.state == "-":
+                        cell[4] += 1
+                    elif log.response_time != -1:
+                        cell[0] += 1
+                        cell[1] += log.response_time
+                        cell[2] = log.response_time if cell[2] is None else min(cell[2], log.response_time)
+                        cell[3] = log.response_time if cell[3] is None else max(cell[3], log.response_time)
+            assert set(rollup.series) == set(expected)
+            for key, cells in expected.items():
+                assert rollup.Query(key, level) == [(start, *cells[start]) for start in sorted(cells)]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            rollup.Save(os.path.join(tmp, "rollup.bin"))
+            loaded = Rollup.Load(os.path.join(tmp, "rollup.bin"))
+        since = seconds_to_datetime(rollup.origin + levels[1])
+        for key in rollup.series:
+            for level in levels:
+                assert loaded.Query(key, level, since=since) == rollup.Query(key, level, since=since)
+
+    # 逆順に読むと、最初の行より前の行で起点を前にずらす
+    with open(f"{testdata_path}/log_4.txt", "r", encoding="utf-8") as fin:
+        lines = fin.readlines()[::-1]
+    reverse = Rollup((10, 60))
+    ServerLogParser().ParseLogLines(lines, rollup=reverse)
+    forward = Rollup((10, 60))
+    ServerLogParser().ParseLogLines(lines[::-1], rollup=forward)
+    assert reverse.origin == forward.origin == datetime_to_seconds(datetime(2020, 10, 19, 13, 0, 0))
+    for key in forward.series:
+        assert reverse.Query(key, 10) == forward.Query(key, 10) and reverse.Query(key, 60) == forward.Query(key, 60)
+
+    # 集計は通常の処理で読み込みながら作るので、他の処理方法では黙って無視せずにエラーにする
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "log_4.rollup")
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", f"{testdata_path}/log_4.txt",
+                              "--rollup", path, "--shards", "2"], capture_output=True, text=True, check=True)
+        assert ret.stdout.strip() == "--rollup cannot be used with --shards."
+        assert not os.path.exists(path)
+
+        # 32bitを超える応答時間も集計でき、保存して読み戻しても同じ
+        filename = os.path.join(tmp, "log.txt")
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.write("20201019130000,10.20.30.1/16,3000000000\n20201019130010,10.20.30.1/16,5\n")
+        ret = subprocess.run([sys.executable, os.path.abspath(__file__), "--file", filename, "--rollup", path],
+                             capture_output=True, text=True, check=True)
+        assert ret.stderr == ""
+        assert Rollup.Load(path).Query("10.20.30.1/16", 60) == [(datetime(2020, 10, 19, 13, 0, 0), 2, 3000000005, 5, 3000000000, 0)]
+        rollup = Rollup()
+        try:
+            rollup.Add(LogLine("10.20.30.1/16", datetime(2020, 10, 19, 13, 0, 0), "", 1 << 63))
+            assert False
+        except ValueError:
+            pass
+
+def test_stream():
+    """順序が入れ替わったログを、許容する遅れの範囲で並べ直して判定できるか (遅れた行は捨てて数える)
+    """
+    global testdata_path
+    options = dict(overload_average_count=2, overload_limit_time_ms=200, storm_bin_sec=60)
+    with open(f"{testdata_path}/log_3.txt", "r", encoding="utf-8") as fin:
+        lines = fin.readlines()
+    parser = ServerLogParser()
+    assert parser.GetInfoStream(lines, allowed_lateness_sec=3600, **options) == ServerLogParser(f"{testdata_path}/log_3.txt").GetInfo(**options)
+    assert parser.ParseStats["late"] == 0 and parser.ParseStats["reordered"] > 0
+
+    # 最も新しい時刻から許容する遅れより前の行は、捨てた行を除いたログと同じ結果になる
+    for lateness in [0, 60, 300]:
+        accepted = []
+        newest = None
+        for line in lines:
+            dt = datetime.strptime(line.split(',')[0], '%Y%m%d%H%M%S')
+            if newest is not None and dt < newest - timedelta(seconds=lateness):
+                continue
+            newest = dt if newest is None else max(newest, dt)
+            accepted.append(line)
+        assert len(accepted) < len(lines)
+        ret = parser.GetInfoStream(lines, allowed_lateness_sec=lateness, **options)
+        assert parser.ParseStats["late"] == len(lines) - len(accepted)
+        expected_parser = ServerLogParser()
+        expected_parser.ParseLogLines(accepted)
+        assert ret == expected_parser.GetInfo(**options)
+
+def test_sharding():
+    """ネットワーク毎のファイルに分けて判定し、まとめた結果がGetInfoと同じになるか
+    """
+    global testdata_path
+    options = dict(storm_bin_sec=60, switch_threshold=0.5, switch_member_timeout_sec=60, availability=True, top_k=2)
+    expected = ServerLogParser(f"{testdata_path}/log_4.txt").GetInfo(**options)
+    assert ServerLogParser().GetInfoSharded(f"{testdata_path}/log_4.txt", shards=3, **options) == expected
+
+    # 別のマシンで分担する手順 (partition → shard-run → merge) を同じプロセスで行う
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = partition_log(f"{testdata_path}/log_4.txt", tmp, 4)
+        networks = {}
+        for i, name in enumerate(manifest["shards"]):
+            with open(os.path.join(tmp, name), "r", encoding="utf-8") as fin:
+                for line in fin:
+                    networks.setdefault(network_of(line.split(',')[1]), set()).add(i)
+        assert all(len(x) == 1 for x in networks.values())
+        results = [run_shard(os.path.join(tmp, SHARD_MANIFEST), i, **options) for i in range(4)]
+        parser = ServerLogParser()
+        assert parser.MergeShards(os.path.join(tmp, SHARD_MANIFEST), results, **options) == expected
+        with open(f"{testdata_path}/log_4.txt", "r", encoding="utf-8") as fin:
+            assert parser.ParseStats["parsed"] == len(fin.readlines())
+
+    # 変換できる行がない場合も (manifest.json の時刻はNone)、1つのプロセスで判定した結果と同じになる
+    options = dict(availability=True, storm_bin_sec=60)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in [("empty.txt", ""), ("garbage.txt", "\n\ngarbage\nx,y\n")]:
+            filename = os.path.join(tmp, name)
+            with open(filename, "w", encoding="utf-8") as fout:
+                fout.write(text)
+            expected = ServerLogParser(filename).GetInfo(**options)
+            assert ServerLogParser().GetInfoSharded(filename, shards=2, **options) == expected
+
+def test_failure_codes():
+    """設定した応答なしの分類で故障を判定し、分類毎の回数を処理方法によらず同じに数えるか
+    """
+    lines = []
+    for i, (a, b) in enumerate([("1", "-"), ("T", "-"), ("T", "R"), ("2", "X"), ("-", "3"), ("R", "4"), ("5", "T")]):
+        lines.append(f"20201019130{i}00,10.20.30.1/16,{a}\n")
+        lines.append(f"20201019130{i}00,10.20.30.2/16,{b}\n")
+    codes = parse_failure_codes("broken=-,timeout=T,refused=R")
+    assert codes == (("broken", "-"), ("timeout", "T"), ("refused", "R"))
+    table = status_table(codes)
+    assert [table.Classify(x) for x in ["-", "T", "R", "X", ""]] == [1, 2, 3, 0, 0]
+    assert status_table() is status_table([["broken", "-"]]) and status_table().is_default
+    try:
+        StatusTable((("timeout", "T"), ("refused", "T")))
+        assert False
+    except ValueError:
+        pass
+
+    parser = ServerLogParser()
+    parser.ParseLogLines(lines)
+    # 既定では "-" だけが応答なし
+    ret = parser.GetInfo()
+    assert ret["broken"] == ["10.20.30.1/16,2020-10-19 13:04:00,2020-10-19 13:04:00",
+                             "10.20.30.2/16,2020-10-19 13:00:00,2020-10-19 13:01:00"]
+    assert "failure_categories" not in ret
+
+    ret = parser.GetInfo(failure_codes=codes)
+    assert ret["broken"] == ["10.20.30.1/16,2020-10-19 13:01:00,2020-10-19 13:02:00",
+                             "10.20.30.1/16,2020-10-19 13:04:00,2020-10-19 13:05:00",
+                             "10.20.30.2/16,2020-10-19 13:00:00,2020-10-19 13:02:00",
+                             "10.20.30.2/16,2020-10-19 13:06:00,----/--/-- --:--:--"]
+    assert ret["failure_categories"] == ["10.20.30.1/16,broken,1", "10.20.30.1/16,timeout,2", "10.20.30.1/16,refused,1",
+                                         "10.20.30.2/16,broken,2", "10.20.30.2/16,timeout,1", "10.20.30.2/16,refused,1"]
+    assert parser.GetInfoStream(lines, failure_codes=codes) == ret
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.writelines(lines)
+        assert ServerLogParser().GetInfoExternal(filename, failure_codes=codes) == ret
+        assert ServerLogParser().GetInfoParallel(filename, workers=2, failure_codes=codes) == ret
+        assert ServerLogParser().GetInfoSharded(filename, shards=2, failure_codes=codes) == ret
+
+    # JSONなどのリストの設定でも同じ結果になり、上位K件・集計・スイープ・現在の故障も同じ分類で数える
+    listed = [list(x) for x in codes]
+    assert parser.GetInfo(failure_codes=listed) == ret
+    expected = parser.GetInfo(top_k=2, failure_codes=codes)
+    assert sorted(expected["top_failed_samples"]) == ["10.20.30.1/16,4,0", "10.20.30.2/16,4,0"]
+    assert parser.GetInfoStream(lines, top_k=2, failure_codes=listed) == expected
+    rollup = Rollup(table=status_table(codes))
+    ServerLogParser().ParseLogLines(lines, rollup=rollup)
+    assert [x[5] for x in rollup.Query("10.20.30.2/16", 60)] == [1, 1, 1, 0, 0, 1]
+    sweep = ServerLogParser()
+    sweep.ParseLogLines(lines)
+    assert sweep.GetInfoSweep([0], [10], [180000], failure_codes=codes)[(0, 10, 180000)] == ret
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        with open(filename, "w", encoding="utf-8") as fout:
+            fout.writelines(lines)
+        assert ServerLogParser().GetInfoExternal(filename, top_k=2, failure_codes=listed) == expected
+        assert ServerLogParser().GetInfoParallel(filename, workers=2, top_k=2, failure_codes=listed) == expected
+        assert ServerLogParser().GetInfoSharded(filename, shards=2, top_k=2, failure_codes=listed) == expected
+        assert ServerLogParser().GetCurrentStatus(filename, failure_codes=codes)["current_broken"] == \
+            ["10.20.30.2/16,2020-10-19 13:06:00,----/--/-- --:--:--"]
+    assert parse_query_params({"failure_codes": "broken=-,timeout=T|TO"})[0]["failure_codes"] == \
+        (("broken", "-"), ("timeout", "T"), ("timeout", "TO"))
+
+def test_coverage():
+    """ネットワーク・時間帯毎のサーバの数が処理方法によらず同じで、HyperLogLogの見積もりが誤差の範囲に入るか
+    """
+    global testdata_path
+    options = dict(coverage_bucket_sec=300, storm_bin_sec=60)
+    coverage = CoverageStats(300)
+    parser = ServerLogParser()
+    parser.ParseLogFile(f"{testdata_path}/log_4.txt", coverage=coverage)
+    expected = parser.GetInfo(**options)
+    assert parser.Coverage is coverage
+
+    # 少ないうちは正確に数える
+    hosts = {}
+    with open(f"{testdata_path}/log_4.txt", "r", encoding="utf-8") as fin:
+        for log in LogReader().Iter(fin):
+            seconds = datetime_to_seconds(log.datetime)
+            cell = hosts.setdefault((network_of(log.address), seconds - seconds % 300), (set(), set()))
+            cell[0].add(log.address)
+            if log.state == "-":
+                cell[1].add(log.address)
+    assert expected["coverage"] == [f"{network},{seconds_to_datetime(bucket)},{len(a)},{len(b)}"
+                                    for (network, bucket), (a, b) in sorted(hosts.items(), key=lambda x: (x[0][1], x[0][0]))]
+    assert ServerLogParser(f"{testdata_path}/log_4.txt").GetInfo(**options) == expected
+    assert ServerLogParser().GetInfoExternal(f"{testdata_path}/log_4.txt", **options) == expected
+    assert ServerLogParser().GetInfoParallel(f"{testdata_path}/log_4.txt", workers=3, **options) == expected
+    assert ServerLogParser().GetInfoSharded(f"{testdata_path}/log_4.txt", shards=2, **options) == expected
+
+    # 多い場合は誤差の範囲に入り、分けて数えてまとめても同じになる
+    whole = HyperLogLog(10)
+    first = HyperLogLog(10)
+    second = HyperLogLog(10)
+    for i in range(20000):
+        value = f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}/8"
+        whole.Add(value)
+        (first if i % 3 else second).Add(value)
+    assert abs(whole.Count() - 20000) < 20000 * 0.1
+    first.Merge(second)
+    assert first.registers == whole.registers
+    assert HyperLogLog.Load(json.loads(json.dumps(whole.Dump()))).Count() == whole.Count()
+
+def test_invalid_utf8():
+    """UTF-8として読めないbyteを含む行だけを、正しい行番号で隔離するか
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        quarantine_file = os.path.join(tmp, "quarantine.txt")
+        for count, bad in [(4, 2), (20001, 9985)]:
+            with open(filename, "wb") as fout:
+                for i in range(1, count + 1):
+                    if i == bad:
+                        fout.write(b"20201019130000,10.20.30.1/16,\xff\n")
+                    else:
+                        fout.write(f"20201019130000,10.20.30.{i % 3 + 1}/16,{i % 50}\n".encode("utf-8"))
+            parser = ServerLogParser()
+            parser.ParseLogFile(filename, quarantine_file=quarantine_file)
+            assert parser.ParseStats == {"lines": count, "parsed": count - 1, "blank": 0, "quarantined": 1}
+            assert sum(len(x) for x in parser.ServerLogs.values()) == count - 1
+            with open(quarantine_file, "rb") as fin:
+                quarantined = fin.read()
+            # 行番号と、元のbyteのままの行
+            assert quarantined.startswith(f"{bad}\t".encode("utf-8"))
+            assert quarantined.endswith(b"\t20201019130000,10.20.30.1/16,\xff\n")
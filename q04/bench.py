@@ -0,0 +1,237 @@
+"""04.py のベンチマーク
+
+実行方法
+    > python q04/bench.py [memory]
+    > python q04/bench.py replay [行数]
+
+出力はそのまま標準出力に出すので、残す場合は bench_output.txt などにリダイレクトする。
+"""
+import gc
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# 04.py は数字で始まるのでimport文では読めない
+_spec = importlib.util.spec_from_file_location("q04", os.path.join(os.path.dirname(os.path.abspath(__file__)), "04.py"))
+q04 = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(q04)
+
+
+def generate_log(filename : str, lines : int = 200000, hosts : int = 1000, seed : int = 1):
+    """ベンチマーク用のログを生成する
+
+    Args:
+        filename (str): 出力先
+        lines (int, optional): 行数. Defaults to 200000.
+        hosts (int, optional): サーバ数. Defaults to 1000.
+        seed (int, optional): 乱数の種. Defaults to 1.
+    """
+    rnd = random.Random(seed)
+    addresses = [f"10.{20 + i // 65536}.{(i // 256) % 256}.{i % 256}/16" for i in range(hosts)]
+    broken = set()
+    dt = datetime(2020, 10, 19, 0, 0, 0)
+    with open(filename, "w", encoding="utf-8") as fout:
+        for i in range(lines):
+            addr = addresses[i % hosts]
+            if i % hosts == 0:
+                dt += timedelta(seconds=60)
+            # 故障は数回続くようにする
+            if addr in broken:
+                if rnd.random() < 0.3:
+                    broken.discard(addr)
+            elif rnd.random() < 0.01:
+                broken.add(addr)
+            response = "-" if addr in broken else str(rnd.randint(1, 400))
+            fout.write(f"{dt:%Y%m%d%H%M%S},{addr},{response}\n")
+
+
+class LegacyLogLine:
+    """__slots__導入前のLogLine (比較用)"""
+    address = "0.0.0.0",
+    break_datetime = datetime.min
+    state = ""
+    response_time = -1
+
+    def Parse(self, line : str):
+        line = line.rstrip()
+        splt = line.split(',')
+        self.address = splt[1]
+        self.datetime =  datetime.strptime(splt[0], '%Y%m%d%H%M%S')
+        if splt[2].isdecimal():
+            self.response_time = int(splt[2])
+            self.state = ""
+        else:
+            self.state = splt[2]
+        return self
+
+
+def legacy_parse(filename : str) -> dict:
+    server_logs = {}
+    with open(filename, "r", encoding="utf-8") as fin:
+        for line in fin:
+            line = line.rstrip()
+            log = LegacyLogLine()
+            p = log.Parse(line)
+            addr = p.address
+            if addr not in server_logs.keys():
+                server_logs[addr] = []
+            server_logs[addr].append(log)
+    return server_logs
+
+
+def current_parse(filename : str) -> dict:
+    q04.address_table.clear()
+    parser = q04.ServerLogParser(filename)
+    return parser.ServerLogs
+
+
+def measure(func, filename : str):
+    """関数の実行時間と、戻り値が保持しているヒープサイズを計測する
+    """
+    gc.collect()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    ret = func(filename)
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del ret
+    gc.collect()
+    return elapsed, current, peak
+
+
+def bench_memory(lines : int = 100000):
+    """LogLineの保持に使うヒープサイズを比較する
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        generate_log(filename, lines=lines)
+        print(f"## memory ({lines} lines)")
+        print("mode,seconds,heap_bytes,peak_bytes,bytes_per_line")
+        base = None
+        for name, func in (("legacy", legacy_parse), ("slots+intern", current_parse)):
+            elapsed, current, peak = measure(func, filename)
+            print(f"{name},{elapsed:.3f},{current},{peak},{current / lines:.1f}")
+            if base is None:
+                base = current
+        print(f"heap ratio : {current / base:.2f}")
+
+
+# testdata/04 の期待値と、その判定条件
+FIXTURES = [
+    ("log_1.txt", "valid_1.txt", dict(overload_average_count=2, overload_limit_time_ms=200)),
+    ("log_3.txt", "valid_1.txt", dict(overload_average_count=2, overload_limit_time_ms=200)),
+    ("log_6.txt", "valid_1.txt", dict(overload_average_count=2, overload_limit_time_ms=200)),
+    ("log_2.txt", "valid_2-1.txt", dict(overload_average_count=2, overload_limit_time_ms=200, overload_window_sec=30)),
+    ("log_2.txt", "valid_2-2.txt", dict(overload_average_count=2, overload_limit_time_ms=300, overload_window_sec=30,
+                                        overload_window_mode="max")),
+    ("log_4.txt", "valid_4.txt", dict(overload_limit_time_ms=1800, storm_bin_sec=60, storm_ratio=0.5)),
+]
+
+
+def run_batch(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    parser.ParseLogFile(filename)
+    parser.GetInfo(**options)
+    return "\n".join(parser.OutputResult())
+
+
+def run_external(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    # 小さいファイルでもランの書き出しとマージが起きるようにする
+    parser.GetInfoExternal(filename, memory_limit_bytes=max(os.path.getsize(filename) // 4, 1024), **options)
+    return "\n".join(parser.OutputResult())
+
+
+def run_parallel(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    parser.GetInfoParallel(filename, workers=4, **options)
+    return "\n".join(parser.OutputResult())
+
+
+def run_max_memory(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    parser.ParseLogFile(filename, memory_limit_bytes=max(os.path.getsize(filename) // 4, 1024))
+    parser.GetInfo(**options)
+    return "\n".join(parser.OutputResult())
+
+
+def run_stream(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    # testdataの並びの入れ替わりが収まる遅れにする
+    with open(filename, "r", encoding="utf-8") as fin:
+        parser.GetInfoStream(fin, allowed_lateness_sec=3600, **options)
+    return "\n".join(parser.OutputResult())
+
+
+def run_sharded(filename : str, options : dict) -> str:
+    parser = q04.ServerLogParser()
+    parser.GetInfoSharded(filename, shards=3, **options)
+    return "\n".join(parser.OutputResult())
+
+
+# ServerLogParserの処理方法 (batchが基準)
+MODES = [
+    ("batch", run_batch),
+    ("external", run_external),
+    ("parallel", run_parallel),
+    ("max-memory", run_max_memory),
+    ("stream", run_stream),
+    ("sharded", run_sharded),
+]
+
+
+def check_fixtures(testdata_path : str = "testdata/04"):
+    """すべての処理方法の出力が、testdataの期待値と一致するか確認する
+    """
+    for log_txt, valid_txt, options in FIXTURES:
+        with open(os.path.join(testdata_path, valid_txt), "r", encoding="utf-8") as fin:
+            expected = fin.read().rstrip("\n")
+        for name, func in MODES:
+            output = func(os.path.join(testdata_path, log_txt), options).rstrip("\n")
+            assert output == expected, f"{name} : {log_txt} != {valid_txt}"
+    print(f"fixtures : {len(FIXTURES)} cases x {len(MODES)} modes OK")
+
+
+def bench_replay(lines : int = 200000):
+    """生成したログを全処理方法で判定し、出力が一致することを確認して、速度とメモリを比べる
+
+    Description:
+        メモリは親プロセスのtracemallocのピークなので、parallelのワーカの分は含まない。
+    """
+    options = dict(min_access_count=2, overload_average_count=5, overload_limit_time_ms=300, storm_bin_sec=600)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "log.txt")
+        generate_log(filename, lines=lines)
+        print(f"## replay ({lines} lines)")
+        print("mode,seconds,lines_per_sec,peak_bytes")
+        expected = None
+        for name, func in MODES:
+            gc.collect()
+            t0 = time.perf_counter()
+            output = func(filename, options)
+            elapsed = time.perf_counter() - t0
+            if expected is None:
+                expected = output
+            assert output == expected, f"{name} : output differs from batch"
+
+            gc.collect()
+            tracemalloc.start()
+            func(filename, options)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name},{elapsed:.3f},{lines / elapsed:.0f},{peak}")
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) >= 2 else "memory"
+    if target == "memory":
+        bench_memory()
+    elif target == "replay":
+        check_fixtures()
+        bench_replay(int(sys.argv[2]) if len(sys.argv) >= 3 else 200000)